@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import logging
+import threading
+
+import condense
+import llm_memo
+import research_crew
+import scheduler
+
+DEFAULT_BATCH_SIZE = int(os.getenv('GROQ_BATCH_SIZE', '1'))
+# Input tokens allowed for all lead texts in one request, leaving room in
+# the 8k context for the instructions and the JSON answer
+BATCH_TOKEN_BUDGET = int(os.getenv('GROQ_BATCH_TOKEN_BUDGET', '4500'))
+ANSWER_TOKENS_PER_LEAD = 200
+
+BATCH_PROMPT = """
+    Below are texts scraped from several company websites, each introduced by a line "### Lead <id>".
+    For every lead, extract the following information from its text only. If the information is not available, write "Not found":
+
+    - Company Name
+    - Description
+    - Industry
+    - Number of Employees
+    - Revenue
+    - Address
+
+    {texts}
+
+    Provide the answer as a JSON array with exactly one object per lead. Each object must have a "lead_id" key with the lead's id plus the keys listed above. Return only the JSON array.
+    """
+
+_stats_lock = threading.Lock()
+stats = {
+    'batch_requests': 0, 'batch_leads': 0, 'batch_seconds': 0.0,
+    'single_requests': 0, 'single_leads': 0, 'single_seconds': 0.0,
+    'fallbacks': 0
+}
+
+class MalformedBatchResponse(Exception):
+    pass
+
+def _record(prefix, requests, leads, seconds):
+    with _stats_lock:
+        stats[f'{prefix}_requests'] += requests
+        stats[f'{prefix}_leads'] += leads
+        stats[f'{prefix}_seconds'] += seconds
+
+def batch_prompt_version():
+    # Computed on use because research_crew is still importing when this module loads
+    return llm_memo.prompt_version(BATCH_PROMPT, answer_tokens=ANSWER_TOKENS_PER_LEAD,
+                                   **research_crew.GROQ_PARAMS)
+
+def current_prompt_versions():
+    # A result from either prompt, as it is now, is good enough for the same
+    # input text
+    return (research_crew.EXTRACTION_PROMPT_VERSION, batch_prompt_version())
+
+def _memo_lookup(text):
+    # (result, version of the prompt that made it), or None
+    for version in current_prompt_versions():
+        cached = llm_memo.get(research_crew.GROQ_MODEL, version, text)
+        if cached is not None:
+            return cached, version
+    return None
+
+def _parse_batch_response(content, lead_ids):
+    start = content.find('[')
+    end = content.rfind(']')
+    if start == -1 or end <= start:
+        raise MalformedBatchResponse("no JSON array in response")
+    try:
+        items = json.loads(content[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise MalformedBatchResponse(f"invalid JSON: {e}")
+
+    results = {}
+    for item in items:
+        if not isinstance(item, dict) or 'lead_id' not in item:
+            raise MalformedBatchResponse("array item without a lead_id")
+        lead_id = str(item.pop('lead_id'))
+        if lead_id in lead_ids:
+            results[lead_id] = item
+
+    missing = set(lead_ids) - set(results)
+    if missing:
+        raise MalformedBatchResponse(f"no result for leads {sorted(missing)}")
+    return results
+
+def _request_batch(batch):
+    texts = '\n\n'.join(f"### Lead {lead_id}\n{text}" for lead_id, text in batch)
+    params = dict(research_crew.GROQ_PARAMS)
+    params['max_tokens'] = ANSWER_TOKENS_PER_LEAD * len(batch)
+    completion = scheduler.call(
+        'groq',
+        research_crew.get_groq_client().chat.completions.create,
+        model=research_crew.GROQ_MODEL,
+        messages=[
+            {
+                "role": "user",
+                "content": BATCH_PROMPT.format(texts=texts)
+            }
+        ],
+        **params
+    )
+    research_crew.record_usage(completion)
+    return completion.choices[0].message.content
+
+def _extract_single(lead_id, text):
+    started = time.monotonic()
+    extracted = research_crew.extract_info_with_groq(text)
+    _record('single', 1, 1, time.monotonic() - started)
+    return extracted, research_crew.EXTRACTION_PROMPT_VERSION
+
+def pack_batches(items, batch_size, token_budget=BATCH_TOKEN_BUDGET):
+    batches = []
+    current = []
+    used = 0
+    for lead_id, text in items:
+        cost = condense.estimate_tokens(text)
+        if current and (len(current) >= batch_size or used + cost > token_budget):
+            batches.append(current)
+            current = []
+            used = 0
+        current.append((lead_id, text))
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+def extract_info_batch(items, batch_size=DEFAULT_BATCH_SIZE):
+    # items is a list of (lead_id, text); returns {lead_id: (extracted_info,
+    # version of the prompt that produced it)}
+    results = {}
+    pending = []
+    for lead_id, text in items:
+        cached = _memo_lookup(text)
+        if cached is not None:
+            results[lead_id] = cached
+        else:
+            pending.append((lead_id, text))
+
+    for batch in pack_batches(pending, batch_size):
+        if len(batch) == 1:
+            lead_id, text = batch[0]
+            results[lead_id] = _extract_single(lead_id, text)
+            continue
+
+        started = time.monotonic()
+        try:
+            content = _request_batch(batch)
+            parsed = _parse_batch_response(content, {str(lead_id) for lead_id, _ in batch})
+        except Exception as e:
+            logging.warning(f"Batch extraction for {len(batch)} leads failed ({str(e)}), "
+                            f"falling back to per-lead requests")
+            with _stats_lock:
+                stats['fallbacks'] += 1
+            for lead_id, text in batch:
+                results[lead_id] = _extract_single(lead_id, text)
+            continue
+
+        _record('batch', 1, len(batch), time.monotonic() - started)
+        for lead_id, text in batch:
+            extracted = parsed[str(lead_id)]
+            llm_memo.put(research_crew.GROQ_MODEL, batch_prompt_version(), text, extracted)
+            results[lead_id] = extracted, batch_prompt_version()
+
+    return results
+
+def _leads_per_minute(leads, seconds):
+    return leads / seconds * 60 if seconds else 0.0
+
+def log_stats():
+    # Each fallback spent one request on a response that had to be thrown away
+    saved = stats['batch_leads'] - stats['batch_requests'] - stats['fallbacks']
+    logging.info(f"Batch extraction: {stats['batch_leads']} leads in {stats['batch_requests']} requests "
+                 f"({saved} requests saved, {stats['fallbacks']} fallbacks); "
+                 f"batched {_leads_per_minute(stats['batch_leads'], stats['batch_seconds']):.1f} leads/min vs "
+                 f"per-lead {_leads_per_minute(stats['single_leads'], stats['single_seconds']):.1f} leads/min")
+    return dict(stats, requests_saved=saved)
@@ -0,0 +1,144 @@
+"""Compare HTML text extraction backends on a saved page corpus.
+
+    python benchmarks/html_extract_bench.py CORPUS_DIR [--save URL_FILE] [--synthetic N] [--workers K]
+
+CORPUS_DIR holds one raw .html file per page. --save fetches the URLs in
+URL_FILE into it first; --synthetic writes N generated pages instead, for
+a run without network access. Every backend is timed against the original
+extractor (BeautifulSoup's html.parser over the whole page), and its
+output is compared with the original's.
+"""
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bs4 import BeautifulSoup
+import html_extract
+import http_client
+
+def original_extract(content):
+    # The scraper's text extraction before the pluggable extractor
+    soup = BeautifulSoup(content, 'html.parser')
+    return '\n'.join([tag.get_text() for tag in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li'])])
+
+def save_pages(url_file, corpus_dir):
+    with open(url_file, encoding='utf-8') as file:
+        urls = [line.strip() for line in file if line.strip()]
+    saved = 0
+    for url in urls:
+        try:
+            response = http_client.get(url, max_bytes=20 * 1024 * 1024)
+        except Exception as e:
+            print(f"  skipped {url}: {e}")
+            continue
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16] + '.html'
+        with open(os.path.join(corpus_dir, name), 'wb') as file:
+            file.write(response.content)
+        saved += 1
+    print(f"Saved {saved} of {len(urls)} pages to {corpus_dir}")
+
+def write_synthetic(corpus_dir, count, seed=0):
+    rng = random.Random(seed)
+    words = ['lead', 'agent', 'company', 'software', 'service', 'market', 'customer', 'growth', 'team',
+             'product', 'platform', 'data', 'cloud', 'support', 'partner', 'café', 'naïve', 'über']
+    def sentence(n):
+        return ' '.join(rng.choice(words) for _ in range(n)).capitalize() + '.'
+    for i in range(count):
+        blocks = []
+        # Page sizes from a few KB to a few MB, like real sites
+        for _ in range(int(rng.lognormvariate(5, 1.2)) + 5):
+            kind = rng.random()
+            if kind < 0.4:
+                blocks.append(f"<p class='c{rng.randint(0, 9)}'>{sentence(40)} <a href='/x'>{sentence(3)}</a></p>")
+            elif kind < 0.55:
+                level = rng.randint(1, 6)
+                blocks.append(f"<h{level}>{sentence(5)}</h{level}>")
+            elif kind < 0.75:
+                items = ''.join(f"<li><span>{sentence(8)}</span></li>" for _ in range(rng.randint(2, 8)))
+                blocks.append(f"<ul>{items}</ul>")
+            elif kind < 0.9:
+                blocks.append(f"<div><div><span>{sentence(20)}</span></div></div>")
+            else:
+                blocks.append(f"<script>var x = {rng.random()}; // {sentence(30)}</script>")
+        page = f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{sentence(4)}</title></head>" \
+               f"<body>{''.join(blocks)}</body></html>"
+        with open(os.path.join(corpus_dir, f'synthetic_{i:05d}.html'), 'w', encoding='utf-8') as file:
+            file.write(page)
+    print(f"Wrote {count} synthetic pages to {corpus_dir}")
+
+def load_corpus(corpus_dir):
+    pages = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.endswith(('.html', '.htm')):
+            with open(os.path.join(corpus_dir, name), 'rb') as file:
+                pages.append(file.read())
+    return pages
+
+def _normalized(text):
+    return ' '.join(text.split())
+
+def time_extractor(name, extract, pages, reference):
+    started = time.perf_counter()
+    texts = [extract(page) for page in pages]
+    elapsed = time.perf_counter() - started
+    matching = sum(1 for text, expected in zip(texts, reference) if _normalized(text) == _normalized(expected))
+    report(name, pages, elapsed, f"{matching}/{len(pages)} match original")
+    return elapsed
+
+def time_pool(backend, pages, workers):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        # Start the workers before timing
+        list(pool.map(html_extract.extract_text, [b'<p></p>'] * workers, [backend] * workers))
+        started = time.perf_counter()
+        list(pool.map(html_extract.extract_text, pages, [backend] * len(pages), chunksize=4))
+        elapsed = time.perf_counter() - started
+    report(f"{backend} x{workers} processes", pages, elapsed)
+    return elapsed
+
+def report(name, pages, elapsed, note=''):
+    size = sum(len(page) for page in pages) / 1024 / 1024
+    print(f"  {name:<28} {elapsed:8.2f}s {len(pages) / elapsed:9.1f} pages/s {size / elapsed:8.2f} MB/s  {note}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML text extraction backends")
+    parser.add_argument('corpus', help="Directory of saved .html pages")
+    parser.add_argument('--save', metavar='URL_FILE', help="Fetch these URLs into the corpus first")
+    parser.add_argument('--synthetic', type=int, metavar='N', help="Write N generated pages into the corpus first")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Processes for the pool run")
+    args = parser.parse_args()
+
+    os.makedirs(args.corpus, exist_ok=True)
+    if args.save:
+        save_pages(args.save, args.corpus)
+    if args.synthetic:
+        write_synthetic(args.corpus, args.synthetic)
+    pages = load_corpus(args.corpus)
+    if not pages:
+        sys.exit(f"No .html pages in {args.corpus}")
+
+    size = sum(len(page) for page in pages)
+    capped = [page[:html_extract.MAX_HTML_BYTES] for page in pages]
+    print(f"{len(pages)} pages, {size / 1024 / 1024:.1f} MB "
+          f"({sum(1 for page in pages if len(page) > html_extract.MAX_HTML_BYTES)} over the "
+          f"{html_extract.MAX_HTML_BYTES} byte cap)")
+
+    reference = [original_extract(page) for page in pages]
+    baseline = time_extractor('original (html.parser)', original_extract, pages, reference)
+    for backend in html_extract.available_backends():
+        elapsed = time_extractor(backend, lambda page: html_extract.extract_text(page, backend), pages, reference)
+        print(f"  {'':<28} {baseline / elapsed:.1f}x the original")
+    best = html_extract.backend_name('auto')
+    time_extractor(f'{best}, capped', lambda page: html_extract.extract_text(page, best), capped, reference)
+    if args.workers > 1:
+        elapsed = time_pool(best, pages, args.workers)
+        print(f"  {'':<28} {baseline / elapsed:.1f}x the original")
+
+if __name__ == '__main__':
+    main()
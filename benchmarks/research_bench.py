@@ -0,0 +1,236 @@
+"""End-to-end throughput benchmark against local stub servers.
+
+    python benchmarks/research_bench.py [--sizes 1000,10000,100000] [--concurrency N] [--batch K]
+                                        [--budget B] [--seeds S] [--corpus DIR] [--results FILE]
+                                        [--groq-latency S] [--groq-errors R] [--groq-429 R] ...
+
+For every size a synthetic database of that many 'new' leads is built. The
+benchmark then researches them (conduct_research), and runs find-similar
+for --seeds seed URLs. Groq, Apollo, Exa and the lead websites are all
+served by benchmarks/stub_servers.py, so no API quota or network is used.
+
+Each size runs in a fresh subprocess, so module settings read from the
+environment apply and peak RSS belongs to that run alone. Every lead site
+is on the stub's host, so the per-host scrape delay is turned off, the
+connection cap is raised as if leads were on separate hosts, and the API
+rate limits are lifted unless --real-rates is given.
+
+The report shows leads/min, peak RSS and per-stage time. Results are
+appended to --results as JSON lines tagged with the git commit, and each
+run is compared with the last saved run of the same configuration, so
+regressions show up between versions.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+import contextlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+import stub_servers
+
+DEFAULT_RESULTS = os.path.join(BENCH_DIR, 'results', 'research.jsonl')
+STAGES = ('scrape', 'condense', 'extract', 'contacts', 'finish', 'find_similar', 'save_similar')
+PROVIDERS = ('scrape', 'groq', 'apollo', 'exa')
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = 'unknown'
+    return revision
+
+def build_database(size, base_url, rng):
+    # Leads as find-similar leaves them: named, scored and waiting for research
+    import db
+    conn = db.connect()
+    started = time.monotonic()
+    rows = ((f'Company {i}', f'{base_url}/site/lead-{i}.html', f'{base_url}/site/seed-{i // 10}.html', 'new',
+             round(rng.uniform(0.5, 0.95), 4)) for i in range(size))
+    conn.executemany('INSERT INTO leads (company_name, website, source_url, status, score) VALUES (?, ?, ?, ?, ?)',
+                     rows)
+    conn.commit()
+    return time.monotonic() - started
+
+def run_child(options):
+    # Runs inside the subprocess, with the environment already pointing at the stubs
+    import db
+    import metrics
+    import research_crew
+    import research_tasks
+    import lead_agent
+
+    rng = random.Random(options['size'])
+    result = {'build_seconds': build_database(options['size'], options['base_url'], rng)}
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.monotonic()
+        research_crew.conduct_research(options['concurrency'], options['batch_size'], options['budget'])
+        result['research_seconds'] = time.monotonic() - started
+        result['tasks'] = research_tasks.summary()
+
+        seeds = [f"{options['base_url']}/site/seed-new-{i}.html" for i in range(options['seeds'])]
+        result['find_similar_seeds'] = len(seeds)
+        if seeds:
+            lead_agent.initialize_exa()
+            conn = db.connect()
+            conn.executemany('INSERT OR IGNORE INTO seed_urls (url) VALUES (?)', [(url,) for url in seeds])
+            conn.commit()
+            leads_before = conn.execute('SELECT COUNT(*) FROM leads').fetchone()[0]
+            started = time.monotonic()
+            lead_agent.find_similar_bulk(seeds, options['find_similar_workers'])
+            result['find_similar_seconds'] = time.monotonic() - started
+            result['find_similar_leads'] = conn.execute('SELECT COUNT(*) FROM leads').fetchone()[0] - leads_before
+
+    db.flush()
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_rss_mb'] = peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    result['metrics'] = metrics.snapshot()
+    with open(options['output'], 'w', encoding='utf-8') as file:
+        json.dump(result, file)
+
+def child_environment(server, work_dir, args, size):
+    env = dict(os.environ)
+    env.update(server.environment())
+    env.update({
+        'LEAD_AGENT_DB': os.path.join(work_dir, f'leads_{size}.db'),
+        'SCRAPE_CACHE_PATH': os.path.join(work_dir, f'scrape_cache_{size}.db'),
+        'SCRAPE_HOST_DELAY': '0',
+        'HTTP_MAX_CONNECTIONS_PER_HOST': str(max(4, args.concurrency * 4)),
+        'METRICS_SNAPSHOT_INTERVAL': '0',
+        'LEAD_TRACE': '0',
+        'PYTHONPATH': REPO_DIR,
+    })
+    if not args.real_rates:
+        env.update({'EXA_RATE_PER_MIN': '1000000', 'GROQ_RATE_PER_MIN': '1000000', 'APOLLO_RATE_PER_MIN': '1000000'})
+    return env
+
+def run_size(server, work_dir, args, size):
+    output = os.path.join(work_dir, f'result_{size}.json')
+    options = {'size': size, 'base_url': server.base_url, 'concurrency': args.concurrency,
+               'batch_size': args.batch, 'budget': args.budget, 'seeds': args.seeds,
+               'find_similar_workers': args.find_similar_workers, 'output': output}
+    # The child's working directory is the scratch directory, so its log file lands there
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--child', json.dumps(options)],
+                   cwd=work_dir, env=child_environment(server, work_dir, args, size), check=True)
+    with open(output, encoding='utf-8') as file:
+        return json.load(file)
+
+def summarize(size, run, args, revision):
+    histograms = run['metrics']['histograms']
+    counters = run['metrics']['counters']
+    researched = run['tasks'].get('done', 0)
+    record = {
+        'revision': revision,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'size': size, 'concurrency': args.concurrency, 'batch_size': args.batch, 'budget': args.budget,
+                   'seeds': args.seeds, 'stubs': stub_servers.config_from_arguments(args)},
+        'leads_researched': researched,
+        'tasks': run['tasks'],
+        'research_seconds': round(run['research_seconds'], 3),
+        'leads_per_min': round(researched / run['research_seconds'] * 60, 1) if run['research_seconds'] else 0.0,
+        'build_seconds': round(run['build_seconds'], 3),
+        'peak_rss_mb': round(run['peak_rss_mb'], 1),
+        'stages': {stage: histograms[f'stage_seconds{{stage="{stage}"}}'] for stage in STAGES
+                   if f'stage_seconds{{stage="{stage}"}}' in histograms},
+        'providers': {provider: dict(histograms.get(f'provider_request_seconds{{provider="{provider}"}}', {}),
+                                     retries=counters.get(f'provider_retries_total{{provider="{provider}"}}', 0),
+                                     errors=counters.get(f'provider_errors_total{{provider="{provider}"}}', 0))
+                      for provider in PROVIDERS},
+    }
+    if run.get('find_similar_seeds'):
+        record['find_similar_seeds_per_min'] = round(run['find_similar_seeds'] / run['find_similar_seconds'] * 60, 1)
+        record['find_similar_leads'] = run['find_similar_leads']
+    return record
+
+def previous_result(path, config):
+    previous = None
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get('config') == config:
+                    previous = record
+    return previous
+
+def print_report(record, previous):
+    config = record['config']
+    print(f"\n{config['size']} leads: {record['leads_researched']} researched in {record['research_seconds']:.1f}s, "
+          f"{record['leads_per_min']:.0f} leads/min, peak RSS {record['peak_rss_mb']:.0f} MB "
+          f"(tasks: {', '.join(f'{state} {count}' for state, count in sorted(record['tasks'].items()))})")
+    if 'find_similar_seeds_per_min' in record:
+        print(f"  find-similar: {record['find_similar_seeds_per_min']:.0f} seeds/min, "
+              f"{record['find_similar_leads']} leads added")
+    print(f"  {'stage':<14} {'count':>7} {'total s':>9} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for stage, values in record['stages'].items():
+        print(f"  {stage:<14} {values['count']:>7} {values['sum']:>9.2f} {values['p50']:>8.3f} "
+              f"{values['p95']:>8.3f} {values['p99']:>8.3f}")
+    for provider, values in record['providers'].items():
+        if values.get('count'):
+            print(f"  {provider + ' calls':<14} {values['count']:>7} {values['sum']:>9.2f} {values['p50']:>8.3f} "
+                  f"{values['p95']:>8.3f} {values['p99']:>8.3f}  retries {values['retries']}, "
+                  f"errors {values['errors']}")
+    if previous:
+        change = (record['leads_per_min'] - previous['leads_per_min']) / previous['leads_per_min'] * 100 \
+            if previous['leads_per_min'] else 0.0
+        print(f"  vs {previous['revision']} ({previous['time']}): {previous['leads_per_min']:.0f} leads/min "
+              f"({change:+.1f}%), peak RSS {previous['peak_rss_mb']:.0f} MB")
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == '--child':
+        run_child(json.loads(sys.argv[2]))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark research and find-similar against local stub servers")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="Comma-separated lead counts")
+    parser.add_argument('--concurrency', type=int, default=8, help="Research workers per stage")
+    parser.add_argument('--batch', type=int, default=1, help="Leads per Groq request")
+    parser.add_argument('--budget', type=int, help="Research at most this many leads per size")
+    parser.add_argument('--seeds', type=int, default=50, help="Seed URLs for the find-similar run")
+    parser.add_argument('--find-similar-workers', type=int, default=8)
+    parser.add_argument('--corpus', help="Directory of recorded .html pages to serve as lead websites")
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help="JSON lines file the results are appended to")
+    parser.add_argument('--real-rates', action='store_true', help="Keep the API rate limits from the environment")
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch databases and logs")
+    stub_servers.add_service_arguments(parser)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    revision = git_revision()
+    server = stub_servers.StubServer(config=stub_servers.config_from_arguments(args), corpus_dir=args.corpus).start()
+    work_dir = tempfile.mkdtemp(prefix='lead_agent_bench_')
+    print(f"Stub servers on {server.base_url}, scratch files in {work_dir}, revision {revision}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    try:
+        for size in sizes:
+            before = {service: dict(counts) for service, counts in server.counts.items()}
+            record = summarize(size, run_size(server, work_dir, args, size), args, revision)
+            record['stub_requests'] = {service: {key: value - before[service][key] for key, value in counts.items()}
+                                       for service, counts in server.counts.items()}
+            previous = previous_result(args.results, record['config'])
+            print_report(record, previous)
+            with open(args.results, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(record) + '\n')
+    finally:
+        server.stop()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"\nResults appended to {args.results}")
+
+if __name__ == '__main__':
+    main()
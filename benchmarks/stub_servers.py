@@ -0,0 +1,280 @@
+"""Local stand-ins for the Groq, Apollo and Exa APIs and for lead websites.
+
+    python benchmarks/stub_servers.py [--port P] [--corpus DIR] [--groq-latency S] [--groq-errors R] ...
+
+One HTTP server answers every service:
+
+    POST /openai/v1/chat/completions   Groq chat completions (GROQ_BASE_URL)
+    POST /v1/mixed_people/search       Apollo people search (APOLLO_BASE_URL)
+    POST /findSimilar                  Exa find-similar with contents (EXA_BASE_URL)
+    GET  /site/<name>                  lead websites
+
+Each service has its own latency, jitter, error rate (HTTP 500) and rate
+limit rate (HTTP 429 with Retry-After). Answers are derived from the
+request, so repeated runs see the same data. Site pages come from a
+directory of recorded .html files when one is given, otherwise they are
+generated; either way every page gets a heading of its own, so no two
+leads share a page.
+"""
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVICES = ('groq', 'apollo', 'exa', 'site')
+
+DEFAULT_CONFIG = {
+    'groq': {'latency': 0.05, 'jitter': 0.02, 'error_rate': 0.0, 'rate_limit_rate': 0.0},
+    'apollo': {'latency': 0.02, 'jitter': 0.01, 'error_rate': 0.0, 'rate_limit_rate': 0.0},
+    'exa': {'latency': 0.05, 'jitter': 0.02, 'error_rate': 0.0, 'rate_limit_rate': 0.0},
+    'site': {'latency': 0.01, 'jitter': 0.01, 'error_rate': 0.0, 'rate_limit_rate': 0.0},
+}
+
+WORDS = ['lead', 'agent', 'company', 'software', 'service', 'market', 'customer', 'growth', 'team', 'product',
+         'platform', 'data', 'cloud', 'support', 'partner', 'logistics', 'retail', 'health', 'finance', 'energy',
+         'design', 'studio', 'consulting', 'manufacturing', 'analytics', 'security', 'mobile', 'travel', 'food',
+         'education', 'media', 'network', 'solutions', 'global', 'local', 'premium', 'custom', 'digital']
+INDUSTRIES = ['Software', 'Retail', 'Healthcare', 'Finance', 'Energy', 'Logistics', 'Education', 'Media']
+TITLES = ['CEO', 'CTO', 'Head of Sales', 'Marketing Director', 'Operations Manager']
+
+def _rng(key):
+    return random.Random(zlib.crc32(key.encode('utf-8')))
+
+def _sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+def company_info(key):
+    rng = _rng(key)
+    return {
+        'Company Name': f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS).capitalize()} Inc",
+        'Description': _sentence(rng, 15),
+        'Industry': rng.choice(INDUSTRIES),
+        'Number of Employees': str(rng.choice([5, 20, 80, 250, 1200, 8000])),
+        'Revenue': f"${rng.choice([0.5, 2, 15, 90, 400])}M",
+        'Address': f"{rng.randint(1, 999)} {rng.choice(WORDS).capitalize()} Street",
+    }
+
+def synthetic_page(name):
+    rng = _rng(name)
+    blocks = [f"<h1>{_sentence(rng, 4)}</h1>"]
+    for _ in range(rng.randint(10, 60)):
+        kind = rng.random()
+        if kind < 0.5:
+            blocks.append(f"<p>{_sentence(rng, 30)} <a href='/site/x'>{_sentence(rng, 2)}</a></p>")
+        elif kind < 0.7:
+            level = rng.randint(2, 4)
+            blocks.append(f"<h{level}>{_sentence(rng, 5)}</h{level}>")
+        elif kind < 0.9:
+            blocks.append('<ul>' + ''.join(f"<li>{_sentence(rng, 8)}</li>" for _ in range(rng.randint(2, 6))) + '</ul>')
+        else:
+            blocks.append(f"<script>var x = {rng.random()};</script><div><span>{_sentence(rng, 10)}</span></div>")
+    return f"<!DOCTYPE html><html><head><meta charset='utf-8'></head><body>{''.join(blocks)}</body></html>"
+
+def load_corpus(corpus_dir):
+    pages = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.endswith(('.html', '.htm')):
+            with open(os.path.join(corpus_dir, name), 'rb') as file:
+                pages.append(file.read())
+    return pages
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, as the real APIs allow, so the client's connection pool is exercised
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self, service):
+        # Latency first, then maybe a failure. Returns True when the request failed.
+        config = self.server.config[service]
+        self.server.count(service, 'requests')
+        delay = config['latency'] + random.uniform(0, config['jitter'])
+        if delay > 0:
+            time.sleep(delay)
+        roll = random.random()
+        if roll < config['rate_limit_rate']:
+            self.server.count(service, 'rate_limited')
+            self._send(429, {'error': {'message': 'Rate limit exceeded'}}, headers={'Retry-After': '1'})
+            return True
+        if roll < config['rate_limit_rate'] + config['error_rate']:
+            self.server.count(service, 'errors')
+            self._send(500, {'error': {'message': 'Internal server error'}})
+            return True
+        return False
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        body = self._body()
+        if path == '/openai/v1/chat/completions':
+            if not self._simulate('groq'):
+                self._send(200, self.server.groq_completion(body))
+        elif path == '/v1/mixed_people/search':
+            if not self._simulate('apollo'):
+                self._send(200, self.server.apollo_people(body))
+        elif path == '/findSimilar':
+            if not self._simulate('exa'):
+                self._send(200, self.server.exa_similar(body))
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path.startswith('/site/'):
+            if not self._simulate('site'):
+                self._send(200, self.server.site_page(path[len('/site/'):]), 'text/html; charset=utf-8')
+        else:
+            self._send(404, {'error': 'not found'})
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, config=None, corpus_dir=None):
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self.config = {service: dict(DEFAULT_CONFIG[service], **((config or {}).get(service) or {}))
+                       for service in SERVICES}
+        self.corpus = load_corpus(corpus_dir) if corpus_dir else []
+        self.counts = {service: {'requests': 0, 'errors': 0, 'rate_limited': 0} for service in SERVICES}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def environment(self):
+        # Settings that point Lead Agent's clients at this server
+        return {
+            'GROQ_BASE_URL': self.base_url,
+            'APOLLO_BASE_URL': self.base_url,
+            'EXA_BASE_URL': self.base_url,
+            'GROQ_API_KEY': 'stub',
+            'APOLLO_API_KEY': 'stub',
+            'EXA_API_KEY': 'stub',
+        }
+
+    def count(self, service, key):
+        with self._lock:
+            self.counts[service][key] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='stub-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def groq_completion(self, body):
+        prompt = ''.join(message.get('content', '') for message in body.get('messages', []))
+        lead_ids = re.findall(r'### Lead (\d+)', prompt)
+        if lead_ids:
+            # Batch prompt: one object per lead, keyed by lead_id
+            sections = re.split(r'### Lead \d+', prompt)[1:]
+            content = json.dumps([dict(company_info(section[:2000]), lead_id=int(lead_id))
+                                  for lead_id, section in zip(lead_ids, sections)])
+        else:
+            content = json.dumps(company_info(prompt[-2000:]))
+        return {
+            'id': f'chatcmpl-{zlib.crc32(prompt.encode("utf-8"))}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(content) // 4,
+                      'total_tokens': (len(prompt) + len(content)) // 4},
+        }
+
+    def apollo_people(self, body):
+        key = body.get('q_organization_name') or body.get('q_organization_domains') or ''
+        rng = _rng(key)
+        people = []
+        for _ in range(rng.randint(0, min(5, body.get('per_page', 5)))):
+            first, last = rng.choice(WORDS).capitalize(), rng.choice(WORDS).capitalize()
+            people.append({'first_name': first, 'last_name': last,
+                           'email': f'{first.lower()}.{last.lower()}@example.com',
+                           'phone_number': f'+1 555 {rng.randint(1000000, 9999999)}', 'title': rng.choice(TITLES)})
+        return {'people': people, 'pagination': {'page': 1, 'per_page': body.get('per_page', 5)}}
+
+    def exa_similar(self, body):
+        seed = body.get('url', '')
+        rng = _rng(seed)
+        results = []
+        for i in range(body.get('numResults', 10)):
+            name = f'{zlib.crc32(seed.encode("utf-8")):08x}-{i}.html'
+            results.append({
+                'id': name,
+                'url': f'{self.base_url}/site/{name}',
+                'title': f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS).capitalize()}",
+                'score': round(rng.uniform(0.5, 0.95), 4),
+                'text': ' '.join(_sentence(rng, 20) for _ in range(5)),
+                'summary': _sentence(rng, 25),
+            })
+        return {'results': results, 'resolvedSearchType': 'neural'}
+
+    def site_page(self, name):
+        if not self.corpus:
+            return synthetic_page(name).encode('utf-8')
+        # Recorded pages are shared between leads, so each gets its own heading
+        page = self.corpus[zlib.crc32(name.encode('utf-8')) % len(self.corpus)]
+        return f"<h1>Site {name}</h1>".encode('utf-8') + page
+
+def add_service_arguments(parser):
+    for service in SERVICES:
+        defaults = DEFAULT_CONFIG[service]
+        parser.add_argument(f'--{service}-latency', type=float, default=defaults['latency'],
+                            help=f"Seconds each {service} request takes (default {defaults['latency']})")
+        parser.add_argument(f'--{service}-jitter', type=float, default=defaults['jitter'],
+                            help=f"Extra random latency for {service} requests, up to this many seconds")
+        parser.add_argument(f'--{service}-errors', type=float, default=defaults['error_rate'],
+                            help=f"Share of {service} requests answered with HTTP 500")
+        parser.add_argument(f'--{service}-429', type=float, default=defaults['rate_limit_rate'],
+                            dest=f'{service}_rate_limits', help=f"Share of {service} requests answered with HTTP 429")
+
+def config_from_arguments(args):
+    return {service: {'latency': getattr(args, f'{service}_latency'), 'jitter': getattr(args, f'{service}_jitter'),
+                      'error_rate': getattr(args, f'{service}_errors'),
+                      'rate_limit_rate': getattr(args, f'{service}_rate_limits')}
+            for service in SERVICES}
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for Groq, Apollo, Exa and lead websites")
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--corpus', help="Directory of recorded .html pages to serve as lead websites")
+    add_service_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer(args.port, config_from_arguments(args), args.corpus)
+    print(f"Stub servers listening on {server.base_url}. Point Lead Agent at them with:")
+    for name, value in server.environment().items():
+        print(f"  export {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import os
+import zlib
+import time
+import random
+import logging
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Texts shorter than this aren't worth a compression frame
+MIN_COMPRESS_BYTES = 64
+# Blobs compressed without a dictionary before one is trained from them
+DICT_TRAIN_SAMPLES = int(os.getenv('BLOB_DICT_TRAIN_SAMPLES', '200'))
+ZSTD_DICT_SIZE = 112 * 1024
+# zlib can only look back 32KB, so a larger preset dictionary is wasted
+ZLIB_DICT_SIZE = 32 * 1024
+
+_dictionaries = {}
+
+def default_codec():
+    return 'zstd' if zstandard is not None else 'zlib'
+
+def _load_dictionary(conn, dict_id):
+    if dict_id is None:
+        return None
+    if dict_id not in _dictionaries:
+        row = conn.execute('SELECT data FROM blob_dicts WHERE id = ?', (dict_id,)).fetchone()
+        _dictionaries[dict_id] = row[0] if row else None
+    return _dictionaries[dict_id]
+
+def current_dictionary(conn, codec):
+    row = conn.execute('SELECT id FROM blob_dicts WHERE codec = ? ORDER BY id DESC LIMIT 1', (codec,)).fetchone()
+    return row[0] if row else None
+
+def compress(data, codec, dictionary=None):
+    if codec == 'raw':
+        return data
+    if codec == 'zstd':
+        if dictionary:
+            compressor = zstandard.ZstdCompressor(level=9, dict_data=zstandard.ZstdCompressionDict(dictionary))
+        else:
+            compressor = zstandard.ZstdCompressor(level=9)
+        return compressor.compress(data)
+    if dictionary:
+        compressor = zlib.compressobj(9, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(9)
+    return compressor.compress(data) + compressor.flush()
+
+def decompress(data, codec, dictionary=None):
+    if codec == 'raw':
+        return data
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("This database holds zstd-compressed text; install the zstandard package to read it")
+        if dictionary:
+            decompressor = zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(dictionary))
+        else:
+            decompressor = zstandard.ZstdDecompressor()
+        return decompressor.decompress(data)
+    if dictionary:
+        decompressor = zlib.decompressobj(zdict=dictionary)
+    else:
+        decompressor = zlib.decompressobj()
+    return decompressor.decompress(data) + decompressor.flush()
+
+def put(conn, text):
+    # Stores text and returns its blob id (None for empty text). Runs inside
+    # the caller's transaction.
+    if not text:
+        return None
+    raw = text.encode('utf-8')
+    codec = default_codec() if len(raw) >= MIN_COMPRESS_BYTES else 'raw'
+    dict_id = current_dictionary(conn, codec) if codec != 'raw' else None
+    data = compress(raw, codec, _load_dictionary(conn, dict_id))
+    cursor = conn.execute('INSERT INTO blobs (codec, dict_id, raw_size, data) VALUES (?, ?, ?, ?)',
+                          (codec, dict_id, len(raw), data))
+    return cursor.lastrowid
+
+def get(conn, blob_id):
+    # Decompresses on demand; listing and scan queries never call this
+    if blob_id is None:
+        return None
+    row = conn.execute('SELECT codec, dict_id, data FROM blobs WHERE id = ?', (blob_id,)).fetchone()
+    if row is None:
+        return None
+    codec, dict_id, data = row
+    return decompress(data, codec, _load_dictionary(conn, dict_id)).decode('utf-8')
+
+def _zlib_dictionary(samples):
+    # Passages repeated across sites (menus, legal lines, common phrases)
+    # make the best preset dictionary. zlib matches nearby bytes more cheaply,
+    # so the most common passages go last.
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(line.strip() for line in sample.decode('utf-8', 'ignore').split('\n') if len(line.strip()) > 8))
+    common = [line for line, count in counts.most_common() if count > 1]
+    dictionary = b''
+    for line in common:
+        encoded = line.encode('utf-8') + b'\n'
+        if len(dictionary) + len(encoded) > ZLIB_DICT_SIZE:
+            break
+        dictionary = encoded + dictionary
+    return dictionary
+
+def train_dictionary(conn, samples, codec=None):
+    codec = codec or default_codec()
+    samples = [sample for sample in samples if sample]
+    if not samples:
+        return None
+    try:
+        if codec == 'zstd':
+            dictionary = zstandard.train_dictionary(ZSTD_DICT_SIZE, samples).as_bytes()
+        else:
+            dictionary = _zlib_dictionary(samples)
+    except Exception as e:
+        logging.warning(f"Could not train a {codec} dictionary: {str(e)}")
+        return None
+    if not dictionary:
+        return None
+    cursor = conn.execute('INSERT INTO blob_dicts (codec, data, created_at) VALUES (?, ?, ?)',
+                          (codec, dictionary, time.time()))
+    logging.info(f"Trained a {len(dictionary)} byte {codec} dictionary from {len(samples)} samples")
+    return cursor.lastrowid
+
+def maybe_train_dictionary(conn):
+    # Once enough text has been stored without a dictionary, train one from
+    # it. Runs on every seed save, so after too few samples or a failed
+    # training it waits until DICT_TRAIN_SAMPLES more blobs are stored.
+    codec = default_codec()
+    if current_dictionary(conn, codec) is not None:
+        return None
+    newest = conn.execute('SELECT MAX(id) FROM blobs').fetchone()[0] or 0
+    row = conn.execute('SELECT last_blob_id FROM blob_dict_attempts WHERE codec = ?', (codec,)).fetchone()
+    if newest - (row[0] if row else 0) < DICT_TRAIN_SAMPLES:
+        return None
+
+    ids = [row[0] for row in conn.execute(
+        'SELECT id FROM blobs WHERE codec = ? AND dict_id IS NULL ORDER BY id DESC LIMIT ?',
+        (codec, DICT_TRAIN_SAMPLES)).fetchall()]
+    dict_id = None
+    if len(ids) >= DICT_TRAIN_SAMPLES:
+        samples = [get(conn, blob_id).encode('utf-8') for blob_id in random.sample(ids, len(ids))]
+        dict_id = train_dictionary(conn, samples, codec)
+    if dict_id is None:
+        conn.execute('INSERT OR REPLACE INTO blob_dict_attempts (codec, last_blob_id, attempted_at) VALUES (?, ?, ?)',
+                     (codec, newest, time.time()))
+    return dict_id
+
+def stats(conn):
+    row = conn.execute('SELECT COUNT(*), COALESCE(SUM(raw_size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM blobs').fetchone()
+    blobs, raw_bytes, stored_bytes = row
+    return {
+        'blobs': blobs,
+        'raw_bytes': raw_bytes,
+        'stored_bytes': stored_bytes,
+        'ratio': raw_bytes / stored_bytes if stored_bytes else 0.0
+    }
@@ -0,0 +1,105 @@
+import os
+import re
+
+# Rough budget for the page text in the extraction prompt. llama3-8b-8192 has
+# an 8k window, and the prompt wrapper plus the 1000-token answer need room too.
+DEFAULT_TOKEN_BUDGET = int(os.getenv('GROQ_TOKEN_BUDGET', '3000'))
+
+# Llama tokenizers average roughly four characters per token on English text
+CHARS_PER_TOKEN = 4
+
+MAX_PASSAGE_CHARS = 600
+MIN_PASSAGE_WORDS = 3
+
+BOILERPLATE_PATTERNS = re.compile(
+    r'cookie|copyright|©|all rights reserved|privacy policy|terms of (use|service)|'
+    r'sign in|log in|subscribe|newsletter|add to cart|shopping cart|skip to content|'
+    r'follow us|back to top|powered by',
+    re.IGNORECASE
+)
+
+# Hints for each field the extraction prompt asks for
+FIELD_PATTERNS = {
+    'name': (re.compile(r'about us|who we are|we are|our company|founded|established|since \d{4}|®|™', re.IGNORECASE), 2.0),
+    'description': (re.compile(r'\bwe (offer|provide|specialize|help|make|build|sell|design)|our (mission|products|services)', re.IGNORECASE), 2.0),
+    'industry': (re.compile(r'industry|services|solutions|products|manufactur|retail|consulting|software|agency|boutique|clinic', re.IGNORECASE), 1.0),
+    'address': (re.compile(r'\d+\s+\w+(\s\w+)?\s(street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|suite|ste)\b|'
+                           r'\b[A-Z]{2}\s\d{5}\b|headquarter|located (in|at)|address', re.IGNORECASE), 3.0),
+    'revenue': (re.compile(r'revenue|annual sales|\$\s?\d+(\.\d+)?\s?(k|m|b|million|billion)\b', re.IGNORECASE), 3.0),
+    'employees': (re.compile(r'employees|staff|team of|\d+\s+people|headcount|workforce', re.IGNORECASE), 3.0),
+}
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def split_passages(text):
+    passages = []
+    for line in text.split('\n'):
+        line = ' '.join(line.split())
+        if not line:
+            continue
+        if len(line) <= MAX_PASSAGE_CHARS:
+            passages.append(line)
+            continue
+        # Long blocks (or text scraped before passages were newline separated)
+        # are split on sentence boundaries so they can be ranked individually
+        for sentence in re.split(r'(?<=[.!?])\s+', line):
+            while len(sentence) > MAX_PASSAGE_CHARS:
+                cut = sentence.rfind(' ', 0, MAX_PASSAGE_CHARS)
+                if cut <= 0:
+                    cut = MAX_PASSAGE_CHARS
+                passages.append(sentence[:cut])
+                sentence = sentence[cut:].strip()
+            if sentence:
+                passages.append(sentence)
+    return passages
+
+def is_boilerplate(passage):
+    if len(passage) < 160 and BOILERPLATE_PATTERNS.search(passage):
+        return True
+    # Lone menu entries and buttons ("Home", "Shop Now") carry nothing useful
+    return len(passage.split()) < MIN_PASSAGE_WORDS and not re.search(r'\d', passage)
+
+def score_passage(passage, position, total):
+    score = 0.0
+    for pattern, weight in FIELD_PATTERNS.values():
+        if pattern.search(passage):
+            score += weight
+    # Sites usually introduce themselves near the top of the page
+    score += 0.5 * (1 - position / max(total, 1))
+    return score
+
+def condense(text, token_budget=DEFAULT_TOKEN_BUDGET):
+    tokens_in = estimate_tokens(text)
+    stats = {'tokens_in': tokens_in, 'tokens_out': tokens_in, 'tokens_saved': 0}
+    if not text:
+        return text, stats
+
+    seen = set()
+    passages = []
+    for passage in split_passages(text):
+        # Navigation and footer text repeats across the page; keep the first copy
+        key = passage.lower()
+        if key in seen or is_boilerplate(passage):
+            continue
+        seen.add(key)
+        passages.append(passage)
+
+    ranked = sorted(range(len(passages)),
+                    key=lambda i: score_passage(passages[i], i, len(passages)),
+                    reverse=True)
+
+    selected = []
+    used = 0
+    for i in ranked:
+        cost = estimate_tokens(passages[i]) + 1
+        if used + cost > token_budget:
+            continue
+        selected.append(i)
+        used += cost
+
+    # Restore page order so the model sees the passages in context
+    condensed = '\n'.join(passages[i] for i in sorted(selected))
+    stats['tokens_out'] = estimate_tokens(condensed)
+    stats['tokens_saved'] = max(0, tokens_in - stats['tokens_out'])
+    return condensed, stats
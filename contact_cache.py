@@ -0,0 +1,135 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+import db
+import metrics
+
+# Seconds an organization's contacts are reused before Apollo is searched again
+CONTACT_TTL = float(os.getenv('CONTACT_CACHE_TTL', str(14 * 24 * 3600)))
+
+ORG_SUFFIXES = {'inc', 'incorporated', 'llc', 'ltd', 'limited', 'co', 'corp', 'corporation',
+                'company', 'gmbh', 'plc', 'lp', 'llp'}
+
+_lock = threading.Lock()
+_in_flight = {}
+stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+def _record(result):
+    stats[result] += 1
+    # A search coalesced with one in flight costs no Apollo call either
+    metrics.inc('cache_requests_total', cache='contacts', result='miss' if result == 'misses' else 'hit')
+
+def normalize_org_name(name):
+    words = re.sub(r'[^a-z0-9 ]+', ' ', (name or '').lower()).split()
+    while words and words[-1] in ORG_SUFFIXES:
+        words.pop()
+    return ' '.join(words)
+
+def normalize_domain(website):
+    host = (urlsplit(website if '//' in website else f'//{website}').hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+def org_key(company_name, website=None):
+    # The domain tells apart different companies that share a name, so the
+    # name is only used for leads without a website
+    domain = normalize_domain(website) if website else ''
+    if domain:
+        return f'domain:{domain}'
+    name = normalize_org_name(company_name)
+    if name:
+        return f'name:{name}'
+    return None
+
+def _cached(key):
+    row = db.connect().execute('SELECT contacts, fetched_at FROM apollo_contacts WHERE org_key = ?',
+                               (key,)).fetchone()
+    if row and time.time() - row[1] <= CONTACT_TTL:
+        return json.loads(row[0])
+    return None
+
+def _store(key, contacts):
+    db.write('INSERT OR REPLACE INTO apollo_contacts (org_key, contacts, fetched_at) VALUES (?, ?, ?)',
+             (key, json.dumps(contacts), time.time()))
+
+def get_contacts(company_name, fetch, website=None):
+    # fetch(company_name, website) does the actual Apollo search and raises on
+    # failure, so errors are never cached
+    key = org_key(company_name, website)
+    if key is None:
+        return fetch(company_name, website)
+
+    contacts = _cached(key)
+    if contacts is not None:
+        _record('hits')
+        return contacts
+
+    with _lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _in_flight[key] = future
+
+    if not owner:
+        # Another worker is already searching for this organization
+        _record('coalesced')
+        return future.result()
+
+    _record('misses')
+    try:
+        contacts = fetch(company_name, website)
+        _store(key, contacts)
+        future.set_result(contacts)
+        return contacts
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _in_flight.pop(key, None)
+
+def lookup_many(companies, fetch, workers=4):
+    # companies is an iterable of (company_name, website); every distinct
+    # organization is searched at most once. Returns {org_key: contacts or exception}.
+    unique = {}
+    for company_name, website in companies:
+        key = org_key(company_name, website)
+        if key is not None and key not in unique:
+            unique[key] = (company_name, website)
+
+    results = {}
+    missing = []
+    for key, company in unique.items():
+        contacts = _cached(key)
+        if contacts is not None:
+            _record('hits')
+            results[key] = contacts
+        else:
+            missing.append((key, company))
+
+    logging.info(f"Contact lookup: {len(unique)} distinct organizations, "
+                 f"{len(results)} cached, {len(missing)} to search")
+
+    def search(item):
+        key, (company_name, website) = item
+        try:
+            return key, get_contacts(company_name, fetch, website)
+        except Exception as e:
+            return key, e
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for key, contacts in executor.map(search, missing):
+                results[key] = contacts
+
+    return results
+
+def log_stats():
+    logging.info(f"Contact cache: {stats['hits']} hits, {stats['misses']} Apollo searches, "
+                 f"{stats['coalesced']} coalesced with an in-flight search")
+    return dict(stats)
@@ -0,0 +1,88 @@
+import os
+import time
+import signal
+import logging
+import threading
+import db
+import metrics
+import research_tasks
+
+# Seconds to sleep when a pass found nothing to do
+DAEMON_INTERVAL = float(os.getenv('DAEMON_INTERVAL', '60'))
+# Most leads researched per pass. Keeps each pass short, so new seeds are
+# searched and a stop request is honoured without waiting for the whole
+# queue to drain.
+DAEMON_RESEARCH_LIMIT = int(os.getenv('DAEMON_RESEARCH_LIMIT', '200'))
+# Most seed URLs searched per pass
+DAEMON_SEED_LIMIT = int(os.getenv('DAEMON_SEED_LIMIT', '500'))
+
+_stop = threading.Event()
+
+def request_stop(signum=None, frame=None):
+    # The pass in progress finishes; its claimed tasks are completed rather
+    # than left to wait out their lease
+    if not _stop.is_set():
+        logging.info(f"Daemon stopping after the current pass (signal {signum})")
+        print("Stopping after the current pass...")
+    _stop.set()
+
+def pending_seeds(limit=DAEMON_SEED_LIMIT):
+    rows = db.connect().execute("SELECT url FROM seed_urls WHERE status = 'not-started' ORDER BY id LIMIT ?",
+                                (limit,)).fetchall()
+    return [row[0] for row in rows]
+
+def run_once(concurrency=None, batch_size=None, limit=DAEMON_RESEARCH_LIMIT,
+             find_similar_workers=None, seed_limit=DAEMON_SEED_LIMIT, refresh_age=research_tasks.REFRESH_AGE):
+    # One pass: search the seeds added since the last pass, queue new leads
+    # and leads due a refresh, then research a chunk of the queue. Returns
+    # whether there was any work.
+    import lead_agent
+    import research_crew
+
+    seeds = pending_seeds(seed_limit)
+    if seeds:
+        metrics.inc('daemon_seeds_total', len(seeds))
+        lead_agent.find_similar_bulk(seeds, find_similar_workers or lead_agent.FIND_SIMILAR_WORKERS)
+
+    research_tasks.enqueue_new_leads()
+    if refresh_age > 0:
+        research_tasks.requeue_stale(refresh_age, limit)
+    researched = research_tasks.has_claimable()
+    if researched:
+        research_crew.conduct_research(concurrency, batch_size, limit)
+    return bool(seeds) or researched
+
+def run(interval=DAEMON_INTERVAL, concurrency=None, batch_size=None, limit=DAEMON_RESEARCH_LIMIT,
+        find_similar_workers=None, once=False, refresh_age=research_tasks.REFRESH_AGE):
+    # Picks up new seeds and leads until SIGINT or SIGTERM. Passes run back to
+    # back while there is work, then every interval seconds.
+    _stop.clear()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, request_stop)
+    metrics.start()
+    logging.info(f"Daemon started (interval {interval:.0f}s, up to {limit} leads per pass)")
+    print(f"Lead Agent daemon started, checking for work every {interval:.0f}s when idle. Ctrl-C to stop.")
+
+    passes = 0
+    while not _stop.is_set():
+        started = time.monotonic()
+        try:
+            busy = run_once(concurrency, batch_size, limit, find_similar_workers, refresh_age=refresh_age)
+        except Exception as e:
+            # A failed pass (say, the database locked for too long) is retried
+            # after the interval rather than ending the daemon
+            logging.exception(f"Daemon pass failed: {str(e)}")
+            metrics.inc('daemon_pass_errors_total')
+            busy = False
+        passes += 1
+        metrics.inc('daemon_passes_total', busy='yes' if busy else 'no')
+        metrics.observe('daemon_pass_seconds', time.monotonic() - started)
+        if once:
+            break
+        if not busy:
+            _stop.wait(interval)
+
+    db.flush()
+    logging.info(f"Daemon stopped after {passes} passes")
+    print(f"Daemon stopped after {passes} passes.")
+    return passes
@@ -0,0 +1,701 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import sqlite3
+import threading
+from concurrent.futures import Future
+import lead_store
+import blob_store
+import scoring
+import metrics
+
+DB_PATH = os.getenv('LEAD_AGENT_DB', 'leads.db')
+
+# Applied to every connection. WAL lets readers run alongside the writer,
+# and synchronous=NORMAL is durable under WAL with far fewer fsyncs.
+PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -65536',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 10000',
+    'PRAGMA foreign_keys = ON',
+]
+
+# Most statements the writer thread commits in one transaction
+WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', '500'))
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+_connections = []
+_connections_lock = threading.Lock()
+
+def _open():
+    conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    # Lets SQL (the search index statements in particular) read compressed
+    # text. Not deterministic: the blob behind an id can be replaced.
+    conn.create_function('blob_text', 1, lambda blob_id: blob_store.get(conn, blob_id))
+    # Only migration 8 calls this; no trigger may, as plain sqlite3
+    # connections don't have it
+    conn.create_function('lead_priority', 5, scoring.priority, deterministic=True)
+    with _connections_lock:
+        _connections.append(conn)
+    return conn
+
+def init_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            company_name TEXT,
+            website TEXT NOT NULL UNIQUE,
+            source_url TEXT,
+            status TEXT DEFAULT 'new',
+            additional_info TEXT,
+            score REAL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS seed_urls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL UNIQUE,
+            status TEXT DEFAULT 'not-started'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS errors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL,
+            error_message TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS llm_memo (
+            model TEXT NOT NULL,
+            prompt_version TEXT NOT NULL,
+            input_hash TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            hits INTEGER DEFAULT 0,
+            PRIMARY KEY (model, prompt_version, input_hash)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS apollo_contacts (
+            org_key TEXT PRIMARY KEY,
+            contacts TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    ''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_seed_urls_status ON seed_urls (status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_leads_status ON leads (status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_memo_created ON llm_memo (created_at)')
+    conn.commit()
+
+    migrate(conn)
+
+def _migrate_normalize_leads(conn):
+    # Version 2: research results and Exa page data move out of the
+    # leads.additional_info JSON blob into typed columns and child tables
+    for column, kind in [('extracted_company_name', 'TEXT'), ('description', 'TEXT'), ('industry', 'TEXT'),
+                         ('employee_count', 'INTEGER'), ('revenue', 'TEXT'), ('address', 'TEXT'),
+                         ('contact_count', 'INTEGER DEFAULT 0'), ('research_error', 'TEXT')]:
+        conn.execute(f'ALTER TABLE leads ADD COLUMN {column} {kind}')
+
+    conn.execute('''
+        CREATE TABLE lead_contacts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lead_id INTEGER NOT NULL REFERENCES leads (id) ON DELETE CASCADE,
+            name TEXT,
+            email TEXT,
+            phone TEXT,
+            title TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE lead_pages (
+            lead_id INTEGER NOT NULL REFERENCES leads (id) ON DELETE CASCADE,
+            source TEXT NOT NULL,
+            text TEXT,
+            summary TEXT,
+            fetched_at REAL,
+            PRIMARY KEY (lead_id, source)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE lead_extractions (
+            lead_id INTEGER PRIMARY KEY REFERENCES leads (id) ON DELETE CASCADE,
+            model TEXT,
+            prompt_version TEXT,
+            data TEXT,
+            extracted_at REAL
+        )
+    ''')
+
+    rows = conn.execute('SELECT id, additional_info FROM leads WHERE additional_info IS NOT NULL').fetchall()
+    for lead_id, additional_info in rows:
+        try:
+            info = json.loads(additional_info)
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(info, dict):
+            continue
+        if set(info) <= {'text', 'summary'}:
+            # Still the Exa payload written by find_similar_websites
+            conn.execute('INSERT INTO lead_pages (lead_id, source, text, summary) VALUES (?, ?, ?, ?)',
+                         (lead_id, 'exa', info.get('text'), info.get('summary')))
+            conn.execute('UPDATE leads SET additional_info = NULL WHERE id = ?', (lead_id,))
+        else:
+            # A research result. The SQL is spelled out here, not shared with
+            # lead_store, so it keeps matching the schema of this version.
+            # The lead keeps whatever status it had; only the data moves.
+            info = dict(info)
+            contacts = info.pop('contacts', []) or []
+            info.pop('website', None)
+            error = info.pop('error', None)
+            columns = lead_store.extraction_columns(info)
+            conn.execute('''
+                UPDATE leads
+                SET extracted_company_name = ?, description = ?, industry = ?, employee_count = ?, revenue = ?,
+                    address = ?, contact_count = ?, research_error = ?, additional_info = NULL
+                WHERE id = ?
+            ''', (columns['extracted_company_name'], columns['description'], columns['industry'],
+                  columns['employee_count'], columns['revenue'], columns['address'], len(contacts),
+                  str(error) if error else None, lead_id))
+            if contacts:
+                conn.executemany('INSERT INTO lead_contacts (lead_id, name, email, phone, title) VALUES (?, ?, ?, ?, ?)',
+                                 lead_store.contact_rows(lead_id, contacts))
+            if info or error:
+                conn.execute('INSERT INTO lead_extractions (lead_id, data, extracted_at) VALUES (?, ?, ?)',
+                             (lead_id, json.dumps(info if not error else {'error': str(error)}), time.time()))
+
+    conn.execute('CREATE INDEX idx_leads_industry ON leads (industry COLLATE NOCASE)')
+    conn.execute('CREATE INDEX idx_leads_employee_count ON leads (employee_count)')
+    conn.execute('CREATE INDEX idx_leads_contact_count ON leads (contact_count)')
+    conn.execute('CREATE INDEX idx_leads_source_url ON leads (source_url)')
+    conn.execute('CREATE INDEX idx_lead_contacts_lead ON lead_contacts (lead_id)')
+    conn.execute('CREATE INDEX idx_lead_contacts_email ON lead_contacts (email)')
+
+def _migrate_compress_pages(conn):
+    # Version 3: page text and summaries move into compressed blobs, so
+    # lead_pages only holds small metadata rows
+    conn.execute('''
+        CREATE TABLE blob_dicts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codec TEXT NOT NULL,
+            data BLOB NOT NULL,
+            created_at REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE blobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codec TEXT NOT NULL,
+            dict_id INTEGER REFERENCES blob_dicts (id),
+            raw_size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE lead_pages_v3 (
+            lead_id INTEGER NOT NULL REFERENCES leads (id) ON DELETE CASCADE,
+            source TEXT NOT NULL,
+            text_blob INTEGER,
+            summary_blob INTEGER,
+            text_size INTEGER DEFAULT 0,
+            fetched_at REAL,
+            PRIMARY KEY (lead_id, source)
+        )
+    ''')
+
+    # Existing pages are enough to train the shared dictionary up front
+    samples = [row[0].encode('utf-8') for row in conn.execute(
+        'SELECT text FROM lead_pages WHERE text IS NOT NULL ORDER BY RANDOM() LIMIT ?',
+        (blob_store.DICT_TRAIN_SAMPLES,)).fetchall()]
+    if len(samples) >= blob_store.DICT_TRAIN_SAMPLES:
+        blob_store.train_dictionary(conn, samples)
+
+    for lead_id, source, text, summary, fetched_at in conn.execute(
+            'SELECT lead_id, source, text, summary, fetched_at FROM lead_pages').fetchall():
+        conn.execute('''
+            INSERT INTO lead_pages_v3 (lead_id, source, text_blob, summary_blob, text_size, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (lead_id, source, blob_store.put(conn, text), blob_store.put(conn, summary),
+              len(text or ''), fetched_at))
+    conn.execute('DROP TABLE lead_pages')
+    conn.execute('ALTER TABLE lead_pages_v3 RENAME TO lead_pages')
+
+    # Blobs belong to exactly one page field; drop them with the page (including
+    # cascaded lead deletes) or when the field is overwritten
+    conn.execute('''
+        CREATE TRIGGER lead_pages_release_blobs AFTER DELETE ON lead_pages BEGIN
+            DELETE FROM blobs WHERE id IN (old.text_blob, old.summary_blob);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER lead_pages_replace_blobs AFTER UPDATE OF text_blob, summary_blob ON lead_pages BEGIN
+            DELETE FROM blobs WHERE id = old.text_blob AND old.text_blob IS NOT new.text_blob;
+            DELETE FROM blobs WHERE id = old.summary_blob AND old.summary_blob IS NOT new.summary_blob;
+        END
+    ''')
+
+def _migrate_research_tasks(conn):
+    # Version 4: research progress is tracked per lead and per stage, so an
+    # interrupted run resumes where it stopped and only failed stages rerun
+    conn.execute('''
+        CREATE TABLE research_tasks (
+            lead_id INTEGER PRIMARY KEY REFERENCES leads (id) ON DELETE CASCADE,
+            state TEXT NOT NULL DEFAULT 'pending',
+            scrape_status TEXT NOT NULL DEFAULT 'pending',
+            extract_status TEXT NOT NULL DEFAULT 'pending',
+            contacts_status TEXT NOT NULL DEFAULT 'pending',
+            scrape_attempts INTEGER NOT NULL DEFAULT 0,
+            extract_attempts INTEGER NOT NULL DEFAULT 0,
+            contacts_attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            lease_owner TEXT,
+            lease_expires REAL,
+            retry_at REAL NOT NULL DEFAULT 0,
+            updated_at REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_research_tasks_claim ON research_tasks (state, retry_at)')
+
+# Current time in seconds since the epoch, for use inside triggers
+SQL_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+def _migrate_lead_updated_at(conn):
+    # Version 5: leads carry the time they last changed, so exports can pick
+    # up only what changed since the previous run
+    conn.execute('ALTER TABLE leads ADD COLUMN updated_at REAL')
+    conn.execute(f'UPDATE leads SET updated_at = {SQL_NOW}')
+    conn.execute('CREATE INDEX idx_leads_updated_at ON leads (updated_at)')
+    conn.execute(f'''
+        CREATE TRIGGER leads_touch_insert AFTER INSERT ON leads WHEN new.updated_at IS NULL BEGIN
+            UPDATE leads SET updated_at = {SQL_NOW} WHERE id = new.id;
+        END
+    ''')
+    # Contacts are rewritten together with the lead row, so this covers them too
+    conn.execute(f'''
+        CREATE TRIGGER leads_touch_update AFTER UPDATE ON leads WHEN new.updated_at IS old.updated_at BEGIN
+            UPDATE leads SET updated_at = {SQL_NOW} WHERE id = new.id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TABLE export_state (
+            name TEXT PRIMARY KEY,
+            last_updated_at REAL NOT NULL,
+            exported_at REAL NOT NULL,
+            rows INTEGER NOT NULL
+        )
+    ''')
+
+# The text indexed for one lead, recomputed from lead_pages whenever a page changes
+FTS_SUMMARY_SQL = "(SELECT blob_text(summary_blob) FROM lead_pages WHERE lead_id = {lead} AND source = 'exa')"
+FTS_PAGE_TEXT_SQL = "(SELECT group_concat(blob_text(text_blob), char(10)) FROM lead_pages WHERE lead_id = {lead})"
+FTS_NAME_SQL = "trim(coalesce({row}.company_name, '') || ' ' || coalesce({row}.extracted_company_name, ''))"
+
+def _migrate_full_text_search(conn):
+    # Version 6: an FTS5 index over lead names, descriptions and page text,
+    # kept in step with the tables by triggers. Its rowid is the lead id.
+    conn.execute('''
+        CREATE VIRTUAL TABLE leads_fts USING fts5 (
+            company_name, description, summary, page_text,
+            tokenize = 'porter unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER leads_fts_insert AFTER INSERT ON leads BEGIN
+            INSERT INTO leads_fts (rowid, company_name, description)
+            VALUES (new.id, {FTS_NAME_SQL.format(row='new')}, new.description);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER leads_fts_update AFTER UPDATE OF company_name, extracted_company_name, description ON leads
+        BEGIN
+            UPDATE leads_fts SET company_name = {FTS_NAME_SQL.format(row='new')}, description = new.description
+            WHERE rowid = new.id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER leads_fts_delete AFTER DELETE ON leads BEGIN
+            DELETE FROM leads_fts WHERE rowid = old.id;
+        END
+    ''')
+    for event, row in [('INSERT', 'new'), ('UPDATE OF text_blob, summary_blob', 'new'), ('DELETE', 'old')]:
+        name = event.split()[0].lower()
+        conn.execute(f'''
+            CREATE TRIGGER lead_pages_fts_{name} AFTER {event} ON lead_pages BEGIN
+                UPDATE leads_fts SET summary = {FTS_SUMMARY_SQL.format(lead=f'{row}.lead_id')},
+                                     page_text = {FTS_PAGE_TEXT_SQL.format(lead=f'{row}.lead_id')}
+                WHERE rowid = {row}.lead_id;
+            END
+        ''')
+
+    conn.execute(f'''
+        INSERT INTO leads_fts (rowid, company_name, description, summary, page_text)
+        SELECT leads.id, {FTS_NAME_SQL.format(row='leads')}, leads.description,
+               {FTS_SUMMARY_SQL.format(lead='leads.id')}, {FTS_PAGE_TEXT_SQL.format(lead='leads.id')}
+        FROM leads
+    ''')
+
+def _migrate_dedup_index(conn):
+    # Version 7: MinHash signatures and LSH band buckets for finding leads
+    # whose pages are near-duplicates, and a pointer from each duplicate to
+    # the lead researched in its place
+    conn.execute('ALTER TABLE leads ADD COLUMN canonical_id INTEGER')
+    conn.execute('''
+        CREATE TABLE lead_minhash (
+            lead_id INTEGER PRIMARY KEY REFERENCES leads (id) ON DELETE CASCADE,
+            signature BLOB NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE lead_lsh (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            lead_id INTEGER NOT NULL REFERENCES leads (id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_lead_lsh_bucket ON lead_lsh (band, bucket)')
+    conn.execute('CREATE INDEX idx_lead_lsh_lead ON lead_lsh (lead_id)')
+    conn.execute('CREATE INDEX idx_leads_canonical ON leads (canonical_id)')
+    # Deleting a canonical lead promotes its oldest duplicate in its place.
+    # The promoted lead is tagged with -old.id first, so every step is an
+    # index lookup.
+    conn.execute('''
+        CREATE TRIGGER leads_promote_duplicate AFTER DELETE ON leads BEGIN
+            UPDATE leads SET canonical_id = -old.id
+            WHERE id = (SELECT MIN(id) FROM leads WHERE canonical_id = old.id);
+            UPDATE leads SET canonical_id = (SELECT id FROM leads WHERE canonical_id = -old.id)
+            WHERE canonical_id = old.id;
+            UPDATE leads SET canonical_id = NULL, status = CASE WHEN status = 'duplicate' THEN 'new' ELSE status END
+            WHERE canonical_id = -old.id;
+        END
+    ''')
+
+# Columns whose change counts as the lead changing (priority doesn't)
+TOUCH_COLUMNS = ('company_name, website, source_url, status, score, extracted_company_name, description, industry, '
+                 'employee_count, revenue, address, contact_count, research_error, canonical_id, seed_count')
+PRIORITY_SQL = 'lead_priority({row}score, {row}employee_count, {row}revenue_amount, {row}contact_count, {row}seed_count)'
+
+def _migrate_priority(conn):
+    # Version 8: a composite priority score per lead, kept current by
+    # triggers, and the seeds that surfaced each lead
+    conn.execute('ALTER TABLE leads ADD COLUMN revenue_amount REAL')
+    conn.execute('ALTER TABLE leads ADD COLUMN seed_count INTEGER NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE leads ADD COLUMN priority REAL NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE research_tasks ADD COLUMN priority REAL NOT NULL DEFAULT 0')
+    conn.execute('''
+        CREATE TABLE lead_sources (
+            lead_id INTEGER NOT NULL REFERENCES leads (id) ON DELETE CASCADE,
+            seed_url TEXT NOT NULL,
+            score REAL,
+            found_at REAL,
+            PRIMARY KEY (lead_id, seed_url)
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO lead_sources (lead_id, seed_url, score, found_at)
+        SELECT id, source_url, score, updated_at FROM leads WHERE source_url IS NOT NULL
+    ''')
+    conn.execute('UPDATE leads SET seed_count = 1 WHERE source_url IS NOT NULL')
+    conn.executemany('UPDATE leads SET revenue_amount = ? WHERE id = ?',
+                     [(lead_store.parse_amount(revenue), lead_id) for lead_id, revenue in
+                      conn.execute('SELECT id, revenue FROM leads WHERE revenue IS NOT NULL').fetchall()])
+
+    conn.execute('''
+        CREATE TRIGGER lead_sources_count AFTER INSERT ON lead_sources BEGIN
+            UPDATE leads SET seed_count = seed_count + 1 WHERE id = new.lead_id;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER leads_priority_insert AFTER INSERT ON leads BEGIN
+            UPDATE leads SET priority = {PRIORITY_SQL.format(row='new.')} WHERE id = new.id;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER leads_priority_update
+        AFTER UPDATE OF score, employee_count, revenue_amount, contact_count, seed_count ON leads BEGIN
+            UPDATE leads SET priority = {PRIORITY_SQL.format(row='new.')} WHERE id = new.id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER leads_priority_tasks AFTER UPDATE OF priority ON leads BEGIN
+            UPDATE research_tasks SET priority = new.priority WHERE lead_id = new.id;
+        END
+    ''')
+    # Rescoring shouldn't make every lead look changed to incremental exports
+    conn.execute('DROP TRIGGER leads_touch_update')
+    conn.execute(f'''
+        CREATE TRIGGER leads_touch_update AFTER UPDATE OF {TOUCH_COLUMNS} ON leads
+        WHEN new.updated_at IS old.updated_at BEGIN
+            UPDATE leads SET updated_at = {SQL_NOW} WHERE id = new.id;
+        END
+    ''')
+
+    conn.execute(f"UPDATE leads SET priority = {PRIORITY_SQL.format(row='')}")
+    conn.execute('CREATE INDEX idx_leads_priority ON leads (priority)')
+    conn.execute('CREATE INDEX idx_research_tasks_priority ON research_tasks (state, priority DESC, lead_id)')
+
+def _migrate_lead_traces(conn):
+    # Version 9: per-lead stage timings, recorded when LEAD_TRACE is set
+    conn.execute('''
+        CREATE TABLE lead_traces (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lead_id INTEGER NOT NULL REFERENCES leads (id) ON DELETE CASCADE,
+            stage TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            seconds REAL NOT NULL,
+            outcome TEXT NOT NULL,
+            detail TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_lead_traces_lead ON lead_traces (lead_id, started_at)')
+
+def _migrate_freshness(conn):
+    # Version 10: when each research stage last ran and the inputs it ran on,
+    # so a refresh only reruns the stages whose inputs changed
+    for column in ('scraped_at REAL', 'extracted_at REAL', 'enriched_at REAL', 'page_hash TEXT',
+                   'extracted_hash TEXT', 'extract_version TEXT', 'contacts_key TEXT'):
+        conn.execute(f'ALTER TABLE research_tasks ADD COLUMN {column}')
+    # Leads researched before the task queue existed get a finished task,
+    # aged by when the lead last changed, so they're refreshed too
+    conn.execute('''
+        INSERT INTO research_tasks (lead_id, state, scrape_status, extract_status, contacts_status, priority,
+                                    updated_at)
+        SELECT id, 'done', 'done', 'done', 'done', priority, COALESCE(updated_at, 0) FROM leads
+        WHERE status = 'researched' AND id NOT IN (SELECT lead_id FROM research_tasks)
+    ''')
+    # Times are known for earlier research, its inputs aren't: the first
+    # refresh of those leads reruns every stage
+    conn.execute('''
+        UPDATE research_tasks SET
+            scraped_at = (SELECT fetched_at FROM lead_pages WHERE lead_id = research_tasks.lead_id AND source = 'site'),
+            extracted_at = (SELECT extracted_at FROM lead_extractions WHERE lead_id = research_tasks.lead_id),
+            enriched_at = CASE WHEN contacts_status = 'done' THEN updated_at END
+    ''')
+    conn.execute('CREATE INDEX idx_research_tasks_refresh ON research_tasks (state, updated_at)')
+    # A refresh that finds nothing new writes the same values back; only an
+    # actual change should make the lead look changed to incremental exports
+    changed = ' OR '.join(f'new.{column} IS NOT old.{column}' for column in TOUCH_COLUMNS.split(', '))
+    conn.execute('DROP TRIGGER leads_touch_update')
+    conn.execute(f'''
+        CREATE TRIGGER leads_touch_update AFTER UPDATE OF {TOUCH_COLUMNS} ON leads
+        WHEN new.updated_at IS old.updated_at AND ({changed}) BEGIN
+            UPDATE leads SET updated_at = {SQL_NOW} WHERE id = new.id;
+        END
+    ''')
+
+def _migrate_contentless_search(conn):
+    # Version 11: the search index stops keeping its own copy of every name,
+    # description and page, which took more room than the compressed pages
+    # themselves. A contentless index can only drop a row given the text it
+    # indexed, so lead_store's unindex/index statements replace the triggers
+    # and bracket every change to that text.
+    for trigger in ('leads_fts_insert', 'leads_fts_update', 'leads_fts_delete',
+                    'lead_pages_fts_insert', 'lead_pages_fts_update', 'lead_pages_fts_delete'):
+        conn.execute(f'DROP TRIGGER {trigger}')
+    conn.execute('DROP TABLE leads_fts')
+    conn.execute('''
+        CREATE VIRTUAL TABLE leads_fts USING fts5 (
+            company_name, description, summary, page_text,
+            content = '',
+            tokenize = 'porter unicode61 remove_diacritics 2'
+        )
+    ''')
+    # Must build the same text as lead_store.SEARCH_DOCUMENT_SQL
+    conn.execute(f'''
+        INSERT INTO leads_fts (rowid, company_name, description, summary, page_text)
+        SELECT leads.id, {FTS_NAME_SQL.format(row='leads')}, leads.description,
+               {FTS_SUMMARY_SQL.format(lead='leads.id')},
+               (SELECT group_concat(text, char(10)) FROM (
+                   SELECT blob_text(text_blob) AS text FROM lead_pages WHERE lead_id = leads.id ORDER BY source))
+        FROM leads
+    ''')
+
+def _migrate_priority_without_triggers(conn):
+    # Version 12: the code that writes a priority input recomputes the
+    # priority (scoring.rescore). The triggers that did it called a Python
+    # function, so any connection not opened here failed to write leads.
+    conn.execute('DROP TRIGGER leads_priority_insert')
+    conn.execute('DROP TRIGGER leads_priority_update')
+
+def _migrate_unique_seed_urls(conn):
+    # Version 13: databases created before seed URLs were unique may hold
+    # repeats; keep the first copy so the unique index (needed by INSERT OR
+    # IGNORE) can be built. Newer databases already have it.
+    conn.execute('DELETE FROM seed_urls WHERE id NOT IN (SELECT MIN(id) FROM seed_urls GROUP BY url)')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_seed_urls_url ON seed_urls (url)')
+
+def _migrate_dictionary_attempts(conn):
+    # Version 14: the newest blob id at the last failed attempt to train a
+    # dictionary, so the next attempt waits for enough new blobs instead of
+    # scanning and training again on every save
+    conn.execute('''
+        CREATE TABLE blob_dict_attempts (
+            codec TEXT PRIMARY KEY,
+            last_blob_id INTEGER NOT NULL,
+            attempted_at REAL
+        )
+    ''')
+
+# (version, migration) pairs, applied in order to databases below that version
+MIGRATIONS = [
+    (2, _migrate_normalize_leads),
+    (3, _migrate_compress_pages),
+    (4, _migrate_research_tasks),
+    (5, _migrate_lead_updated_at),
+    (6, _migrate_full_text_search),
+    (7, _migrate_dedup_index),
+    (8, _migrate_priority),
+    (9, _migrate_lead_traces),
+    (10, _migrate_freshness),
+    (11, _migrate_contentless_search),
+    (12, _migrate_priority_without_triggers),
+    (13, _migrate_unique_seed_urls),
+    (14, _migrate_dictionary_attempts),
+]
+
+def migrate(conn):
+    for version, migration in MIGRATIONS:
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= version:
+            continue
+        # IMMEDIATE takes the write lock up front, so two processes starting
+        # together can't both run the same migration
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('PRAGMA user_version').fetchone()[0] < version:
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logging.info(f"Database migrated to schema version {version}")
+
+def connect():
+    # One connection per thread; sqlite3 connections must not be shared
+    # between threads that use them at the same time
+    global _schema_ready
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = _open()
+        if not _schema_ready:
+            with _schema_lock:
+                if not _schema_ready:
+                    init_schema(conn)
+                    _schema_ready = True
+    return conn
+
+class DBWriter(threading.Thread):
+    # Serializes writes from worker threads onto one connection and commits
+    # them in batches, so workers never contend for the write lock
+
+    def __init__(self):
+        super().__init__(name='db-writer', daemon=True)
+        self.queue = queue.Queue()
+
+    def run(self):
+        conn = connect()
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(conn, batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _commit(self, conn, batch):
+        # Each queued item's statements commit together or not at all. An
+        # item that fails is dropped, and its future holds the error.
+        try:
+            with metrics.timer('sqlite_commit_seconds'):
+                for statements, _ in batch:
+                    execute_statements(conn, statements)
+                conn.commit()
+            for _, done in batch:
+                done.set_result(None)
+            return
+        except sqlite3.Error as e:
+            conn.rollback()
+            logging.error(f"Batched write failed ({str(e)}), retrying writes one by one")
+
+        for statements, done in batch:
+            try:
+                execute_statements(conn, statements)
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logging.error(f"Write failed: {statements[0][0].strip()[:80]} ({str(e)})")
+                metrics.inc('db_writes_dropped_total')
+                done.set_exception(e)
+            else:
+                done.set_result(None)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def _get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = DBWriter()
+                _writer.start()
+    return _writer
+
+def execute_statements(conn, statements):
+    for sql, params, many in statements:
+        if many:
+            conn.executemany(sql, params)
+        else:
+            conn.execute(sql, params)
+
+def _queue(statements):
+    done = Future()
+    _get_writer().queue.put((statements, done))
+    return done
+
+# Queue writes for the writer thread. Each returns a Future that resolves
+# once the write is committed, or holds the sqlite3.Error it was dropped for.
+
+def write(sql, params=()):
+    return _queue([(sql, params, False)])
+
+def write_many(sql, rows):
+    return _queue([(sql, list(rows), True)])
+
+def write_atomic(statements):
+    # (sql, params, many) statements, as execute_statements takes them,
+    # committed in one transaction or not at all
+    return _queue(list(statements))
+
+def flush():
+    # Blocks until every queued write has been committed
+    if _writer is not None:
+        _writer.queue.join()
+
+@atexit.register
+def close():
+    flush()
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+    logging.info("Database connection closed")
@@ -0,0 +1,149 @@
+import os
+import re
+import zlib
+import random
+import hashlib
+import logging
+from array import array
+import lead_store
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Signature settings. 16 bands of 8 rows make leads sharing ~70% of their
+# shingles likely to collide in at least one band; candidates are then
+# checked against DUPLICATE_THRESHOLD.
+NUM_PERM = 128
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_WORDS = 5
+DUPLICATE_THRESHOLD = float(os.getenv('DUPLICATE_THRESHOLD', '0.8'))
+# Only the start of very long pages is shingled
+MAX_TEXT_CHARS = 50000
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Fixed seed: signatures are stored, so the permutations must never change.
+# With 31-bit coefficients and 32-bit shingle hashes, a * x + b fits in 64
+# bits, so numpy and plain Python compute exactly the same values.
+_rng = random.Random(1)
+_PERMUTATIONS = [(_rng.randint(1, (1 << 31) - 1), _rng.randint(0, (1 << 31) - 1)) for _ in range(NUM_PERM)]
+if numpy is not None:
+    _A = numpy.array([a for a, _ in _PERMUTATIONS], dtype=numpy.uint64)
+    _B = numpy.array([b for _, b in _PERMUTATIONS], dtype=numpy.uint64)
+
+def shingles(text):
+    words = re.findall(r'\w+', (text or '')[:MAX_TEXT_CHARS].lower())
+    if not words:
+        return set()
+    if len(words) < SHINGLE_WORDS:
+        return {zlib.crc32(' '.join(words).encode('utf-8'))}
+    return {zlib.crc32(' '.join(words[i:i + SHINGLE_WORDS]).encode('utf-8'))
+            for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def minhash(text):
+    # NUM_PERM 32-bit minimums, or None for text without words
+    values = shingles(text)
+    if not values:
+        return None
+    if numpy is not None:
+        hashes = numpy.fromiter(values, dtype=numpy.uint64, count=len(values))
+        permuted = (numpy.outer(_A, hashes) + _B[:, None]) % numpy.uint64(_MERSENNE_PRIME) & numpy.uint64(_MAX_HASH)
+        return array('I', permuted.min(axis=1).astype(numpy.uint32).tobytes())
+    return array('I', [min((a * x + b) % _MERSENNE_PRIME & _MAX_HASH for x in values) for a, b in _PERMUTATIONS])
+
+def band_buckets(signature):
+    # One bucket id per band; leads sharing any (band, bucket) are candidates
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(rows.tobytes(), digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, 'big', signed=True)))
+    return buckets
+
+def similarity(signature, other):
+    return sum(1 for x, y in zip(signature, other) if x == y) / NUM_PERM
+
+def _load_signature(cursor, lead_id):
+    cursor.execute('SELECT signature FROM lead_minhash WHERE lead_id = ?', (lead_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    signature = array('I')
+    signature.frombytes(row[0])
+    return signature
+
+def find_duplicate(cursor, lead_id, signature):
+    # Returns (canonical lead id, similarity) of the closest earlier lead, or
+    # None. Only leads sharing a band bucket are compared, so the cost doesn't
+    # grow with the size of the table.
+    buckets = band_buckets(signature)
+    cursor.execute(f'''
+        SELECT DISTINCT lsh.lead_id, COALESCE(leads.canonical_id, leads.id)
+        FROM lead_lsh lsh JOIN leads ON leads.id = lsh.lead_id
+        WHERE ({' OR '.join(['(lsh.band = ? AND lsh.bucket = ?)'] * len(buckets))}) AND lsh.lead_id < ?
+    ''', [value for bucket in buckets for value in bucket] + [lead_id])
+    best = None
+    for candidate_id, canonical_id in cursor.fetchall():
+        score = similarity(signature, _load_signature(cursor, candidate_id))
+        if score >= DUPLICATE_THRESHOLD and (best is None or score > best[1]):
+            best = (canonical_id, score)
+    return best
+
+def index_lead(cursor, lead_id, text):
+    # Stores the lead's signature and marks it a duplicate of an earlier lead
+    # with near-identical text. Runs in the caller's transaction. Returns the
+    # canonical lead id when the lead is a duplicate.
+    signature = minhash(text)
+    cursor.execute('DELETE FROM lead_lsh WHERE lead_id = ?', (lead_id,))
+    if signature is None:
+        cursor.execute('DELETE FROM lead_minhash WHERE lead_id = ?', (lead_id,))
+        return None
+
+    duplicate = find_duplicate(cursor, lead_id, signature)
+    cursor.execute('INSERT OR REPLACE INTO lead_minhash (lead_id, signature) VALUES (?, ?)',
+                   (lead_id, signature.tobytes()))
+    cursor.executemany('INSERT INTO lead_lsh (band, bucket, lead_id) VALUES (?, ?, ?)',
+                       [(band, bucket, lead_id) for band, bucket in band_buckets(signature)])
+
+    if duplicate is None or duplicate[0] == lead_id:
+        cursor.execute("UPDATE leads SET canonical_id = NULL, status = 'new' WHERE id = ? AND status = 'duplicate'",
+                       (lead_id,))
+        return None
+    canonical_id, score = duplicate
+    # Only leads still waiting for research are set aside
+    cursor.execute('''
+        UPDATE leads SET canonical_id = ?, status = CASE WHEN status = 'new' THEN 'duplicate' ELSE status END
+        WHERE id = ?
+    ''', (canonical_id, lead_id))
+    cursor.execute("DELETE FROM research_tasks WHERE lead_id = ? AND state = 'pending'", (lead_id,))
+    logging.info(f"Lead {lead_id} duplicates lead {canonical_id} ({score:.0%} similar)")
+    return canonical_id
+
+def index_unindexed(conn, chunk_size=500):
+    # Backfills signatures for leads stored before deduplication existed, using
+    # the Exa text or, failing that, the scraped site text
+    cursor = conn.cursor()
+    duplicates = indexed = 0
+    last_id = 0
+    while True:
+        cursor.execute('''
+            SELECT id FROM leads WHERE id > ? AND id NOT IN (SELECT lead_id FROM lead_minhash)
+            ORDER BY id LIMIT ?
+        ''', (last_id, chunk_size))
+        lead_ids = [row[0] for row in cursor.fetchall()]
+        if not lead_ids:
+            break
+        for lead_id in lead_ids:
+            page = lead_store.load_page(cursor, lead_id, 'exa') or lead_store.load_page(cursor, lead_id, 'site')
+            if page and page[0]:
+                indexed += 1
+                if index_lead(cursor, lead_id, page[0]) is not None:
+                    duplicates += 1
+        conn.commit()
+        last_id = lead_ids[-1]
+    logging.info(f"Deduplication index: {indexed} leads indexed, {duplicates} duplicates found")
+    return indexed, duplicates
@@ -0,0 +1,187 @@
+import os
+import csv
+import json
+import time
+import logging
+import db
+import lead_store
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Rows fetched from SQLite and written out per chunk
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '1000'))
+# Apollo searches return at most this many people per lead
+MAX_EXPORT_CONTACTS = 5
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+
+LEAD_COLUMNS = ['id', 'company_name', 'website', 'source_url', 'status', 'score', 'extracted_company_name',
+                'description', 'industry', 'employee_count', 'revenue', 'address', 'contact_count',
+                'research_error', 'updated_at']
+CONTACT_FIELDS = ['name', 'email', 'phone', 'title']
+TEXT_COLUMNS = ['summary', 'page_text']
+
+def flat_columns(include_text=False):
+    # CSV and Parquet need a fixed set of columns, so contacts become
+    # contact_1_name ... contact_5_title
+    columns = list(LEAD_COLUMNS)
+    for i in range(1, MAX_EXPORT_CONTACTS + 1):
+        columns += [f'contact_{i}_{field}' for field in CONTACT_FIELDS]
+    return columns + (TEXT_COLUMNS if include_text else [])
+
+def _query(statuses=None, min_score=None, source=None, since=None):
+    conditions = []
+    params = []
+    if statuses:
+        conditions.append(f"status IN ({','.join('?' * len(statuses))})")
+        params += statuses
+    if min_score is not None:
+        conditions.append('score >= ?')
+        params.append(min_score)
+    if source:
+        conditions.append('source_url = ?')
+        params.append(source)
+    if since is not None:
+        conditions.append('updated_at > ?')
+        params.append(since)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return f"SELECT {', '.join(LEAD_COLUMNS)} FROM leads {where} ORDER BY id", params
+
+def _contacts_by_lead(cursor, lead_ids):
+    contacts = {lead_id: [] for lead_id in lead_ids}
+    cursor.execute(f'''
+        SELECT lead_id, name, email, phone, title FROM lead_contacts
+        WHERE lead_id IN ({','.join('?' * len(lead_ids))}) ORDER BY lead_id, id
+    ''', lead_ids)
+    for row in cursor.fetchall():
+        contacts[row[0]].append(dict(zip(CONTACT_FIELDS, row[1:])))
+    return contacts
+
+def iter_lead_chunks(statuses=None, min_score=None, source=None, since=None, include_text=False,
+                     chunk_size=EXPORT_CHUNK_SIZE):
+    # Yields lists of lead dicts (with a 'contacts' list). One cursor streams
+    # the leads, so memory stays at one chunk however large the table is.
+    conn = db.connect()
+    leads_cursor = conn.cursor()
+    detail_cursor = conn.cursor()
+    sql, params = _query(statuses, min_score, source, since)
+    leads_cursor.execute(sql, params)
+    while True:
+        rows = leads_cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        leads = [dict(zip(LEAD_COLUMNS, row)) for row in rows]
+        contacts = _contacts_by_lead(detail_cursor, [lead['id'] for lead in leads])
+        for lead in leads:
+            lead['contacts'] = contacts[lead['id']]
+            if include_text:
+                # Only now is the page text decompressed
+                page = lead_store.load_page(detail_cursor, lead['id'], 'exa') or (None, None)
+                lead['summary'], lead['page_text'] = page[1], page[0]
+        yield leads
+
+def flatten(lead, include_text=False):
+    # One row in flat_columns() order
+    row = [lead[column] for column in LEAD_COLUMNS]
+    contacts = lead['contacts'][:MAX_EXPORT_CONTACTS]
+    for contact in contacts:
+        row += [contact[field] for field in CONTACT_FIELDS]
+    row += [None] * (len(CONTACT_FIELDS) * (MAX_EXPORT_CONTACTS - len(contacts)))
+    if include_text:
+        row += [lead['summary'], lead['page_text']]
+    return row
+
+class CSVWriter:
+    def __init__(self, path, include_text):
+        self.include_text = include_text
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(flat_columns(include_text))
+
+    def write(self, leads):
+        self.writer.writerows(flatten(lead, self.include_text) for lead in leads)
+
+    def close(self):
+        self.file.close()
+
+class JSONLWriter:
+    def __init__(self, path, include_text):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, leads):
+        for lead in leads:
+            self.file.write(json.dumps(lead) + '\n')
+
+    def close(self):
+        self.file.close()
+
+class ParquetWriter:
+    # One row group per chunk, written as it arrives
+    def __init__(self, path, include_text):
+        if pyarrow is None:
+            raise RuntimeError("Parquet export needs the pyarrow package (pip install pyarrow)")
+        self.include_text = include_text
+        types = {'id': pyarrow.int64(), 'score': pyarrow.float64(), 'employee_count': pyarrow.int64(),
+                 'contact_count': pyarrow.int64(), 'updated_at': pyarrow.float64()}
+        self.schema = pyarrow.schema([(column, types.get(column, pyarrow.string()))
+                                      for column in flat_columns(include_text)])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, leads):
+        columns = zip(*(flatten(lead, self.include_text) for lead in leads))
+        arrays = [pyarrow.array(values, type=field.type) for values, field in zip(columns, self.schema)]
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+WRITERS = {'csv': CSVWriter, 'jsonl': JSONLWriter, 'parquet': ParquetWriter}
+
+def format_for(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    return extension if extension in FORMATS else 'csv'
+
+def _last_export(name):
+    row = db.connect().execute('SELECT last_updated_at FROM export_state WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+def _record_export(name, last_updated_at, rows):
+    conn = db.connect()
+    conn.execute('''
+        INSERT OR REPLACE INTO export_state (name, last_updated_at, exported_at, rows) VALUES (?, ?, ?, ?)
+    ''', (name, last_updated_at, time.time(), rows))
+    conn.commit()
+
+def export_leads(path, export_format=None, statuses=None, min_score=None, source=None, incremental=None,
+                 include_text=False, chunk_size=EXPORT_CHUNK_SIZE):
+    # incremental names a saved export position: only leads changed since the
+    # last export under that name are written, and the position moves forward
+    export_format = export_format or format_for(path)
+    if export_format not in WRITERS:
+        raise ValueError(f"Unknown export format '{export_format}' (use one of {', '.join(FORMATS)})")
+
+    since = _last_export(incremental) if incremental else None
+    started = time.monotonic()
+    writer = WRITERS[export_format](path, include_text)
+    rows = 0
+    newest = since
+    try:
+        for leads in iter_lead_chunks(statuses, min_score, source, since, include_text, chunk_size):
+            writer.write(leads)
+            rows += len(leads)
+            newest = max([newest or 0] + [lead['updated_at'] or 0 for lead in leads])
+    finally:
+        writer.close()
+
+    if incremental:
+        _record_export(incremental, newest or 0, rows)
+
+    elapsed = time.monotonic() - started
+    rate = rows / elapsed if elapsed else 0.0
+    logging.info(f"Exported {rows} leads to {path} as {export_format} in {elapsed:.1f}s ({rate:.0f} rows/s)"
+                 + (f", changes since {since}" if since is not None else ''))
+    return rows
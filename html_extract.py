@@ -0,0 +1,125 @@
+import os
+import time
+import atexit
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup, UnicodeDammit
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    SelectolaxParser = None
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# Parser backend: auto picks the fastest one installed
+HTML_PARSER = os.getenv('HTML_PARSER', 'auto')
+# Pages are read up to this size; with truncation on, larger pages are cut
+# off there and parsed anyway instead of failing the scrape
+MAX_HTML_BYTES = int(os.getenv('SCRAPE_MAX_BYTES', str(2 * 1024 * 1024)))
+TRUNCATE = os.getenv('SCRAPE_TRUNCATE', '1') != '0'
+# Processes to parse pages in; 0 parses in the calling thread
+PARSE_WORKERS = int(os.getenv('HTML_PARSE_WORKERS', '0'))
+
+# Text comes from these tags, in document order. Nested matches are
+# included on their own too, as BeautifulSoup's find_all returns them.
+TEXT_TAGS = ('p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li')
+
+_pool = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+stats = {'pages': 0, 'bytes': 0, 'seconds': 0.0, 'truncated': 0}
+
+def _decode(content):
+    # Most pages are UTF-8; the rest get BeautifulSoup's charset detection
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return UnicodeDammit(content, is_html=True).unicode_markup
+
+def extract_with_selectolax(content):
+    # lexbor assumes UTF-8 bytes, so other charsets are decoded first
+    tree = SelectolaxParser(_decode(content))
+    return '\n'.join(node.text(deep=True) for node in tree.css(', '.join(TEXT_TAGS)))
+
+def extract_with_lxml(content):
+    if not content.strip():
+        return ''
+    try:
+        doc = lxml.html.document_fromstring(_decode(content))
+    except ValueError:
+        # Text with an XML encoding declaration has to be parsed as bytes
+        doc = lxml.html.document_fromstring(content)
+    return '\n'.join(element.text_content() for element in doc.iter(*TEXT_TAGS))
+
+def extract_with_html_parser(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    return '\n'.join(tag.get_text() for tag in soup.find_all(list(TEXT_TAGS)))
+
+BACKENDS = {
+    'selectolax': extract_with_selectolax,
+    'lxml': extract_with_lxml,
+    'html.parser': extract_with_html_parser,
+}
+
+def available_backends():
+    return [name for name, module in [('selectolax', SelectolaxParser), ('lxml', lxml), ('html.parser', True)]
+            if module is not None]
+
+def backend_name(name=None):
+    name = name or HTML_PARSER
+    if name == 'auto':
+        return available_backends()[0]
+    if name not in available_backends():
+        raise ValueError(f"HTML parser '{name}' is not available (installed: {', '.join(available_backends())})")
+    return name
+
+def extract_text(content, backend=None):
+    # Text of the page's paragraphs, headings and list items from raw bytes
+    return BACKENDS[backend_name(backend)](content)
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn rather than fork: the research pipeline has threads running
+                _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+                logging.info(f"HTML parse pool started with {PARSE_WORKERS} processes ({backend_name()})")
+    return _pool
+
+def extract(content, truncated=False):
+    # extract_text() in the parse pool when one is configured. Scrape threads
+    # block here while the pool parses, so parsing isn't held to one core by
+    # the GIL.
+    started = time.monotonic()
+    if PARSE_WORKERS > 0:
+        text = _get_pool().submit(extract_text, content).result()
+    else:
+        text = extract_text(content)
+    with _stats_lock:
+        stats['pages'] += 1
+        stats['bytes'] += len(content)
+        stats['seconds'] += time.monotonic() - started
+        stats['truncated'] += truncated
+    return text
+
+@atexit.register
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+def log_stats():
+    rate = stats['bytes'] / stats['seconds'] / 1024 / 1024 if stats['seconds'] else 0.0
+    logging.info(f"HTML extraction ({backend_name()}, {PARSE_WORKERS or 'no'} worker processes): "
+                 f"{stats['pages']} pages, {stats['bytes'] / 1024 / 1024:.1f} MB in {stats['seconds']:.1f}s "
+                 f"({rate:.1f} MB/s), {stats['truncated']} truncated at {MAX_HTML_BYTES} bytes")
+    return dict(stats)
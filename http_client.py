@@ -0,0 +1,111 @@
+import os
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# Timeouts in seconds, connection pool limits, and the most bytes read
+# from one response
+CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '20'))
+MAX_HOSTS = int(os.getenv('HTTP_MAX_HOSTS', '100'))
+MAX_CONNECTIONS_PER_HOST = int(os.getenv('HTTP_MAX_CONNECTIONS_PER_HOST', '4'))
+MAX_RESPONSE_BYTES = int(os.getenv('HTTP_MAX_RESPONSE_BYTES', str(5 * 1024 * 1024)))
+
+USER_AGENT = 'Mozilla/5.0 (compatible; LeadAgent/1.0)'
+
+class ResponseTooLarge(Exception):
+    pass
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # pool_block makes MAX_CONNECTIONS_PER_HOST a hard cap: extra
+                # requests to the same host wait for a free connection
+                adapter = HTTPAdapter(pool_connections=MAX_HOSTS,
+                                      pool_maxsize=MAX_CONNECTIONS_PER_HOST,
+                                      pool_block=True)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({'User-Agent': USER_AGENT})
+                _session = session
+                logging.info("HTTP session initialized")
+    return _session
+
+def read_limited(response, max_bytes=MAX_RESPONSE_BYTES, truncate=False):
+    # With truncate, a body over max_bytes is cut off there instead of
+    # raising, and response.truncated is set
+    response.truncated = False
+    content_length = response.headers.get('Content-Length')
+    if not truncate and content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        response.close()
+        raise ResponseTooLarge(f"{response.url} is {content_length} bytes (limit {max_bytes})")
+
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        size += len(chunk)
+        if size > max_bytes:
+            if not truncate:
+                response.close()
+                raise ResponseTooLarge(f"{response.url} exceeded {max_bytes} bytes")
+            # The rest is never read; closing drops the connection
+            chunks.append(chunk[:len(chunk) - (size - max_bytes)])
+            response.truncated = True
+            response.close()
+            break
+        chunks.append(chunk)
+
+    # Cache the body so response.text / response.json() keep working
+    response._content = b''.join(chunks)
+    return response._content
+
+def request(method, url, max_bytes=MAX_RESPONSE_BYTES, timeout=None, truncate=False, **kwargs):
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    response = get_session().request(method, url, timeout=timeout, stream=True, **kwargs)
+    try:
+        read_limited(response, max_bytes, truncate)
+    finally:
+        # Hands the connection back to the pool for keep-alive reuse
+        response.close()
+    return response
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+def pool_stats():
+    stats = {'hosts': 0, 'requests': 0, 'connections': 0, 'reused': 0, 'hit_rate': 0.0}
+    if _session is None:
+        return stats
+
+    adapters = {id(adapter): adapter for adapter in _session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats['hosts'] += 1
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
+
+    # Every request beyond the first on a connection skipped a TCP/TLS handshake
+    stats['reused'] = max(0, stats['requests'] - stats['connections'])
+    stats['hit_rate'] = stats['reused'] / stats['requests'] if stats['requests'] else 0.0
+    return stats
+
+def log_pool_stats():
+    stats = pool_stats()
+    logging.info(f"HTTP pool: {stats['requests']} requests over {stats['connections']} connections "
+                 f"to {stats['hosts']} hosts, {stats['reused']} reused ({stats['hit_rate']:.0%})")
+    return stats
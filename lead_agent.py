@@ -1,12 +1,18 @@
-import sqlite3
-import argparse
-import atexit
-from exa_py import Exa
 import os
 import logging
+import threading
 from dotenv import load_dotenv
-import json
-import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import db
+import blob_store
+import dedup
+import lead_store
+import metrics
+import research_tasks
+import scheduler
+import scoring
+from url_utils import canonicalize_url
 
 # Set up logging
 logging.basicConfig(filename='lead_agent.log', level=logging.INFO,
@@ -15,72 +21,70 @@ logging.basicConfig(filename='lead_agent.log', level=logging.INFO,
 # Load environment variables
 load_dotenv()
 
-# Initialize Exa AI API
+# Exa AI API client, created on first use: importing exa_py alone takes
+# most of a second, which commands that never search shouldn't pay
 exa = None
+_exa_lock = threading.Lock()
+
+# Overridable so benchmarks can point the client at a local stand-in
+EXA_BASE_URL = os.getenv('EXA_BASE_URL', 'https://api.exa.ai')
+
+# Number of seeds searched at the same time by find_similar_bulk
+FIND_SIMILAR_WORKERS = int(os.getenv('FIND_SIMILAR_WORKERS', '8'))
 
 def initialize_exa():
     global exa
     api_key = os.getenv("EXA_API_KEY")
     if api_key:
-        exa = Exa(api_key=api_key)
+        from exa_py import Exa
+        exa = Exa(api_key=api_key, base_url=EXA_BASE_URL)
         logging.info("Exa API initialized successfully")
     else:
         logging.warning("Exa API key not found")
 
-# Create and connect to the SQLite database
-conn = sqlite3.connect('leads.db')
-cursor = conn.cursor()
-
-# Create the leads table with the correct structure
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS leads (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        company_name TEXT,
-        website TEXT NOT NULL UNIQUE,
-        source_url TEXT,
-        status TEXT DEFAULT 'new',
-        additional_info TEXT,
-        score REAL
-    )
-''')
-conn.commit()
-
-# Create tables if they don't exist
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS seed_urls (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        url TEXT NOT NULL UNIQUE,
-        status TEXT DEFAULT 'not-started'
-    )
-''')
-
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS errors (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        url TEXT NOT NULL,
-        error_message TEXT,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-    )
-''')
+def get_exa():
+    if exa is None:
+        with _exa_lock:
+            if exa is None:
+                initialize_exa()
+    return exa
 
-conn.commit()
+# Number of lines read from a bulk import file per executemany call
+IMPORT_CHUNK_SIZE = 10000
 
 # Functions for managing seed URLs
 def add_seed_url(url):
-    cursor.execute('INSERT INTO seed_urls (url) VALUES (?)', (url,))
+    conn = db.connect()
+    cursor = conn.cursor()
+    canonical = canonicalize_url(url)
+    if canonical is None:
+        print(f"Invalid URL: {url}")
+        return
+    cursor.execute('INSERT OR IGNORE INTO seed_urls (url) VALUES (?)', (canonical,))
     conn.commit()
-    logging.info(f"Added seed URL: {url}")
-    print(f"Added seed URL: {url}")
+    if cursor.rowcount == 0:
+        print(f"Seed URL already exists: {canonical}")
+        return
+    logging.info(f"Added seed URL: {canonical}")
+    print(f"Added seed URL: {canonical}")
 
 def remove_seed_url(url):
-    cursor.execute('DELETE FROM seed_urls WHERE url = ?', (url,))
+    # Seeds are stored canonicalized, so the URL is looked up the same way
+    conn = db.connect()
+    cursor = conn.cursor()
+    canonical = canonicalize_url(url) or url
+    cursor.execute('DELETE FROM seed_urls WHERE url = ?', (canonical,))
     conn.commit()
-    logging.info(f"Removed seed URL: {url}")
-    print(f"Removed seed URL: {url}")
+    if cursor.rowcount == 0:
+        print(f"No seed URL found for: {canonical}")
+        return
+    logging.info(f"Removed seed URL: {canonical}")
+    print(f"Removed seed URL: {canonical}")
 
 def check_status(url=None):
+    cursor = db.connect().cursor()
     if url:
-        cursor.execute('SELECT * FROM seed_urls WHERE url = ?', (url,))
+        cursor.execute('SELECT * FROM seed_urls WHERE url = ?', (canonicalize_url(url) or url,))
         row = cursor.fetchone()
         if row:
             print(f"ID: {row[0]}, URL: {row[1]}, Status: {row[2]}")
@@ -95,18 +99,155 @@ def check_status(url=None):
         for row in rows:
             print(f"ID: {row[0]}, URL: {row[1]}, Status: {row[2]}")
 
+def read_url_chunks(file_path, chunk_size=IMPORT_CHUNK_SIZE):
+    # Streams the file so memory stays flat however large it is
+    chunk = []
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
 def bulk_add_urls(file_path):
-    with open(file_path, 'r') as file:
-        urls = file.read().splitlines()
-    
-    for url in urls:
-        add_seed_url(url.strip())
-    
-    logging.info(f"Added {len(urls)} URLs from {file_path}")
-    print(f"Added {len(urls)} URLs from {file_path}")
+    conn = db.connect()
+    cursor = conn.cursor()
+    counts = {'inserted': 0, 'duplicate': 0, 'invalid': 0}
+    seen = set()
+    changes_before = conn.total_changes
+
+    try:
+        # One transaction for the whole file instead of a commit per URL
+        for lines in read_url_chunks(file_path):
+            batch = []
+            for line in lines:
+                if not line.strip():
+                    continue
+                canonical = canonicalize_url(line)
+                if canonical is None:
+                    counts['invalid'] += 1
+                elif canonical in seen:
+                    counts['duplicate'] += 1
+                else:
+                    seen.add(canonical)
+                    batch.append((canonical,))
+            cursor.executemany('INSERT OR IGNORE INTO seed_urls (url) VALUES (?)', batch)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    counts['inserted'] = conn.total_changes - changes_before
+    # URLs already in the database were skipped by INSERT OR IGNORE
+    counts['duplicate'] += len(seen) - counts['inserted']
+
+    logging.info(f"Imported {file_path}: {counts['inserted']} added, {counts['duplicate']} duplicates, "
+                 f"{counts['invalid']} invalid")
+    print(f"Added {counts['inserted']} URLs from {file_path} "
+          f"({counts['duplicate']} duplicates, {counts['invalid']} invalid)")
+    return counts
+
+def exclude_domain(url):
+    return url.split("//")[-1].split("/")[0]
+
+@metrics.stage('find_similar')
+def fetch_similar(url):
+    # Network only, so it can run on worker threads; results are written by the caller
+    return scheduler.call(
+        'exa',
+        exa.find_similar_and_contents,
+        url,
+        num_results=10,
+        text=True,
+        summary=True,
+        exclude_domains=[exclude_domain(url)]
+    )
+
+def similar_lead_rows(url, result):
+    return [(
+        getattr(similar_site, 'title', ''),
+        similar_site.url,
+        url,
+        getattr(similar_site, 'score', 0),
+        getattr(similar_site, 'text', ''),
+        getattr(similar_site, 'summary', '')
+    ) for similar_site in result.results]
+
+@metrics.stage('save_similar')
+def save_similar_results(url, result):
+    # All rows for a seed plus its status change go in one transaction
+    conn = db.connect()
+    cursor = conn.cursor()
+    if hasattr(result, 'results') and isinstance(result.results, list):
+        rows = similar_lead_rows(url, result)
+        # Leads found before leave the search index until their new name and
+        # page are stored
+        for row in rows:
+            cursor.execute('SELECT id FROM leads WHERE website = ?', (row[1],))
+            existing = cursor.fetchone()
+            if existing:
+                db.execute_statements(cursor, [lead_store.unindex_statement(existing[0])])
+        # An upsert rather than INSERT OR REPLACE keeps the lead's id, so its
+        # contacts and pages stay attached when another seed finds it again.
+        # The lead is only researched again if its name changed.
+        cursor.executemany('''
+            INSERT INTO leads (company_name, website, source_url, status, score)
+            VALUES (?, ?, ?, 'new', ?)
+            ON CONFLICT (website) DO UPDATE SET
+                company_name = excluded.company_name,
+                source_url = excluded.source_url,
+                status = CASE WHEN company_name IS excluded.company_name THEN status ELSE 'new' END,
+                score = excluded.score
+        ''', [row[:4] for row in rows])
+        duplicates = 0
+        lead_ids = []
+        for row in rows:
+            cursor.execute('SELECT id FROM leads WHERE website = ?', (row[1],))
+            lead_id = cursor.fetchone()[0]
+            lead_ids.append(lead_id)
+            lead_store.save_page(cursor, lead_id, 'exa', row[4], row[5])
+            db.execute_statements(cursor, [lead_store.index_statement(lead_id)])
+            # Each seed that surfaces the lead counts once towards its priority
+            cursor.execute('''
+                INSERT OR IGNORE INTO lead_sources (lead_id, seed_url, score, found_at) VALUES (?, ?, ?, ?)
+            ''', (lead_id, url, row[3], time.time()))
+            # Mirrors and URL variants of a site already found aren't researched again
+            if dedup.index_lead(cursor, lead_id, row[4]) is not None:
+                duplicates += 1
+        # The Exa score and seed count just changed
+        scoring.rescore(cursor, lead_ids)
+        research_tasks.restart_tasks(cursor, lead_ids)
+        for row in rows:
+            logging.info(f"Added/Updated similar website: {row[1]}")
+        metrics.inc('similar_leads_total', len(rows))
+        metrics.inc('duplicate_leads_total', duplicates)
+        print(f"Added {len(rows)} similar websites for {url} ({duplicates} near-duplicates of existing leads)")
+        logging.info(f"Added {len(rows)} similar websites for {url} ({duplicates} near-duplicates)")
+    else:
+        logging.warning(f"No results found for {url}")
+        print(f"No results found for {url}")
+
+    cursor.execute('UPDATE seed_urls SET status = "completed" WHERE url = ?', (url,))
+    blob_store.maybe_train_dictionary(cursor)
+    conn.commit()
+    logging.info(f"Completed finding similar websites for: {url}")
+    print(f"Completed finding similar websites for: {url}")
+
+def record_find_similar_error(url, error):
+    conn = db.connect()
+    cursor = conn.cursor()
+    cursor.execute('UPDATE seed_urls SET status = "failed" WHERE url = ?', (url,))
+    cursor.execute('INSERT INTO errors (url, error_message) VALUES (?, ?)', (url, str(error)))
+    conn.commit()
+    logging.error(f"Error processing {url}: {str(error)}")
+    print(f"Error processing {url}: {str(error)}")
 
 def find_similar_websites(url):
-    if exa is None:
+    conn = db.connect()
+    cursor = conn.cursor()
+    if get_exa() is None:
         logging.error("Exa API is not initialized. Please set up your API key.")
         print("Exa API is not initialized. Please set up your API key.")
         return
@@ -125,81 +266,98 @@ def find_similar_websites(url):
         cursor.execute('UPDATE seed_urls SET status = "processing" WHERE url = ?', (url,))
         conn.commit()
 
-        result = exa.find_similar_and_contents(
-            url,
-            num_results=10,
-            text=True,
-            summary=True,
-            exclude_domains=[url.split("//")[-1].split("/")[0]]
-        )
-
-        # Process and save the results
-        if hasattr(result, 'results') and isinstance(result.results, list):
-            for similar_site in result.results:
-                cursor.execute('''
-                    INSERT OR REPLACE INTO leads 
-                    (company_name, website, source_url, status, additional_info, score) 
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (
-                    getattr(similar_site, 'title', ''),
-                    similar_site.url,
-                    url,
-                    'new',
-                    json.dumps({
-                        'text': getattr(similar_site, 'text', ''),
-                        'summary': getattr(similar_site, 'summary', '')
-                    }),
-                    getattr(similar_site, 'score', 0)
-                ))
-                logging.info(f"Added/Updated similar website: {similar_site.url}")
-                print(f"Added/Updated similar website: {similar_site.url}")
-            
-            print(f"Added {len(result.results)} similar websites for {url}")
-            logging.info(f"Added {len(result.results)} similar websites for {url}")
-        else:
-            logging.warning(f"No results found for {url}")
-            print(f"No results found for {url}")
-
-        cursor.execute('UPDATE seed_urls SET status = "completed" WHERE url = ?', (url,))
-        conn.commit()
-        logging.info(f"Completed finding similar websites for: {url}")
-        print(f"Completed finding similar websites for: {url}")
+        result = fetch_similar(url)
+        save_similar_results(url, result)
 
     except Exception as e:
-        cursor.execute('UPDATE seed_urls SET status = "failed" WHERE url = ?', (url,))
-        cursor.execute('INSERT INTO errors (url, error_message) VALUES (?, ?)', (url, str(e)))
-        conn.commit()
-        logging.error(f"Error processing {url}: {str(e)}")
-        print(f"Error processing {url}: {str(e)}")
+        record_find_similar_error(url, e)
+
+def find_similar_bulk(urls, workers=FIND_SIMILAR_WORKERS):
+    conn = db.connect()
+    cursor = conn.cursor()
+    if get_exa() is None:
+        logging.error("Exa API is not initialized. Please set up your API key.")
+        print("Exa API is not initialized. Please set up your API key.")
+        return
+
+    completed = set()
+    for i in range(0, len(urls), 500):
+        chunk = urls[i:i + 500]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'SELECT url FROM seed_urls WHERE status = "completed" AND url IN ({placeholders})', chunk)
+        completed.update(row[0] for row in cursor.fetchall())
+    for url in completed:
+        print(f"Skipping {url} as it has already been processed.")
+    pending = [url for url in dict.fromkeys(urls) if url not in completed]
+    if not pending:
+        return
+
+    cursor.executemany('UPDATE seed_urls SET status = "processing" WHERE url = ?', [(url,) for url in pending])
+    conn.commit()
+
+    logging.info(f"Finding similar websites for {len(pending)} seeds with {workers} workers")
+    print(f"Finding similar websites for {len(pending)} seeds with {workers} workers")
+    started = time.monotonic()
+
+    # Exa calls fan out across the pool; all database writes stay on this thread
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_similar, url): url for url in pending}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                save_similar_results(url, future.result())
+            except Exception as e:
+                record_find_similar_error(url, e)
+
+    elapsed = time.monotonic() - started
+    rate = len(pending) / elapsed * 60 if elapsed else 0.0
+    logging.info(f"Processed {len(pending)} seeds in {elapsed:.1f}s ({rate:.1f} seeds/min)")
+    print(f"Processed {len(pending)} seeds in {elapsed:.1f}s ({rate:.1f} seeds/min)")
+
+LEADS_PER_PAGE = 10
 
 def view_leads():
-    cursor.execute('SELECT COUNT(*) FROM leads')
-    total_leads = cursor.fetchone()[0]
-    leads_per_page = 10
-    total_pages = math.ceil(total_leads / leads_per_page)
-    current_page = 1
+    cursor = db.connect().cursor()
+    counts = lead_store.status_counts(cursor)
+    total_leads = sum(counts.values())
+    summary = ', '.join(f"{status}: {count}" for status, count in counts.items())
+    print(f"\nTotal leads: {total_leads}" + (f" ({summary})" if summary else ''))
 
+    leads = lead_store.leads_after(cursor, 0, LEADS_PER_PAGE)
     while True:
-        cursor.execute('SELECT id, company_name FROM leads LIMIT ? OFFSET ?', 
-                       (leads_per_page, (current_page - 1) * leads_per_page))
-        leads = cursor.fetchall()
-
-        print(f"\nPage {current_page} of {total_pages}")
-        for lead in leads:
-            print(f"ID: {lead[0]}, Company Name: {lead[1]}")
+        if leads:
+            print(f"\nLeads {leads[0][0]} to {leads[-1][0]}")
+            for lead in leads:
+                print(f"ID: {lead[0]}, Company Name: {lead[1]}, Status: {lead[2]}")
+        else:
+            print("\nNo leads on this page")
 
         print("\nOptions:")
         print("n - Next page")
         print("p - Previous page")
+        print("g <ID> - Jump to the page starting at a lead ID")
         print("v <ID> - View details of a specific lead")
         print("q - Return to main menu")
 
         choice = input("Enter your choice: ").strip().lower()
 
-        if choice == 'n' and current_page < total_pages:
-            current_page += 1
-        elif choice == 'p' and current_page > 1:
-            current_page -= 1
+        if choice == 'n':
+            next_leads = lead_store.leads_after(cursor, leads[-1][0] if leads else 0, LEADS_PER_PAGE)
+            if next_leads:
+                leads = next_leads
+            else:
+                print("Already on the last page.")
+        elif choice == 'p':
+            previous_leads = lead_store.leads_before(cursor, leads[0][0] if leads else 2 ** 63 - 1, LEADS_PER_PAGE)
+            if previous_leads:
+                leads = previous_leads
+            else:
+                print("Already on the first page.")
+        elif choice.startswith('g '):
+            try:
+                leads = lead_store.leads_after(cursor, int(choice.split()[1]) - 1, LEADS_PER_PAGE)
+            except (ValueError, IndexError):
+                print("Invalid lead ID. Please try again.")
         elif choice.startswith('v '):
             try:
                 lead_id = int(choice.split()[1])
@@ -212,7 +370,13 @@ def view_leads():
             print("Invalid choice. Please try again.")
 
 def view_lead_details(lead_id):
-    cursor.execute('SELECT * FROM leads WHERE id = ?', (lead_id,))
+    cursor = db.connect().cursor()
+    cursor.execute('''
+        SELECT id, company_name, website, source_url, status, score, extracted_company_name,
+               description, industry, employee_count, revenue, address, research_error, canonical_id,
+               priority, seed_count
+        FROM leads WHERE id = ?
+    ''', (lead_id,))
     lead = cursor.fetchone()
     if lead:
         print(f"\nLead Details:")
@@ -221,20 +385,91 @@ def view_lead_details(lead_id):
         print(f"Website: {lead[2]}")
         print(f"Source: {lead[3]}")
         print(f"Status: {lead[4]}")
-        additional_info = json.loads(lead[5])
-        print(f"Summary: {additional_info.get('summary', 'N/A')}")
-        print(f"Score: {lead[6]}")
-        print(f"Additional Text: {additional_info.get('text', 'N/A')}")
+        if lead[13] is not None:
+            print(f"Duplicate of: {lead[13]}")
+        page = lead_store.load_page(cursor, lead_id, 'exa') or (None, None)
+        print(f"Summary: {page[1] or 'N/A'}")
+        print(f"Score: {lead[5]}")
+        print(f"Priority: {lead[14]:.3f} (found by {lead[15]} seed{'s' if lead[15] != 1 else ''})")
+        for label, value in [('Extracted Name', lead[6]), ('Description', lead[7]), ('Industry', lead[8]),
+                             ('Employees', lead[9]), ('Revenue', lead[10]), ('Address', lead[11]),
+                             ('Research Error', lead[12])]:
+            if value is not None:
+                print(f"{label}: {value}")
+        for contact in lead_store.load_contacts(cursor, lead_id):
+            print(f"Contact: {contact['name']}, {contact['title']}, {contact['email']}, {contact['phone']}")
+        cursor.execute('SELECT scraped_at, extracted_at, enriched_at FROM research_tasks WHERE lead_id = ?',
+                       (lead_id,))
+        for label, value in zip(('Last Scraped', 'Last Extracted', 'Last Enriched'), cursor.fetchone() or ()):
+            if value is not None:
+                print(f"{label}: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(value))}")
+        print(f"Additional Text: {page[0] or 'N/A'}")
     else:
         print(f"No lead found with ID: {lead_id}")
 
+def view_lead_trace(lead_id):
+    cursor = db.connect().cursor()
+    spans = metrics.load_trace(cursor, lead_id)
+    if not spans:
+        print(f"No trace recorded for lead {lead_id} (set LEAD_TRACE=1 to record traces)")
+        return
+    print(f"\nTrace for lead {lead_id}:")
+    for span in spans:
+        started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(span['started_at']))
+        detail = f" - {span['detail']}" if span['detail'] else ''
+        print(f"  {started}  {span['stage']:<10} {span['seconds']:8.3f}s  {span['outcome']}{detail}")
+
+def view_stats(metrics_snapshot=None):
+    for line in metrics.summary_lines(metrics_snapshot):
+        print(line)
+
 def delete_lead(lead_id):
+    conn = db.connect()
+    cursor = conn.cursor()
+    db.execute_statements(cursor, [lead_store.unindex_statement(lead_id)])
     cursor.execute('DELETE FROM leads WHERE id = ?', (lead_id,))
     conn.commit()
     logging.info(f"Deleted lead with ID: {lead_id}")
     print(f"Deleted lead with ID: {lead_id}")
 
+def search_leads(query, limit=20):
+    cursor = db.connect().cursor()
+    started = time.monotonic()
+    results = lead_store.search(cursor, query, limit)
+    elapsed = time.monotonic() - started
+    logging.info(f"Search for '{query}' returned {len(results)} leads in {elapsed * 1000:.1f}ms")
+    if not results:
+        print(f"No leads match '{query}'")
+        return results
+
+    print(f"\nTop {len(results)} leads for '{query}' ({elapsed * 1000:.1f}ms):")
+    for lead_id, company_name, website, status, rank, snippet in results:
+        print(f"ID: {lead_id}, Company Name: {company_name}, Website: {website}, Status: {status}")
+        print(f"    {' '.join(snippet.split())}")
+    return results
+
+def dedupe_leads():
+    conn = db.connect()
+    cursor = conn.cursor()
+    started = time.monotonic()
+    indexed, duplicates = dedup.index_unindexed(conn)
+    print(f"Indexed {indexed} leads in {time.monotonic() - started:.1f}s, found {duplicates} near-duplicates")
+    cursor.execute("SELECT COUNT(*) FROM leads WHERE status = 'duplicate'")
+    print(f"Leads set aside as duplicates: {cursor.fetchone()[0]}")
+
+def view_storage_stats():
+    cursor = db.connect().cursor()
+    stats = blob_store.stats(cursor)
+    logging.info(f"Page storage: {stats['blobs']} blobs, {stats['raw_bytes']} bytes of text stored in "
+                 f"{stats['stored_bytes']} bytes ({stats['ratio']:.1f}x compression)")
+    print(f"Stored page texts and summaries: {stats['blobs']}")
+    print(f"Uncompressed size: {stats['raw_bytes'] / 1024:.1f} KB")
+    print(f"Stored size: {stats['stored_bytes'] / 1024:.1f} KB")
+    print(f"Compression ratio: {stats['ratio']:.1f}x")
+    return stats
+
 def view_errors():
+    cursor = db.connect().cursor()
     cursor.execute('SELECT * FROM errors')
     errors = cursor.fetchall()
     if not errors:
@@ -244,11 +479,6 @@ def view_errors():
             print(f"ID: {error[0]}, URL: {error[1]}, Error: {error[2]}, Timestamp: {error[3]}")
 
 def get_seed_urls():
+    cursor = db.connect().cursor()
     cursor.execute('SELECT url FROM seed_urls WHERE status != "completed"')
     return [row[0] for row in cursor.fetchall()]
-
-# Ensure the database connection is closed when the module is unloaded
-@atexit.register
-def close_connection():
-    conn.close()
-    logging.info("Database connection closed")
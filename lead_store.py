@@ -0,0 +1,282 @@
+import re
+import json
+import time
+import sqlite3
+import unicodedata
+import blob_store
+
+# Keys the extraction prompt asks for, matched loosely because the model
+# doesn't always keep the exact spelling ("Company Name", "company_name", ...)
+EXTRACTION_FIELDS = {
+    'companyname': 'extracted_company_name',
+    'name': 'extracted_company_name',
+    'description': 'description',
+    'industry': 'industry',
+    'numberofemployees': 'employees',
+    'employees': 'employees',
+    'employeecount': 'employees',
+    'revenue': 'revenue',
+    'address': 'address',
+}
+
+def _field_key(key):
+    return re.sub(r'[^a-z]', '', str(key).lower())
+
+def _as_text(value):
+    if value is None:
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    text = str(value).strip()
+    return None if not text or text.lower() in ('not found', 'n/a', 'none', 'unknown') else text
+
+AMOUNT_UNITS = {'k': 1e3, 'thousand': 1e3, 'm': 1e6, 'mm': 1e6, 'mn': 1e6, 'million': 1e6,
+                'b': 1e9, 'bn': 1e9, 'billion': 1e9, 't': 1e12, 'trillion': 1e12}
+# A number with an optional unit; longer unit names are tried first
+UNIT_NAMES = '|'.join(sorted(AMOUNT_UNITS, key=len, reverse=True))
+NUMBER_PATTERN = re.compile(rf'(\d[\d,]*(?:\.\d+)?)\s*({UNIT_NAMES})?\b', re.IGNORECASE)
+CURRENCY_PATTERN = r'(?:[$€£¥]|\b(?:usd|eur|gbp|dollars?|euros?)\b)'
+HEADCOUNT_PATTERN = r'(?:employees?|staff|people|workers|persons)\b'
+
+def _numbers(text):
+    # (value with its unit applied, unit, text before, text after) for each
+    # number in the text
+    for match in NUMBER_PATTERN.finditer(text):
+        value = float(match.group(1).replace(',', ''))
+        if match.group(2):
+            value *= AMOUNT_UNITS[match.group(2).lower()]
+        yield value, match.group(2), text[:match.start()], text[match.end():]
+
+def parse_count(value):
+    # "1,200", "50-100", "about 10k employees", "founded 2010, 250 staff",
+    # "1.5 million" -> 1200, 50, 10000, 250, 1500000. A number followed by a
+    # word for people wins, then one with a unit, then the first.
+    if isinstance(value, (int, float)):
+        return int(value)
+    numbers = list(_numbers(str(value or '')))
+    if not numbers:
+        return None
+    for count, unit, before, after in numbers:
+        if re.match(r'\s*\+?\s*' + HEADCOUNT_PATTERN, after, re.IGNORECASE):
+            return int(count)
+    for count, unit, before, after in numbers:
+        if unit:
+            return int(count)
+    return int(numbers[0][0])
+
+def parse_amount(value):
+    # "$12.5M", "USD 3 billion", "1,200,000", "2019 revenue of $5M"
+    # -> 12500000.0, 3000000000.0, 1200000.0, 5000000.0. A number next to a
+    # currency wins, then one with a unit, then the first.
+    if isinstance(value, (int, float)):
+        return float(value)
+    numbers = list(_numbers(str(value or '')))
+    if not numbers:
+        return None
+    for amount, unit, before, after in numbers:
+        if re.search(CURRENCY_PATTERN + r'\s*$', before, re.IGNORECASE) or \
+                re.match(r'\s*' + CURRENCY_PATTERN, after, re.IGNORECASE):
+            return amount
+    for amount, unit, before, after in numbers:
+        if unit:
+            return amount
+    return numbers[0][0]
+
+def extraction_columns(info):
+    columns = {
+        'extracted_company_name': None, 'description': None, 'industry': None,
+        'employees': None, 'revenue': None, 'address': None
+    }
+    for key, value in info.items():
+        column = EXTRACTION_FIELDS.get(_field_key(key))
+        if column and columns[column] is None:
+            columns[column] = _as_text(value)
+    columns['employee_count'] = parse_count(columns.pop('employees'))
+    columns['revenue_amount'] = parse_amount(columns['revenue'])
+    return columns
+
+def contact_rows(lead_id, contacts):
+    return [(lead_id, _as_text(c.get('name')), _as_text(c.get('email')), _as_text(c.get('phone')),
+             _as_text(c.get('title'))) for c in contacts]
+
+# What the search index holds for each lead: its names, description, Exa
+# summary and page text, read back from the compressed pages (blob_text is
+# registered by db.connect)
+SEARCH_COLUMNS = 'rowid, company_name, description, summary, page_text'
+SEARCH_DOCUMENT_SQL = '''
+    SELECT leads.id, trim(coalesce(leads.company_name, '') || ' ' || coalesce(leads.extracted_company_name, '')),
+           leads.description,
+           (SELECT blob_text(summary_blob) FROM lead_pages WHERE lead_id = leads.id AND source = 'exa'),
+           (SELECT group_concat(text, char(10)) FROM (
+               SELECT blob_text(text_blob) AS text FROM lead_pages WHERE lead_id = leads.id ORDER BY source))
+    FROM leads
+'''
+
+def unindex_statement(lead_id):
+    # The search index keeps no copy of the text, so removing a lead means
+    # handing it exactly the text it indexed. Run this before changing
+    # anything the lead's document is built from, and index_statement after.
+    return (f'''
+        INSERT INTO leads_fts (leads_fts, {SEARCH_COLUMNS})
+        SELECT 'delete', * FROM ({SEARCH_DOCUMENT_SQL} WHERE leads.id = ?)
+        WHERE EXISTS (SELECT 1 FROM leads_fts WHERE rowid = ?)
+    ''', (lead_id, lead_id), False)
+
+def index_statement(lead_id):
+    return (f'''
+        INSERT INTO leads_fts ({SEARCH_COLUMNS})
+        {SEARCH_DOCUMENT_SQL} WHERE leads.id = ? AND NOT EXISTS (SELECT 1 FROM leads_fts WHERE rowid = leads.id)
+    ''', (lead_id,), False)
+
+def research_statements(lead_id, info, model=None, prompt_version=None):
+    # Statements that store one lead's research result; run them together
+    info = dict(info)
+    contacts = info.pop('contacts', []) or []
+    info.pop('website', None)
+    error = info.pop('error', None)
+    columns = extraction_columns(info)
+
+    statements = [unindex_statement(lead_id), (
+        '''
+        UPDATE leads
+        SET status = 'researched', extracted_company_name = ?, description = ?, industry = ?,
+            employee_count = ?, revenue = ?, revenue_amount = ?, address = ?, contact_count = ?,
+            research_error = ?, additional_info = NULL
+        WHERE id = ?
+        ''',
+        (columns['extracted_company_name'], columns['description'], columns['industry'],
+         columns['employee_count'], columns['revenue'], columns['revenue_amount'], columns['address'], len(contacts),
+         str(error) if error else None, lead_id),
+        False
+    ), (
+        'DELETE FROM lead_contacts WHERE lead_id = ?', (lead_id,), False
+    )]
+    if contacts:
+        statements.append((
+            'INSERT INTO lead_contacts (lead_id, name, email, phone, title) VALUES (?, ?, ?, ?, ?)',
+            contact_rows(lead_id, contacts),
+            True
+        ))
+    if info or error:
+        statements.append((
+            '''
+            INSERT OR REPLACE INTO lead_extractions (lead_id, model, prompt_version, data, extracted_at)
+            VALUES (?, ?, ?, ?, ?)
+            ''',
+            (lead_id, model, prompt_version, json.dumps(info if not error else {'error': str(error)}), time.time()),
+            False
+        ))
+    statements.append(index_statement(lead_id))
+    return statements
+
+def execute_research(conn, lead_id, info, model=None, prompt_version=None):
+    for sql, params, many in research_statements(lead_id, info, model, prompt_version):
+        if many:
+            conn.executemany(sql, params)
+        else:
+            conn.execute(sql, params)
+
+def save_page(cursor, lead_id, source, text, summary=None):
+    # Text is compressed into the blob store; the upsert's trigger frees the
+    # blobs it replaces
+    cursor.execute('''
+        INSERT INTO lead_pages (lead_id, source, text_blob, summary_blob, text_size, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (lead_id, source) DO UPDATE SET
+            text_blob = excluded.text_blob,
+            summary_blob = excluded.summary_blob,
+            text_size = excluded.text_size,
+            fetched_at = excluded.fetched_at
+    ''', (lead_id, source, blob_store.put(cursor, text), blob_store.put(cursor, summary),
+          len(text or ''), time.time()))
+
+def load_page(cursor, lead_id, source):
+    # (text, summary), decompressed only now that a caller needs them
+    cursor.execute('SELECT text_blob, summary_blob FROM lead_pages WHERE lead_id = ? AND source = ?',
+                   (lead_id, source))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return blob_store.get(cursor, row[0]), blob_store.get(cursor, row[1])
+
+def load_contacts(cursor, lead_id):
+    cursor.execute('SELECT name, email, phone, title FROM lead_contacts WHERE lead_id = ? ORDER BY id', (lead_id,))
+    return [{'name': row[0], 'email': row[1], 'phone': row[2], 'title': row[3]} for row in cursor.fetchall()]
+
+def status_counts(cursor):
+    # Served from idx_leads_status without touching the lead rows
+    cursor.execute('SELECT status, COUNT(*) FROM leads GROUP BY status ORDER BY status')
+    return dict(cursor.fetchall())
+
+def leads_after(cursor, after_id, limit):
+    # Keyset pagination: seeks straight to the id instead of counting past an offset
+    cursor.execute('SELECT id, company_name, status FROM leads WHERE id > ? ORDER BY id LIMIT ?', (after_id, limit))
+    return cursor.fetchall()
+
+def leads_before(cursor, before_id, limit):
+    cursor.execute('SELECT id, company_name, status FROM leads WHERE id < ? ORDER BY id DESC LIMIT ?', (before_id, limit))
+    return cursor.fetchall()[::-1]
+
+def fts_query(query):
+    # Quotes every word, for input that isn't valid FTS5 query syntax
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+# Words shown around the matches in a search result
+SNIPPET_WORDS = 12
+
+def _fold(word):
+    # Lowercase without diacritics, as the index tokenizer sees words
+    word = unicodedata.normalize('NFKD', word.lower())
+    return ''.join(c for c in word if not unicodedata.combining(c))
+
+def query_terms(query):
+    # The words of a search (not its operators or column names), cut to a
+    # rough stem so "companies" still marks "company"
+    words = re.findall(r'\b(\w+)\b(?!:)', query)
+    return [_fold(word)[:max(3, len(word) - 3)] for word in words if word not in ('AND', 'OR', 'NOT', 'NEAR')]
+
+def snippet(document, terms, size=SNIPPET_WORDS):
+    # The run of size words with the most matches, matches in [brackets].
+    # Earlier fields win ties, so a name match beats the same word in page text.
+    best = None
+    for text in document:
+        words = (text or '').split()
+        if not words:
+            continue
+        hits = [any(re.sub(r'^\W+', '', _fold(word)).startswith(term) for term in terms) for word in words]
+        count = sum(hits[:size])
+        start, most = 0, count
+        for i in range(size, len(words)):
+            count += hits[i] - hits[i - size]
+            if count > most:
+                start, most = i - size + 1, count
+        if best is None or most > best[0]:
+            best = (most, words, hits, start)
+    if best is None:
+        return ''
+    _, words, hits, start = best
+    shown = [f'[{word}]' if hit else word for word, hit in zip(words[start:start + size], hits[start:start + size])]
+    return ('...' if start > 0 else '') + ' '.join(shown) + ('...' if start + size < len(words) else '')
+
+def search(cursor, query, limit=20):
+    # BM25-ranked matches; name and description hits outweigh page text hits.
+    # The index holds no text, so snippets come from the decompressed pages.
+    sql = '''
+        SELECT leads.id, leads.company_name, leads.website, leads.status,
+               bm25(leads_fts, 10.0, 5.0, 2.0, 1.0) AS rank
+        FROM leads_fts JOIN leads ON leads.id = leads_fts.rowid
+        WHERE leads_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    '''
+    try:
+        cursor.execute(sql, (query, limit))
+    except sqlite3.OperationalError:
+        cursor.execute(sql, (fts_query(query), limit))
+    rows = cursor.fetchall()
+    if not rows:
+        return rows
+    cursor.execute(f"{SEARCH_DOCUMENT_SQL} WHERE leads.id IN ({', '.join('?' * len(rows))})", [row[0] for row in rows])
+    documents = {row[0]: row[1:] for row in cursor.fetchall()}
+    terms = query_terms(query)
+    return [row + (snippet(documents.get(row[0], ()), terms),) for row in rows]
@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import db
+import metrics
+
+# Seconds a memoized response is kept
+MEMO_MAX_AGE = float(os.getenv('LLM_MEMO_MAX_AGE', str(30 * 24 * 3600)))
+
+_evicted = False
+stats = {'hits': 0, 'misses': 0}
+
+def _connection():
+    # Old entries are cleared once per process, on first use
+    global _evicted
+    conn = db.connect()
+    if not _evicted:
+        _evicted = True
+        _evict(conn, MEMO_MAX_AGE)
+    return conn
+
+def prompt_version(template, **params):
+    # Any edit to the template or generation parameters yields a new version,
+    # so results produced by an older prompt are never returned
+    payload = json.dumps({'template': template, 'params': params}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def input_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def get(model, version, text):
+    key = (model, version, input_hash(text))
+    row = _connection().execute('''
+        SELECT response FROM llm_memo
+        WHERE model = ? AND prompt_version = ? AND input_hash = ?
+    ''', key).fetchone()
+    if row is None:
+        stats['misses'] += 1
+        metrics.inc('cache_requests_total', cache='llm_memo', result='miss')
+        return None
+    db.write('''
+        UPDATE llm_memo SET hits = hits + 1
+        WHERE model = ? AND prompt_version = ? AND input_hash = ?
+    ''', key)
+    stats['hits'] += 1
+    metrics.inc('cache_requests_total', cache='llm_memo', result='hit')
+    return json.loads(row[0])
+
+def put(model, version, text, response):
+    db.write('''
+        INSERT OR REPLACE INTO llm_memo (model, prompt_version, input_hash, response, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (model, version, input_hash(text), json.dumps(response), time.time()))
+
+def _evict(conn, max_age):
+    deleted = conn.execute('DELETE FROM llm_memo WHERE created_at < ?', (time.time() - max_age,)).rowcount
+    conn.commit()
+    if deleted:
+        logging.info(f"Evicted {deleted} memoized LLM responses older than {max_age / 86400:.0f} days")
+    return deleted
+
+def log_stats():
+    total = stats['hits'] + stats['misses']
+    hit_rate = stats['hits'] / total if total else 0.0
+    logging.info(f"LLM memo: {stats['hits']} hits, {stats['misses']} misses ({hit_rate:.0%} hit rate)")
+    return dict(stats)
@@ -1,14 +1,27 @@
 import os
+import sys
+import json
+import time
 import argparse
 import getpass
 import logging
-import sqlite3  # Add this import
 from dotenv import load_dotenv, set_key
+# Only modules that are cheap to import are loaded here, so commands like
+# status start at once; the research stack, exporter and API SDKs are
+# imported by the commands that use them
 from lead_agent import (
     add_seed_url, remove_seed_url, check_status, bulk_add_urls,
-    find_similar_websites, view_leads, delete_lead, view_errors, initialize_exa, get_seed_urls
+    find_similar_websites, view_leads, delete_lead, view_errors, get_exa, get_seed_urls,
+    find_similar_bulk, FIND_SIMILAR_WORKERS, view_storage_stats, search_leads,
+    dedupe_leads, view_stats, view_lead_trace, view_lead_details
 )
-from research_crew import conduct_research, initialize_research_tools, check_leads_table
+from url_utils import canonicalize_url
+import scrape_cache
+import scoring
+import research_tasks
+import metrics
+import db
+import lead_store
 
 # Set up logging
 logging.basicConfig(filename='lead_agent.log', level=logging.INFO,
@@ -23,15 +36,29 @@ def print_welcome():
     print("  remove <URL>        - Remove a specific seed URL")
     print("  status [URL]        - Check status of all URLs or a specific URL")
     print("  bulk-add <FILE>     - Bulk add URLs from a text file")
-    print("  find-similar        - Find similar websites for seed URLs")
+    print("  find-similar [N]    - Find similar websites for seed URLs (N = parallel workers)")
     print("  view-leads          - View all leads")
+    print("  search <QUERY>      - Full-text search over lead names, descriptions and page text")
     print("  delete-lead <ID>    - Delete a specific lead")
     print("  view-errors         - View all errors")
     print("  help                - Show this help message")
     print("  exit                - Exit the program")
-    print("  research-leads      - Conduct research on leads")
+    print("  research-leads [N] [--batch K] [--budget B] [--no-cache]")
+    print("                      - Conduct research on leads, highest priority first")
+    print("                        (N = concurrent workers, K = leads per Groq request,")
+    print("                        B = most leads to research this run)")
+    print("  score-leads         - Recompute every lead's priority score")
+    print("  refresh [DAYS]      - Queue leads researched more than DAYS ago (default 30) for research again")
+    print("  stats [json|prometheus] - Show stage latencies, provider calls and cache hit rates")
+    print("  trace <ID>          - Show the stage timings recorded for a lead (LEAD_TRACE=1)")
     print("  add-test-lead        - Add a test lead to the database")
     print("  check-leads         - Check the leads table")
+    print("  storage-stats       - Show how well page text is compressed")
+    print("  dedupe              - Find near-duplicate leads among those not yet indexed")
+    print("  export <FILE> [--format csv|jsonl|parquet] [--status S[,S]] [--min-score X]")
+    print("         [--source URL] [--incremental NAME] [--with-text]")
+    print("                      - Export leads and contacts (format defaults to the file extension;")
+    print("                        --incremental only writes leads changed since the last NAME export)")
 
 def setup():
     print("Welcome to Lead Agent Setup!")
@@ -73,27 +100,170 @@ def select_seed_url():
         except ValueError:
             print("Please enter a valid number.")
 
+def parse_research_options(args):
+    options = {'concurrency': None, 'batch_size': None, 'budget': None, 'bypass_cache': False}
+    args = list(args)
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == '--no-cache':
+                options['bypass_cache'] = True
+            elif arg == '--batch':
+                options['batch_size'] = int(args.pop(0))
+            elif arg == '--budget':
+                options['budget'] = int(args.pop(0))
+            elif options['concurrency'] is None:
+                options['concurrency'] = int(arg)
+            else:
+                return None
+    except (ValueError, IndexError):
+        return None
+    return options
+
+def parse_export_options(args):
+    if not args or args[0].startswith('--'):
+        return None
+    options = {'path': args[0], 'export_format': None, 'statuses': None, 'min_score': None,
+               'source': None, 'incremental': None, 'include_text': False}
+    args = list(args[1:])
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == '--with-text':
+                options['include_text'] = True
+            elif arg == '--format':
+                options['export_format'] = args.pop(0).lower()
+            elif arg == '--status':
+                options['statuses'] = args.pop(0).split(',')
+            elif arg == '--min-score':
+                options['min_score'] = float(args.pop(0))
+            elif arg == '--source':
+                options['source'] = args.pop(0)
+            elif arg == '--incremental':
+                options['incremental'] = args.pop(0)
+            else:
+                return None
+    except (ValueError, IndexError):
+        return None
+    return options
+
 def add_test_lead():
-    conn = sqlite3.connect('leads.db')
+    conn = db.connect()
     cursor = conn.cursor()
     cursor.execute('''
         INSERT INTO leads (company_name, website, status)
         VALUES (?, ?, ?)
     ''', ('Test Company', 'https://www.atouchofclassbridal.com/', 'new'))
+    db.execute_statements(conn, [lead_store.index_statement(cursor.lastrowid)])
     conn.commit()
-    conn.close()
     print("Test lead added to the database")
 
-def main():
+REQUIRED_KEYS = ['EXA_API_KEY', 'GROQ_API_KEY', 'APOLLO_API_KEY']
+# API keys each non-interactive command needs before it starts
+COMMAND_KEYS = {
+    'find-similar': ['EXA_API_KEY'],
+    'research': ['GROQ_API_KEY', 'APOLLO_API_KEY'],
+    'daemon': REQUIRED_KEYS,
+}
+# Commands whose metrics are saved as a snapshot when they exit, for the
+# stats command to read from another process. The daemon starts its own.
+METERED_COMMANDS = ('find-similar', 'research', 'research-leads')
+
+def missing_keys(keys):
+    return [key for key in keys if not os.getenv(key)]
+
+def run_research(concurrency=None, batch_size=None, budget=None, bypass_cache=False):
+    from research_crew import conduct_research
+    use_cache = scrape_cache.CACHE_ENABLED
+    scrape_cache.set_enabled(use_cache and not bypass_cache)
+    print("Starting research process...")
+    try:
+        conduct_research(concurrency, batch_size, budget)
+    finally:
+        scrape_cache.set_enabled(use_cache)
+    print("Research process completed.")
+
+def print_lead_counts():
+    from research_crew import check_leads_table
+    counts = check_leads_table()
+    print(f"Total leads: {sum(counts.values())}")
+    for status, count in counts.items():
+        print(f"  {status}: {count}")
+
+def print_stats(view):
+    # This process's metrics, for the interactive prompt
+    if view == 'json':
+        print(json.dumps(metrics.snapshot(), indent=2))
+    elif view == 'prometheus':
+        print(metrics.prometheus_text(), end='')
+    elif view == 'summary':
+        view_stats()
+    else:
+        return False
+    return True
+
+def print_saved_stats(view):
+    # A stats command starts with no metrics of its own, so it shows the
+    # daemon's (from METRICS_PORT) or the last snapshot a run wrote. Returns
+    # the exit code.
+    if view == 'prometheus':
+        text = metrics.load_prometheus_text()
+        if text is None:
+            print("Prometheus text is served by a running daemon; set METRICS_PORT to where it listens.",
+                  file=sys.stderr)
+            return 1
+        print(text, end='')
+        return 0
+    metrics_snapshot = metrics.load_snapshot()
+    if metrics_snapshot is None:
+        print(f"No metrics yet: no daemon serving on METRICS_PORT and no snapshot at {metrics.SNAPSHOT_PATH} "
+              f"(research, find-similar, daemon and interactive runs write one).", file=sys.stderr)
+        return 1
+    if view == 'json':
+        print(json.dumps(metrics_snapshot, indent=2))
+    else:
+        recorded = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(metrics_snapshot.get('time', 0)))
+        print(f"Metrics as of {recorded}:")
+        view_stats(metrics_snapshot)
+    return 0
+
+def rescore_leads():
+    rows, changed, elapsed = scoring.rescore_all(db.connect())
+    print(f"Rescored {rows} leads in {elapsed:.1f}s ({changed} changed)")
+
+def refresh_leads(days=None, limit=None):
+    # Queues researched leads older than days for research again
+    max_age = research_tasks.REFRESH_AGE if days is None else days * 86400
+    requeued = research_tasks.requeue_stale(max_age, limit)
+    counts = research_tasks.freshness(max_age)
+    print(f"Requeued {requeued} leads last researched over {max_age / 86400:g} days ago")
+    print(f"Researched leads: {counts['current']} current, {counts['stale']} stale, "
+          f"{counts['queued']} queued for a refresh")
+    if counts['oldest_scrape']:
+        print(f"Oldest page scraped: {time.strftime('%Y-%m-%d %H:%M', time.localtime(counts['oldest_scrape']))}")
+    if requeued:
+        print("Run 'research' (or keep 'daemon' running) to refresh them; unchanged pages skip extraction "
+              "and unchanged companies keep their contacts.")
+
+def export(options):
+    import exporter
+    try:
+        rows = exporter.export_leads(**options)
+        print(f"Exported {rows} leads to {options['path']}")
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f"Export failed: {str(e)}")
+        return False
+    return True
+
+def interactive():
     # Check if .env file exists and contains all required API keys
-    required_keys = ['EXA_API_KEY', 'GROQ_API_KEY', 'APOLLO_API_KEY']
-    if not os.path.exists('.env') or not all(key in os.environ for key in required_keys):
+    if not os.path.exists('.env') or missing_keys(REQUIRED_KEYS):
         setup()
     
     load_dotenv()  # Reload environment variables
-    initialize_exa()  # Initialize Exa API client
-    initialize_research_tools()  # Initialize research tools
+    # The Exa and Groq clients are created when first needed
     
+    metrics.start()
     print_welcome()
 
     while True:
@@ -122,13 +292,23 @@ def main():
                 print("Invalid usage. Use 'status' or 'status <URL>'")
         elif action == 'bulk-add' and len(command) == 2:
             bulk_add_urls(command[1])
-        elif action == 'find-similar':
+        elif action == 'find-similar' and len(command) <= 2:
+            workers = FIND_SIMILAR_WORKERS
+            if len(command) == 2:
+                try:
+                    workers = int(command[1])
+                except ValueError:
+                    print("Invalid worker count. Please provide a valid integer.")
+                    continue
             urls = select_seed_url()
-            if urls:
-                for url in urls:
-                    find_similar_websites(url)
+            if urls and len(urls) > 1:
+                find_similar_bulk(urls, workers)
+            elif urls:
+                find_similar_websites(urls[0])
         elif action == 'view-leads':
             view_leads()
+        elif action == 'search' and len(command) > 1:
+            search_leads(' '.join(command[1:]))
         elif action == 'delete-lead' and len(command) == 2:
             try:
                 delete_lead(int(command[1]))
@@ -137,17 +317,192 @@ def main():
         elif action == 'view-errors':
             view_errors()
         elif action == 'research-leads':
-            print("Starting research process...")
-            conduct_research()
-            print("Research process completed.")
+            options = parse_research_options(command[1:])
+            if options is None:
+                print("Invalid usage. Use 'research-leads [N] [--batch K] [--budget B] [--no-cache]'")
+                continue
+            run_research(**options)
         elif action == 'add-test-lead':
             add_test_lead()
         elif action == 'check-leads':
-            all_leads = check_leads_table()
-            for lead in all_leads:
-                print(f"ID: {lead[0]}, Company: {lead[1]}, Website: {lead[2]}, Status: {lead[3]}")
+            print_lead_counts()
+        elif action == 'storage-stats':
+            view_storage_stats()
+        elif action == 'dedupe':
+            dedupe_leads()
+        elif action == 'stats' and len(command) <= 2:
+            if not print_stats(command[1].lower() if len(command) == 2 else 'summary'):
+                print("Invalid usage. Use 'stats', 'stats json' or 'stats prometheus'")
+        elif action == 'trace' and len(command) == 2:
+            try:
+                view_lead_trace(int(command[1]))
+            except ValueError:
+                print("Invalid lead ID. Please provide a valid integer.")
+        elif action == 'score-leads':
+            rescore_leads()
+        elif action == 'refresh' and len(command) <= 2:
+            try:
+                refresh_leads(float(command[1]) if len(command) == 2 else None)
+            except ValueError:
+                print("Invalid number of days. Use 'refresh [DAYS]'")
+        elif action == 'export':
+            options = parse_export_options(command[1:])
+            if options is None:
+                print("Invalid usage. Use 'export <FILE> [--format F] [--status S] [--min-score X] "
+                      "[--source URL] [--incremental NAME] [--with-text]'")
+                continue
+            export(options)
         else:
             print("Invalid command. Type 'help' for usage information.")
 
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='main.py', description="Lead Agent: find, research and export leads. "
+                                    "Without a command, starts the interactive prompt.")
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+
+    commands.add_parser('interactive', help="Start the interactive prompt (the default)")
+    command = commands.add_parser('add', help="Add a seed URL")
+    command.add_argument('url')
+    command = commands.add_parser('remove', help="Remove a seed URL")
+    command.add_argument('url')
+    command = commands.add_parser('status', help="Show the status of every seed URL, or of one")
+    command.add_argument('url', nargs='?')
+    command = commands.add_parser('bulk-add', help="Add seed URLs from a file, one per line")
+    command.add_argument('file')
+
+    command = commands.add_parser('find-similar', help="Find websites similar to seed URLs")
+    command.add_argument('urls', nargs='*', metavar='URL', help="Seed URLs to search for")
+    command.add_argument('--all', action='store_true', help="Search every seed not yet completed")
+    command.add_argument('--workers', type=int, default=FIND_SIMILAR_WORKERS, help="Seeds searched at once")
+
+    command = commands.add_parser('research', aliases=['research-leads'],
+                                  help="Research leads, highest priority first")
+    command.add_argument('--workers', type=int, dest='concurrency', help="Concurrent workers per stage")
+    command.add_argument('--batch', type=int, dest='batch_size', help="Leads per Groq request")
+    command.add_argument('--limit', type=int, dest='budget', help="Most leads to research this run")
+    command.add_argument('--no-cache', action='store_true', dest='bypass_cache', help="Bypass the scrape cache")
+
+    command = commands.add_parser('daemon', help="Keep searching new seeds and researching new leads")
+    command.add_argument('--interval', type=float, help="Seconds to wait when there is no work")
+    command.add_argument('--workers', type=int, dest='concurrency', help="Concurrent research workers per stage")
+    command.add_argument('--batch', type=int, dest='batch_size', help="Leads per Groq request")
+    command.add_argument('--limit', type=int, help="Most leads researched per pass")
+    command.add_argument('--find-similar-workers', type=int, help="Seeds searched at once")
+    command.add_argument('--once', action='store_true', help="Run a single pass and exit, e.g. from cron")
+    command.add_argument('--refresh-days', type=float,
+                         help="Refresh researched leads after this many days (0 turns refreshing off)")
+
+    command = commands.add_parser('refresh', help="Queue leads researched long ago for research again")
+    command.add_argument('--older-than', type=float, metavar='DAYS', help="Age in days that counts as stale "
+                                                                          "(defaults to RESEARCH_REFRESH_AGE)")
+    command.add_argument('--limit', type=int, help="Most leads to queue, highest priority first")
+
+    command = commands.add_parser('search', help="Full-text search over leads")
+    command.add_argument('query', nargs='+')
+    command.add_argument('--limit', type=int, default=20)
+    command = commands.add_parser('lead', help="Show a lead's details")
+    command.add_argument('lead_id', type=int)
+    command = commands.add_parser('delete-lead', help="Delete a lead")
+    command.add_argument('lead_id', type=int)
+    commands.add_parser('view-errors', help="Show recorded errors")
+    commands.add_parser('check-leads', help="Count leads by status")
+    commands.add_parser('storage-stats', help="Show how well page text is compressed")
+    commands.add_parser('dedupe', help="Find near-duplicate leads among those not yet indexed")
+    commands.add_parser('score-leads', help="Recompute every lead's priority score")
+    command = commands.add_parser('stats', help="Show stage latencies, provider calls and cache hit rates (the "
+                                                   "daemon's from METRICS_PORT, else the last research or "
+                                                   "find-similar run's snapshot)")
+    command.add_argument('view', nargs='?', default='summary', choices=['summary', 'json', 'prometheus'])
+    command = commands.add_parser('trace', help="Show the stage timings recorded for a lead (LEAD_TRACE=1)")
+    command.add_argument('lead_id', type=int)
+
+    command = commands.add_parser('export', help="Export leads and contacts")
+    command.add_argument('path', metavar='FILE')
+    command.add_argument('--format', dest='export_format', type=str.lower, help="csv, jsonl or parquet "
+                                                                                "(defaults to the file extension)")
+    command.add_argument('--status', dest='statuses', type=lambda value: value.split(','), metavar='S[,S]')
+    command.add_argument('--min-score', type=float)
+    command.add_argument('--source', metavar='URL')
+    command.add_argument('--incremental', metavar='NAME',
+                         help="Only write leads changed since the last export under this name")
+    command.add_argument('--with-text', action='store_true', dest='include_text')
+    return parser
+
+def run_command(args):
+    # Runs one command without prompting; returns the process exit code
+    missing = missing_keys(COMMAND_KEYS.get(args.command, []))
+    if missing:
+        print(f"Missing API keys: {', '.join(missing)}. Set them in the environment or .env "
+              f"(running 'python main.py' without a command walks through setup).", file=sys.stderr)
+        return 1
+    if args.command in METERED_COMMANDS:
+        # No endpoint: a running daemon may already be serving METRICS_PORT
+        metrics.start(port=None)
+
+    if args.command == 'add':
+        add_seed_url(args.url)
+    elif args.command == 'remove':
+        remove_seed_url(args.url)
+    elif args.command == 'status':
+        check_status(args.url)
+    elif args.command == 'bulk-add':
+        bulk_add_urls(args.file)
+    elif args.command == 'find-similar':
+        if args.all:
+            urls = get_seed_urls()
+        else:
+            urls = [canonicalize_url(url) or url for url in args.urls]
+        if not urls:
+            print("No seed URLs to search. Give URLs or --all.", file=sys.stderr)
+            return 1
+        if get_exa() is None:
+            return 1
+        find_similar_bulk(urls, args.workers)
+    elif args.command in ('research', 'research-leads'):
+        run_research(args.concurrency, args.batch_size, args.budget, args.bypass_cache)
+    elif args.command == 'daemon':
+        import daemon
+        daemon.run(args.interval if args.interval is not None else daemon.DAEMON_INTERVAL, args.concurrency,
+                   args.batch_size, args.limit if args.limit is not None else daemon.DAEMON_RESEARCH_LIMIT,
+                   args.find_similar_workers, args.once,
+                   research_tasks.REFRESH_AGE if args.refresh_days is None else args.refresh_days * 86400)
+    elif args.command == 'refresh':
+        refresh_leads(args.older_than, args.limit)
+    elif args.command == 'search':
+        search_leads(' '.join(args.query), args.limit)
+    elif args.command == 'lead':
+        view_lead_details(args.lead_id)
+    elif args.command == 'delete-lead':
+        delete_lead(args.lead_id)
+    elif args.command == 'view-errors':
+        view_errors()
+    elif args.command == 'check-leads':
+        print_lead_counts()
+    elif args.command == 'storage-stats':
+        view_storage_stats()
+    elif args.command == 'dedupe':
+        dedupe_leads()
+    elif args.command == 'score-leads':
+        rescore_leads()
+    elif args.command == 'stats':
+        return print_saved_stats(args.view)
+    elif args.command == 'trace':
+        view_lead_trace(args.lead_id)
+    elif args.command == 'export':
+        options = {key: getattr(args, key) for key in ('path', 'export_format', 'statuses', 'min_score', 'source',
+                                                       'incremental', 'include_text')}
+        if not export(options):
+            return 1
+    db.flush()
+    return 0
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command in (None, 'interactive'):
+        interactive()
+        return 0
+    return run_command(args)
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
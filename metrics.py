@@ -0,0 +1,291 @@
+import os
+import re
+import json
+import time
+import atexit
+import logging
+import threading
+import urllib.request
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import db
+
+# Where and how often the JSON snapshot is written; an interval of 0 turns
+# it off. By default it sits next to the database (read from the
+# environment, as db imports this module before setting DB_PATH).
+SNAPSHOT_PATH = os.getenv('METRICS_SNAPSHOT_PATH') or os.path.join(
+    os.path.dirname(os.getenv('LEAD_AGENT_DB', 'leads.db')), 'metrics.json')
+SNAPSHOT_INTERVAL = float(os.getenv('METRICS_SNAPSHOT_INTERVAL', '60'))
+# Port for the Prometheus text endpoint (/metrics); 0 leaves it off
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# Records every stage of every lead in lead_traces
+TRACE_ENABLED = os.getenv('LEAD_TRACE', '0') != '0'
+
+# Latency histogram bucket bounds in seconds, from fast SQLite writes to
+# slow LLM calls and backoffs
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_started = time.time()
+_snapshot_thread = None
+_server = None
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(BUCKETS) and value > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # Interpolated within the bucket holding the q-th observation, so
+        # accurate to the bucket width
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index > 0 else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+@contextmanager
+def timer(name, **labels):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - started, **labels)
+
+@contextmanager
+def stage(name, *lead_ids):
+    # Times a pipeline stage into stage_seconds and counts its failures. With
+    # tracing on, each lead the stage ran for gets a span in lead_traces.
+    started_at = time.time()
+    started = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        seconds = time.monotonic() - started
+        observe('stage_seconds', seconds, stage=name)
+        inc('stage_errors_total', stage=name)
+        trace(lead_ids, name, started_at, seconds, 'error', str(e))
+        raise
+    seconds = time.monotonic() - started
+    observe('stage_seconds', seconds, stage=name)
+    trace(lead_ids, name, started_at, seconds, 'ok')
+
+def trace(lead_ids, stage_name, started_at, seconds, outcome, detail=None):
+    if not TRACE_ENABLED or not lead_ids:
+        return
+    db.write_many('''
+        INSERT INTO lead_traces (lead_id, stage, started_at, seconds, outcome, detail) VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(lead_id, stage_name, started_at, seconds, outcome, detail) for lead_id in lead_ids])
+
+def load_trace(cursor, lead_id):
+    cursor.execute('''
+        SELECT stage, started_at, seconds, outcome, detail FROM lead_traces WHERE lead_id = ? ORDER BY started_at, id
+    ''', (lead_id,))
+    return [dict(zip(('stage', 'started_at', 'seconds', 'outcome', 'detail'), row)) for row in cursor.fetchall()]
+
+def _series_name(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{label}="{value}"' for label, value in labels) + '}'
+
+def snapshot():
+    with _lock:
+        counters = {_series_name(name, labels): value for (name, labels), value in sorted(_counters.items())}
+        histograms = {_series_name(name, labels): {
+            'count': histogram.count,
+            'sum': round(histogram.sum, 6),
+            'p50': round(histogram.quantile(0.5), 6),
+            'p95': round(histogram.quantile(0.95), 6),
+            'p99': round(histogram.quantile(0.99), 6),
+            'max': round(histogram.max, 6),
+        } for (name, labels), histogram in sorted(_histograms.items())}
+    return {'time': time.time(), 'uptime': time.time() - _started, 'counters': counters, 'histograms': histograms}
+
+def prometheus_text():
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, list(histogram.counts), histogram.sum, histogram.count)
+                            for key, histogram in _histograms.items())
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# TYPE {name} counter')
+        lines.append(f'{_series_name(name, labels)} {value}')
+    for (name, labels), counts, total, count in histograms:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# TYPE {name} histogram')
+        cumulative = 0
+        for bound, bucket_count in zip(list(BUCKETS) + ['+Inf'], counts):
+            cumulative += bucket_count
+            lines.append(f"{_series_name(name + '_bucket', labels + (('le', bound),))} {cumulative}")
+        lines.append(f"{_series_name(name + '_sum', labels)} {total}")
+        lines.append(f"{_series_name(name + '_count', labels)} {count}")
+    return '\n'.join(lines) + '\n'
+
+def write_snapshot(path=SNAPSHOT_PATH):
+    # Written to a temporary file first so readers never see half a snapshot
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(snapshot(), file, indent=2)
+    os.replace(temporary, path)
+
+def _try_write_snapshot(path):
+    try:
+        write_snapshot(path)
+    except OSError as e:
+        logging.warning(f"Could not write metrics snapshot to {path}: {str(e)}")
+
+def _write_snapshots(path, interval):
+    while True:
+        time.sleep(interval)
+        _try_write_snapshot(path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] == '/metrics':
+            body = prometheus_text().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path.split('?')[0] == '/metrics.json':
+            body = json.dumps(snapshot()).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start(snapshot_path=SNAPSHOT_PATH, interval=SNAPSHOT_INTERVAL, port=METRICS_PORT):
+    # Starts the periodic snapshot and the /metrics endpoint, as configured
+    global _snapshot_thread, _server
+    if interval > 0 and snapshot_path and _snapshot_thread is None:
+        _snapshot_thread = threading.Thread(target=_write_snapshots, args=(snapshot_path, interval),
+                                            name='metrics-snapshot', daemon=True)
+        _snapshot_thread.start()
+        # A last snapshot on exit, so short runs leave one behind too
+        atexit.register(_try_write_snapshot, snapshot_path)
+        logging.info(f"Writing metrics snapshots to {snapshot_path} every {interval:.0f}s")
+    if port and _server is None:
+        _server = ThreadingHTTPServer(('127.0.0.1', port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name='metrics-http', daemon=True).start()
+        logging.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+
+def _fetch(path, port=METRICS_PORT):
+    # A page from the metrics endpoint of a running daemon, None when none
+    # is serving
+    if not port:
+        return None
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=2) as response:
+            return response.read().decode('utf-8')
+    except OSError:
+        return None
+
+def load_snapshot(path=SNAPSHOT_PATH, port=METRICS_PORT):
+    # Metrics recorded by another process: the daemon's live numbers if it
+    # serves them, else the last snapshot written to path. None if neither.
+    body = _fetch('/metrics.json', port)
+    if body is not None:
+        return json.loads(body)
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def load_prometheus_text(port=METRICS_PORT):
+    # Only the endpoint has the histogram buckets; snapshots keep quantiles
+    return _fetch('/metrics', port)
+
+def _parse_series(series):
+    name, _, labels = series.partition('{')
+    return name, tuple(re.findall(r'(\w+)="([^"]*)"', labels))
+
+def summary_lines(metrics_snapshot=None):
+    # A snapshot (this process's by default) as a few readable tables, for
+    # the stats command
+    metrics_snapshot = metrics_snapshot or snapshot()
+    lines = []
+    histograms = metrics_snapshot.get('histograms', {})
+    counters = {_parse_series(series): value for series, value in metrics_snapshot.get('counters', {}).items()}
+    cache_requests = {labels: value for (name, labels), value in counters.items() if name == 'cache_requests_total'}
+
+    if histograms:
+        lines.append(f"{'Latency (s)':<44} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+        for series, histogram in histograms.items():
+            lines.append(f"  {series:<42} {histogram['count']:>7} {histogram['p50']:>8.3f} "
+                         f"{histogram['p95']:>8.3f} {histogram['p99']:>8.3f} {histogram['max']:>8.3f}")
+
+    providers = sorted({dict(labels)['provider'] for (name, labels) in counters
+                        if name.startswith('provider_') and 'provider' in dict(labels)})
+    if providers:
+        lines.append(f"{'Provider':<20} {'calls':>8} {'retries':>8} {'errors':>8} {'rejected':>8}")
+        for provider in providers:
+            values = [counters.get((f'provider_{key}_total', (('provider', provider),)), 0)
+                      for key in ('calls', 'retries', 'errors', 'rejected')]
+            lines.append(f"  {provider:<18} " + ' '.join(f'{value:>8}' for value in values))
+
+    caches = sorted({dict(labels)['cache'] for labels in cache_requests})
+    if caches:
+        lines.append('Cache hit rates')
+        for cache in caches:
+            hits = cache_requests.get((('cache', cache), ('result', 'hit')), 0)
+            misses = cache_requests.get((('cache', cache), ('result', 'miss')), 0)
+            rate = hits / (hits + misses) if hits + misses else 0.0
+            lines.append(f"  {cache:<18} {rate:>6.0%} ({hits} hits, {misses} misses)")
+
+    others = [(key, value) for key, value in counters.items()
+              if not key[0].startswith('provider_') and key[0] != 'cache_requests_total']
+    if others:
+        lines.append('Counters')
+        for (name, labels), value in others:
+            lines.append(f"  {_series_name(name, labels):<42} {value}")
+    return lines or ['No metrics recorded yet']
+
+def log_summary():
+    for line in summary_lines():
+        logging.info(f"Metrics: {line.strip()}")
+    return snapshot()
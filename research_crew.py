@@ -1,11 +1,20 @@
 import os
 from dotenv import load_dotenv
-import requests
-from bs4 import BeautifulSoup
+import db
+import lead_store
+import research_tasks
+import http_client
+import scrape_cache
+import llm_memo
+import condense
+import contact_cache
+import scheduler
+import html_extract
+import metrics
 import json
-import sqlite3
-from groq import Groq
 import logging
+import threading
+import research_pipeline
 
 # Set up logging
 logging.basicConfig(filename='lead_agent.log', level=logging.INFO,
@@ -14,23 +23,62 @@ logging.basicConfig(filename='lead_agent.log', level=logging.INFO,
 # Load environment variables
 load_dotenv()
 
-# Initialize API clients
-groq_client = Groq(api_key=os.getenv('GROQ_API_KEY'))
 APOLLO_API_KEY = os.getenv('APOLLO_API_KEY')
+APOLLO_BASE_URL = os.getenv('APOLLO_BASE_URL', 'https://api.apollo.io')
 
-def scrape_website(url):
-    try:
-        response = requests.get(url)
-        soup = BeautifulSoup(response.content, 'html.parser')
-        # Extract text from paragraphs, headings, and other relevant tags
-        text = ' '.join([tag.get_text() for tag in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li'])])
-        return text
-    except Exception as e:
-        print(f"Error scraping {url}: {str(e)}")
-        return ""
+# The Groq client is created on first use, so commands that never call the
+# LLM don't import its SDK
+_groq_client = None
+_groq_lock = threading.Lock()
 
-def extract_info_with_groq(text):
-    prompt = f"""
+def get_groq_client():
+    # Retries are handled by the scheduler, not the SDK. The SDK also reads
+    # GROQ_BASE_URL, which benchmarks use to point it at a local stand-in.
+    global _groq_client
+    if _groq_client is None:
+        with _groq_lock:
+            if _groq_client is None:
+                from groq import Groq
+                _groq_client = Groq(api_key=os.getenv('GROQ_API_KEY'), max_retries=0)
+    return _groq_client
+
+def fetch_page(url, headers):
+    response = http_client.get(url, headers=headers, max_bytes=html_extract.MAX_HTML_BYTES,
+                               truncate=html_extract.TRUNCATE)
+    metrics.inc('fetched_bytes_total', len(response.content), provider='scrape')
+    if response.status_code in scheduler.TRANSIENT_STATUS:
+        raise scheduler.TransientHTTPError(f"{url} returned {response.status_code}", response.status_code,
+                                           response.headers.get('Retry-After'))
+    return response
+
+def fetch_website_text(url, use_cache=None):
+    # Raises on failure; the research scrape stage relies on that to retry
+    if use_cache is None:
+        use_cache = scrape_cache.CACHE_ENABLED
+
+    cached = scrape_cache.lookup(url) if use_cache else None
+    response = scheduler.call('scrape', fetch_page, url, scrape_cache.conditional_headers(cached),
+                              host=scheduler.host_of(url))
+    if cached and response.status_code == 304:
+        scrape_cache.mark_hit(url)
+        return cached['text']
+
+    # Extract text from paragraphs, headings, and other relevant tags
+    text = html_extract.extract(response.content, response.truncated)
+    if use_cache and response.ok:
+        scrape_cache.store(url, text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    return text
+
+GROQ_MODEL = "llama3-8b-8192"
+GROQ_PARAMS = {
+    "temperature": 0.5,
+    "max_tokens": 1000,
+    "top_p": 1,
+    "stream": False,
+    "stop": None
+}
+
+EXTRACTION_PROMPT = """
     Extract the following information from the given text. If the information is not available, write "Not found":
     
     - Company Name
@@ -44,30 +92,60 @@ def extract_info_with_groq(text):
     
     Provide the answer in JSON format.
     """
+
+EXTRACTION_PROMPT_VERSION = llm_memo.prompt_version(EXTRACTION_PROMPT, **GROQ_PARAMS)
+
+def record_usage(completion):
+    # Token counts as reported by Groq
+    usage = getattr(completion, 'usage', None)
+    if usage is not None:
+        metrics.inc('llm_tokens_total', getattr(usage, 'prompt_tokens', 0) or 0, provider='groq', direction='in')
+        metrics.inc('llm_tokens_total', getattr(usage, 'completion_tokens', 0) or 0, provider='groq',
+                    direction='out')
+
+def condense_for_extraction(text, website):
+    with metrics.timer('stage_seconds', stage='condense'):
+        condensed, stats = condense.condense(text)
+    logging.info(f"Condensed {website} from {stats['tokens_in']} to {stats['tokens_out']} tokens "
+                 f"({stats['tokens_saved']} saved)")
+    return condensed
+
+def extract_info_with_groq(text):
+    cached = llm_memo.get(GROQ_MODEL, EXTRACTION_PROMPT_VERSION, text)
+    if cached is not None:
+        return cached
+
+    prompt = EXTRACTION_PROMPT.format(text=text)
     
     try:
-        completion = groq_client.chat.completions.create(
-            model="llama3-8b-8192",
+        completion = scheduler.call(
+            'groq',
+            get_groq_client().chat.completions.create,
+            model=GROQ_MODEL,
             messages=[
                 {
                     "role": "user",
                     "content": prompt
                 }
             ],
-            temperature=0.5,
-            max_tokens=1000,
-            top_p=1,
-            stream=False,
-            stop=None
+            **GROQ_PARAMS
         )
-        
-        return json.loads(completion.choices[0].message.content)
+        record_usage(completion)
+        extracted = json.loads(completion.choices[0].message.content)
+        llm_memo.put(GROQ_MODEL, EXTRACTION_PROMPT_VERSION, text, extracted)
+        return extracted
     except Exception as e:
         logging.error(f"Error in Groq API call: {str(e)}")
         return {"error": str(e)}
 
-def find_contacts_with_apollo(company_name):
-    url = "https://api.apollo.io/v1/mixed_people/search"
+def post_json(url, headers, data):
+    response = http_client.post(url, headers=headers, json=data)
+    metrics.inc('fetched_bytes_total', len(response.content), provider='apollo')
+    response.raise_for_status()
+    return response.json()
+
+def search_apollo_contacts(company_name, website=None):
+    url = f"{APOLLO_BASE_URL}/v1/mixed_people/search"
     
     headers = {
         "Content-Type": "application/json",
@@ -76,103 +154,185 @@ def find_contacts_with_apollo(company_name):
     }
     
     data = {
-        "q_organization_name": company_name,
         "page": 1,
         "per_page": 5
     }
-    
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        search_response = response.json()
-        
-        contacts = []
-        for person in search_response.get('people', []):
-            contact = {
-                'name': f"{person.get('first_name', '')} {person.get('last_name', '')}",
-                'email': person.get('email', 'Not found'),
-                'phone': person.get('phone_number', 'Not found'),
-                'title': person.get('title', 'Not found')
-            }
-            contacts.append(contact)
-        
-        return contacts
-    except Exception as e:
-        print(f"Error finding contacts for {company_name}: {str(e)}")
-        return []
-
-def get_leads_from_db():
-    conn = sqlite3.connect('leads.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, company_name, website FROM leads WHERE status = "new"')
-    leads = cursor.fetchall()
-    conn.close()
-    
-    logging.info(f"Retrieved {len(leads)} leads from the database")
-    if not leads:
-        logging.warning("No leads with 'new' status found in the database")
+    if company_name or not website:
+        data["q_organization_name"] = company_name
     else:
-        for lead in leads:
-            logging.info(f"Lead found: ID={lead[0]}, Company={lead[1]}, Website={lead[2]}")
+        # No usable name, so search by the lead's domain instead
+        data["q_organization_domains"] = contact_cache.normalize_domain(website)
     
-    return leads
-
-def update_lead_in_db(lead_id, info):
-    conn = sqlite3.connect('leads.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE leads
-        SET status = ?, additional_info = ?
-        WHERE id = ?
-    ''', ('researched', json.dumps(info), lead_id))
-    conn.commit()
-    conn.close()
-
-def conduct_research():
-    logging.info("Starting research process")
-    check_leads_table()  # Add this line
-    leads = get_leads_from_db()
-    logging.info(f"Found {len(leads)} leads to research")
+    search_response = scheduler.call('apollo', post_json, url, headers, data)
+    
+    contacts = []
+    for person in search_response.get('people', []):
+        contact = {
+            'name': f"{person.get('first_name', '')} {person.get('last_name', '')}",
+            'email': person.get('email', 'Not found'),
+            'phone': person.get('phone_number', 'Not found'),
+            'title': person.get('title', 'Not found')
+        }
+        contacts.append(contact)
     
-    for lead_id, company_name, website in leads:
-        logging.info(f"Researching: {company_name}")
-        print(f"Researching: {company_name}")
-        
+    return contacts
+
+def lookup_contacts(company_name, website=None):
+    # Raises on failure, so the contacts stage can retry
+    return contact_cache.get_contacts(company_name, search_apollo_contacts, website)
+
+def find_contacts_bulk(leads, workers=4):
+    # Searches each distinct organization in a batch of (id, company, website)
+    # rows once and returns {lead_id: contacts, or the exception the search
+    # raised}. Leads without a usable name or domain map to None.
+    found = contact_cache.lookup_many([(company_name, website) for _, company_name, website in leads],
+                                      search_apollo_contacts, workers)
+    return {lead_id: found.get(contact_cache.org_key(company_name, website))
+            for lead_id, company_name, website in leads}
+
+def build_lead_info(website, extracted_info, contacts):
+    return {
+        **extracted_info,
+        'website': website,
+        'contacts': contacts
+    }
+
+def skip_unchanged_extraction(task):
+    # On a refresh the stored extraction stands if the page text, model and
+    # prompt (single-lead or batch) are all the same as when it was made
+    prompt_versions = research_pipeline.batch_extract.current_prompt_versions()
+    if task['extract_status'] != 'done' and research_tasks.extraction_current(task, GROQ_MODEL, prompt_versions):
+        research_tasks.skip_stage(task, 'extract')
+
+def scrape_stage(task):
+    if task['scrape_status'] == 'done':
+        skip_unchanged_extraction(task)
+        # The stored text is only needed if extraction still has to run
+        if task['extract_status'] == 'done':
+            return None
+        return research_tasks.load_scraped_text(task['lead_id'])
+    with metrics.stage('scrape', task['lead_id']):
+        text = fetch_website_text(task['website'])
+        logging.info(f"Scraped {len(text)} characters from {task['website']}")
+        if not research_tasks.save_scraped_text(task, text):
+            metrics.inc('pages_unchanged_total')
+    skip_unchanged_extraction(task)
+    return text
+
+def save_extraction_stage(task, extracted, prompt_version=EXTRACTION_PROMPT_VERSION):
+    # extract_info_with_groq reports API failures as {"error": ...}.
+    # prompt_version is that of the prompt that produced the result.
+    if not isinstance(extracted, dict) or set(extracted) == {'error'}:
+        raise RuntimeError((extracted or {}).get('error', 'No extraction result'))
+    logging.info(f"Extracted info using Groq: {json.dumps(extracted)}")
+    research_tasks.save_extraction(task, extracted, GROQ_MODEL, prompt_version)
+    return extracted
+
+def extract_stage(task, scraped_text):
+    # (extracted info, version of the prompt that produced it)
+    if task['extract_status'] == 'done':
+        return research_tasks.load_extraction(task['lead_id'])
+    # Trim boilerplate and keep the passages most relevant to the prompt
+    condensed_text = condense_for_extraction(scraped_text, task['website'])
+    with metrics.stage('extract', task['lead_id']):
+        return save_extraction_stage(task, extract_info_with_groq(condensed_text)), EXTRACTION_PROMPT_VERSION
+
+def contacts_stage(task, found=None):
+    # found is a search result obtained up front (contacts or an exception)
+    if task['contacts_status'] == 'done':
+        return research_tasks.load_contacts(task['lead_id'])
+    with metrics.stage('contacts', task['lead_id']):
+        contacts = found if found is not None else lookup_contacts(task['company_name'], task['website'])
+        if isinstance(contacts, Exception):
+            raise contacts
+        logging.info(f"Found {len(contacts)} contacts using Apollo")
+        research_tasks.save_contacts(task, contacts)
+    return contacts
+
+def finish_task(task, failures, extracted_info=None, contacts=None, prompt_version=EXTRACTION_PROMPT_VERSION):
+    company_name = task['company_name']
+    full_info = None if failures else build_lead_info(task['website'], extracted_info, contacts)
+    with metrics.stage('finish', task['lead_id']):
+        state = research_tasks.finish(task, failures, full_info, GROQ_MODEL, prompt_version)
+    metrics.inc('research_tasks_total', state=state)
+
+    if state == 'done':
+        logging.info(f"Research completed for {company_name}")
+        print(f"Research completed for {company_name}")
+        print(json.dumps(full_info, indent=2))
+        print("\n" + "="*50 + "\n")
+        return full_info
+
+    error = '; '.join(f"{stage}: {str(e)}" for stage, e in failures.items()) or "lease lost"
+    logging.error(f"Error researching {company_name}: {error}")
+    retry = " (will retry)" if state == 'pending' else ""
+    print(f"Error researching {company_name}: {error}{retry}")
+    return {"error": error}
+
+def research_task(task, found_contacts=None):
+    # Runs whichever stages haven't completed yet; a failure in one stage
+    # doesn't discard the others' results
+    logging.info(f"Researching: {task['company_name']}")
+    print(f"Researching: {task['company_name']}")
+
+    failures = {}
+    extracted_info = contacts = None
+    prompt_version = EXTRACTION_PROMPT_VERSION
+    try:
+        scraped_text = scrape_stage(task)
         try:
-            # Scrape website
-            scraped_text = scrape_website(website)
-            logging.info(f"Scraped {len(scraped_text)} characters from {website}")
-            
-            # Extract info with Groq
-            extracted_info = extract_info_with_groq(scraped_text)
-            logging.info(f"Extracted info using Groq: {json.dumps(extracted_info)}")
-            
-            # Find contacts with Apollo
-            contacts = find_contacts_with_apollo(company_name)
-            logging.info(f"Found {len(contacts)} contacts using Apollo")
-            
-            # Combine all information
-            full_info = {
-                **extracted_info,
-                'website': website,
-                'contacts': contacts
-            }
-            
-            # Update the lead in the database
-            update_lead_in_db(lead_id, full_info)
-            
-            logging.info(f"Research completed for {company_name}")
-            print(f"Research completed for {company_name}")
-            print(json.dumps(full_info, indent=2))
-            print("\n" + "="*50 + "\n")
-        
+            extracted_info, prompt_version = extract_stage(task, scraped_text)
         except Exception as e:
-            logging.error(f"Error researching {company_name}: {str(e)}")
-            print(f"Error researching {company_name}: {str(e)}")
-            update_lead_in_db(lead_id, {"error": str(e)})
-    
+            failures['extract'] = e
+    except Exception as e:
+        failures['scrape'] = e
+    try:
+        contacts = contacts_stage(task, found_contacts)
+    except Exception as e:
+        failures['contacts'] = e
+
+    return finish_task(task, failures, extracted_info, contacts, prompt_version)
+
+def conduct_research(concurrency=None, batch_size=None, budget=None):
+    # Leads are researched highest priority first; budget caps how many
+    logging.info("Starting research process")
+    check_leads_table()
+    queued = research_tasks.enqueue_new_leads()
+    logging.info(f"Queued {queued} new leads for research")
+
+    if concurrency is None:
+        concurrency = research_pipeline.DEFAULT_CONCURRENCY
+    if batch_size is None:
+        batch_size = research_pipeline.batch_extract.DEFAULT_BATCH_SIZE
+
+    # Tasks are claimed from the database as the run goes, so several
+    # processes can work through the same queue
+    owner = research_tasks.worker_id()
+    if concurrency > 1 or batch_size > 1:
+        research_pipeline.research_leads(owner, concurrency, batch_size, budget)
+    else:
+        research_sequentially(owner, budget=budget)
+
+    db.flush()
+    research_tasks.log_summary()
+    http_client.log_pool_stats()
+    scrape_cache.log_stats()
+    html_extract.log_stats()
+    llm_memo.log_stats()
+    contact_cache.log_stats()
+    scheduler.log_stats()
+    metrics.log_summary()
     logging.info("Research process completed")
 
+def research_sequentially(owner, chunk_size=50, budget=None):
+    for tasks in research_tasks.claim_all(owner, chunk_size, budget):
+        # Look up every distinct organization in the chunk once
+        needing_contacts = [(task['lead_id'], task['company_name'], task['website'])
+                            for task in tasks if task['contacts_status'] != 'done']
+        found = find_contacts_bulk(needing_contacts)
+        for task in tasks:
+            research_task(task, found.get(task['lead_id']))
+
 def initialize_research_tools():
     logging.info("Initializing research tools")
     if not os.getenv('APOLLO_API_KEY'):
@@ -184,17 +344,13 @@ def initialize_research_tools():
     logging.info("Research tools initialized successfully")
 
 def check_leads_table():
-    conn = sqlite3.connect('leads.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, company_name, website, status FROM leads')
-    all_leads = cursor.fetchall()
-    conn.close()
+    counts = lead_store.status_counts(db.connect().cursor())
     
-    logging.info(f"Total leads in the database: {len(all_leads)}")
-    for lead in all_leads:
-        logging.info(f"Lead: ID={lead[0]}, Company={lead[1]}, Website={lead[2]}, Status={lead[3]}")
+    logging.info(f"Total leads in the database: {sum(counts.values())}")
+    for status, count in counts.items():
+        logging.info(f"Leads with status '{status}': {count}")
     
-    return all_leads
+    return counts
 
 if __name__ == "__main__":
     initialize_research_tools()
@@ -0,0 +1,195 @@
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import batch_extract
+import contact_cache
+import research_crew
+import research_tasks
+import metrics
+
+# Number of leads that may be in each stage at the same time
+DEFAULT_CONCURRENCY = int(os.getenv('RESEARCH_CONCURRENCY', '8'))
+# How long a batching extract worker waits for more leads before sending
+BATCH_LINGER = float(os.getenv('GROQ_BATCH_LINGER', '0.5'))
+
+async def _run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+async def _lookup_contacts(semaphore, company_name, website):
+    async with semaphore:
+        return await _run_blocking(research_crew.lookup_contacts, company_name, website)
+
+def _forget_failed(contact_tasks, key, contacts_task):
+    # A failed search isn't shared: the lead's retry searches Apollo again
+    failed = contacts_task.cancelled() or contacts_task.exception() is not None
+    if failed and contact_tasks.get(key) is contacts_task:
+        del contact_tasks[key]
+
+async def _produce(owner, scrape_queue, apollo_semaphore, contact_tasks, workers, budget=None):
+    # Claims tasks from the database a queue's worth at a time, so leases
+    # start close to when the work does. Stops after budget tasks.
+    claimed = 0
+    while budget is None or claimed < budget:
+        limit = scrape_queue.maxsize or workers
+        if budget is not None:
+            limit = min(limit, budget - claimed)
+        tasks = await _run_blocking(research_tasks.claim, owner, limit)
+        if not tasks:
+            break
+        claimed += len(tasks)
+        for task in tasks:
+            logging.info(f"Researching: {task['company_name']}")
+            print(f"Researching: {task['company_name']}")
+            # The Apollo search only needs the company name, so it starts right
+            # away and runs alongside the scrape and LLM stages for this lead.
+            # Leads of the same organization share one search while it runs or
+            # once it has succeeded.
+            contacts_task = None
+            if task['contacts_status'] != 'done':
+                key = contact_cache.org_key(task['company_name'], task['website']) or f"lead:{task['lead_id']}"
+                contacts_task = contact_tasks.get(key)
+                if contacts_task is None:
+                    contacts_task = asyncio.create_task(
+                        _lookup_contacts(apollo_semaphore, task['company_name'], task['website']))
+                    contacts_task.add_done_callback(functools.partial(_forget_failed, contact_tasks, key))
+                    contact_tasks[key] = contacts_task
+            await scrape_queue.put({
+                'task': task,
+                'lead_id': task['lead_id'],
+                'failures': {},
+                'contacts_task': contacts_task
+            })
+
+    for _ in range(workers):
+        await scrape_queue.put(None)
+
+async def _scrape_worker(scrape_queue, extract_queue):
+    while True:
+        job = await scrape_queue.get()
+        if job is None:
+            await extract_queue.put(None)
+            return
+
+        task = job['task']
+        try:
+            job['scraped_text'] = await _run_blocking(research_crew.scrape_stage, task)
+            if task['extract_status'] != 'done':
+                job['condensed_text'] = await _run_blocking(research_crew.condense_for_extraction,
+                                                            job['scraped_text'], task['website'])
+        except Exception as e:
+            job['failures']['scrape'] = e
+        await extract_queue.put(job)
+
+async def _collect_jobs(extract_queue, batch_size):
+    # Wait for one job, then take whatever else arrives within BATCH_LINGER
+    # so a batch can fill up without stalling the stage
+    jobs = []
+    job = await extract_queue.get()
+    while job is not None:
+        jobs.append(job)
+        if len(jobs) >= batch_size:
+            break
+        try:
+            job = await asyncio.wait_for(extract_queue.get(), BATCH_LINGER)
+        except asyncio.TimeoutError:
+            break
+    return jobs, job is None
+
+async def _extract_jobs(jobs, batch_size):
+    # {lead_id: (extracted_info, version of the prompt that produced it)}
+    if batch_size > 1:
+        items = [(job['lead_id'], job['condensed_text']) for job in jobs]
+        return await _run_blocking(batch_extract.extract_info_batch, items, batch_size)
+
+    extracted = {}
+    for job in jobs:
+        info = await _run_blocking(research_crew.extract_info_with_groq, job['condensed_text'])
+        extracted[job['lead_id']] = info, research_crew.EXTRACTION_PROMPT_VERSION
+    return extracted
+
+async def _finish_job(job, extracted, results):
+    task = job['task']
+    failures = job['failures']
+    extracted_info, prompt_version = extracted or (None, research_crew.EXTRACTION_PROMPT_VERSION)
+    if 'scrape' not in failures:
+        try:
+            if task['extract_status'] == 'done':
+                extracted_info, prompt_version = await _run_blocking(research_tasks.load_extraction,
+                                                                     task['lead_id'])
+            elif 'extract' not in failures:
+                extracted_info = await _run_blocking(research_crew.save_extraction_stage, task, extracted_info,
+                                                     prompt_version)
+        except Exception as e:
+            failures['extract'] = e
+
+    contacts = None
+    try:
+        found = await job['contacts_task'] if job['contacts_task'] else None
+    except Exception as e:
+        found = e
+    try:
+        contacts = await _run_blocking(research_crew.contacts_stage, task, found)
+    except Exception as e:
+        failures['contacts'] = e
+
+    results[task['lead_id']] = await _run_blocking(research_crew.finish_task, task, failures,
+                                                   extracted_info, contacts, prompt_version)
+
+async def _extract_worker(extract_queue, results, batch_size):
+    finished = False
+    while not finished:
+        jobs, finished = await _collect_jobs(extract_queue, batch_size)
+        ready = [job for job in jobs if not job['failures'] and job['task']['extract_status'] != 'done']
+        extracted = {}
+        if ready:
+            try:
+                # One span covers the whole batch, for every lead in it
+                with metrics.stage('extract', *[job['lead_id'] for job in ready]):
+                    extracted = await _extract_jobs(ready, batch_size)
+            except Exception as e:
+                for job in ready:
+                    job['failures']['extract'] = e
+
+        for job in jobs:
+            await _finish_job(job, extracted.get(job['lead_id']), results)
+
+async def run_pipeline(owner, concurrency=DEFAULT_CONCURRENCY, batch_size=batch_extract.DEFAULT_BATCH_SIZE,
+                       budget=None):
+    concurrency = max(1, concurrency)
+    loop = asyncio.get_running_loop()
+    # Scrape, Groq and Apollo calls all block, so give each stage its own threads
+    executor = ThreadPoolExecutor(max_workers=concurrency * 3)
+    loop.set_default_executor(executor)
+
+    # Bounded queues keep memory flat and apply backpressure between stages
+    scrape_queue = asyncio.Queue(maxsize=concurrency * 2)
+    extract_queue = asyncio.Queue(maxsize=concurrency * 2)
+    apollo_semaphore = asyncio.Semaphore(concurrency)
+    contact_tasks = {}
+    results = {}
+
+    try:
+        await asyncio.gather(
+            _produce(owner, scrape_queue, apollo_semaphore, contact_tasks, concurrency, budget),
+            *[_scrape_worker(scrape_queue, extract_queue) for _ in range(concurrency)],
+            *[_extract_worker(extract_queue, results, batch_size) for _ in range(concurrency)]
+        )
+        # Searches for leads that failed earlier may still be running
+        await asyncio.gather(*contact_tasks.values(), return_exceptions=True)
+    finally:
+        executor.shutdown(wait=True)
+
+    return results
+
+def research_leads(owner, concurrency=DEFAULT_CONCURRENCY, batch_size=batch_extract.DEFAULT_BATCH_SIZE,
+                   budget=None):
+    logging.info(f"Researching queued leads with concurrency {concurrency}, batch size {batch_size}"
+                 + (f", budget {budget}" if budget is not None else ''))
+    results = asyncio.run(run_pipeline(owner, concurrency, batch_size, budget))
+    if batch_size > 1:
+        batch_extract.log_stats()
+    return results
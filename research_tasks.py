@@ -0,0 +1,332 @@
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import logging
+import sqlite3
+import db
+import lead_store
+import scoring
+import contact_cache
+import metrics
+
+# Seconds a claimed task stays leased to its worker, attempts per stage
+# before a task fails, and the delay before the first retry (it doubles
+# with each failure)
+LEASE_SECONDS = float(os.getenv('RESEARCH_LEASE_SECONDS', '900'))
+MAX_ATTEMPTS = int(os.getenv('RESEARCH_MAX_ATTEMPTS', '3'))
+RETRY_DELAY = float(os.getenv('RESEARCH_RETRY_DELAY', '60'))
+# Researched leads are refreshed once their last run is this old; the daemon
+# doesn't refresh when it's 0
+REFRESH_AGE = float(os.getenv('RESEARCH_REFRESH_AGE', str(30 * 24 * 3600)))
+
+STAGES = ('scrape', 'extract', 'contacts')
+# lead_pages source for the scraped site text, kept so a retried extraction
+# doesn't fetch the site again
+PAGE_SOURCE = 'site'
+
+TASK_COLUMNS = ['lead_id', 'company_name', 'website', 'scrape_status', 'extract_status', 'contacts_status',
+                'scrape_attempts', 'extract_attempts', 'contacts_attempts', 'page_hash', 'extracted_hash',
+                'extract_version', 'contacts_key']
+
+def worker_id():
+    # Identifies this process's leases; unique across hosts and restarts
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+def enqueue_new_leads():
+    # Every 'new' lead without a task gets one. Only those leads are read, so
+    # a daemon pass doesn't rewrite the tasks already queued.
+    conn = db.connect()
+    cursor = conn.execute('''
+        INSERT INTO research_tasks (lead_id, priority, updated_at)
+        SELECT id, priority, ? FROM leads
+        WHERE status = 'new' AND NOT EXISTS (SELECT 1 FROM research_tasks WHERE lead_id = leads.id)
+    ''', (time.time(),))
+    conn.commit()
+    return cursor.rowcount
+
+def restart_tasks(conn, lead_ids):
+    # Of the given leads, those find-similar set back to 'new' (their name
+    # changed, or they are no longer a duplicate) start over. Researched and
+    # duplicate leads, and tasks still in progress, are left alone. Runs in
+    # the caller's transaction.
+    now = time.time()
+    conn.executemany('''
+        UPDATE research_tasks SET
+            state = 'pending', scrape_status = 'pending', extract_status = 'pending',
+            contacts_status = 'pending', scrape_attempts = 0, extract_attempts = 0,
+            contacts_attempts = 0, last_error = NULL, lease_owner = NULL, lease_expires = NULL,
+            retry_at = 0, updated_at = ?
+        WHERE lead_id = ? AND state IN ('done', 'failed')
+          AND EXISTS (SELECT 1 FROM leads WHERE id = research_tasks.lead_id AND status = 'new')
+    ''', [(now, lead_id) for lead_id in lead_ids])
+
+# Tasks of leads set aside as duplicates stay queued, but aren't claimed
+CLAIM_SQL = '''
+    SELECT t.lead_id, l.company_name, l.website, t.scrape_status, t.extract_status, t.contacts_status,
+           t.scrape_attempts, t.extract_attempts, t.contacts_attempts, t.page_hash, t.extracted_hash,
+           t.extract_version, t.contacts_key
+    FROM research_tasks t {index} JOIN leads l ON l.id = t.lead_id
+    WHERE l.status != 'duplicate'
+'''
+
+def claim(owner, limit):
+    # IMMEDIATE takes the write lock before reading, so processes sharing the
+    # database never claim the same task. Expired leases belong to workers
+    # that died and are claimed again first; after them, the highest priority
+    # pending tasks go first. Without ANALYZE statistics the planner prefers
+    # idx_research_tasks_claim for the retry_at range and sorts every pending
+    # task, so the pending query names idx_research_tasks_priority, which
+    # reads them already in order and stops at the limit. Contacts found for
+    # the same company name before are kept, not searched again.
+    conn = db.connect()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute(CLAIM_SQL.format(index='') + '''
+            AND t.state = 'running' AND t.lease_expires < ?
+            ORDER BY t.lead_id LIMIT ?
+        ''', (now, limit)).fetchall()
+        if len(rows) < limit:
+            rows += conn.execute(CLAIM_SQL.format(index='INDEXED BY idx_research_tasks_priority') + '''
+                AND t.state = 'pending' AND t.retry_at <= ?
+                ORDER BY t.priority DESC, t.lead_id LIMIT ?
+            ''', (now, limit - len(rows))).fetchall()
+        tasks = [dict(zip(TASK_COLUMNS, row), owner=owner) for row in rows]
+        conn.executemany('''
+            UPDATE research_tasks SET state = 'running', lease_owner = ?, lease_expires = ?, updated_at = ?
+            WHERE lead_id = ?
+        ''', [(owner, now + LEASE_SECONDS, now, task['lead_id']) for task in tasks])
+        unchanged = [task for task in tasks if task['contacts_status'] != 'done' and task['contacts_key']
+                     and task['contacts_key'] == contact_cache.org_key(task['company_name'], task['website'])]
+        for task in unchanged:
+            conn.execute(*_stage_done(task, 'contacts'))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if unchanged:
+        metrics.inc('stages_skipped_total', len(unchanged), stage='contacts')
+    return tasks
+
+def claim_all(owner, chunk_size, budget=None):
+    # Claims in small chunks so leases don't expire while tasks wait their
+    # turn. budget caps the number of tasks claimed in all.
+    claimed = 0
+    while budget is None or claimed < budget:
+        tasks = claim(owner, chunk_size if budget is None else min(chunk_size, budget - claimed))
+        if not tasks:
+            return
+        claimed += len(tasks)
+        yield tasks
+
+def _stage_done(task, stage):
+    # The statement that marks a stage done; the task itself is marked at once
+    task[f'{stage}_status'] = 'done'
+    return (f"UPDATE research_tasks SET {stage}_status = 'done', updated_at = ? WHERE lead_id = ?",
+            (time.time(), task['lead_id']))
+
+def page_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+# Stage results are queued for the db writer thread, which commits many
+# leads' writes in one transaction, rather than committed one by one here.
+# A stage's data and its done mark are one queued item, so neither lands
+# without the other, and finish() waits for the item before it commits.
+
+def _write_stage(task, stage, statements):
+    statements.append((*_stage_done(task, stage), False))
+    task.setdefault('stage_writes', {})[stage] = db.write_atomic(statements)
+
+def save_scraped_text(task, text):
+    # Text identical to what was stored last time isn't written again; only
+    # the time it was checked moves. Returns whether the text changed. A new
+    # page is committed here with its done mark: its row needs the id of the
+    # blob it's stored in.
+    lead_id = task['lead_id']
+    digest = page_hash(text)
+    changed = digest != task['page_hash']
+    statements = [('UPDATE research_tasks SET scraped_at = ?, page_hash = ? WHERE lead_id = ?',
+                   (time.time(), digest, lead_id), False)]
+    if changed:
+        conn = db.connect()
+        with conn:
+            db.execute_statements(conn, [lead_store.unindex_statement(lead_id)])
+            lead_store.save_page(conn.cursor(), lead_id, PAGE_SOURCE, text)
+            db.execute_statements(conn, [lead_store.index_statement(lead_id)])
+            db.execute_statements(conn, statements + [(*_stage_done(task, 'scrape'), False)])
+    else:
+        _write_stage(task, 'scrape', statements)
+    task['page_hash'] = digest
+    return changed
+
+def load_scraped_text(lead_id):
+    page = lead_store.load_page(db.connect().cursor(), lead_id, PAGE_SOURCE)
+    return (page[0] or '') if page else ''
+
+def extraction_version(model, prompt_version):
+    return f'{model}:{prompt_version}'
+
+def extraction_current(task, model, prompt_versions):
+    # Whether the stored extraction was made from the page text just scraped,
+    # with this model and one of these prompts
+    return (task['page_hash'] is not None and task['extracted_hash'] == task['page_hash']
+            and task['extract_version'] in [extraction_version(model, version) for version in prompt_versions])
+
+def skip_stage(task, stage):
+    # The stage's stored result stands, as its inputs haven't changed
+    _write_stage(task, stage, [])
+    metrics.inc('stages_skipped_total', stage=stage)
+
+def save_extraction(task, extracted, model=None, prompt_version=None):
+    now = time.time()
+    _write_stage(task, 'extract', [('''
+        INSERT OR REPLACE INTO lead_extractions (lead_id, model, prompt_version, data, extracted_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (task['lead_id'], model, prompt_version, json.dumps(extracted), now), False), ('''
+        UPDATE research_tasks SET extracted_at = ?, extracted_hash = ?, extract_version = ? WHERE lead_id = ?
+    ''', (now, task['page_hash'], extraction_version(model, prompt_version), task['lead_id']), False)])
+
+def load_extraction(lead_id):
+    # (extracted info, version of the prompt that produced it)
+    row = db.connect().execute('SELECT data, prompt_version FROM lead_extractions WHERE lead_id = ?',
+                               (lead_id,)).fetchone()
+    return (json.loads(row[0]) if row and row[0] else {}), (row[1] if row else None)
+
+def save_contacts(task, contacts):
+    lead_id = task['lead_id']
+    _write_stage(task, 'contacts', [
+        ('DELETE FROM lead_contacts WHERE lead_id = ?', (lead_id,), False),
+        ('INSERT INTO lead_contacts (lead_id, name, email, phone, title) VALUES (?, ?, ?, ?, ?)',
+         lead_store.contact_rows(lead_id, contacts), True),
+        ('UPDATE research_tasks SET enriched_at = ?, contacts_key = ? WHERE lead_id = ?',
+         (time.time(), contact_cache.org_key(task['company_name'], task['website']), lead_id), False),
+    ])
+
+def load_contacts(lead_id):
+    return lead_store.load_contacts(db.connect().cursor(), lead_id)
+
+def wait_for_stage_writes(task, failures):
+    # Blocks until the task's queued stage writes are committed. A stage whose
+    # write was dropped is added to failures, so it runs again on the retry.
+    for stage, done in task.pop('stage_writes', {}).items():
+        try:
+            done.result()
+        except sqlite3.Error as e:
+            logging.error(f"Lead {task['lead_id']}: the {stage} stage's results weren't saved ({str(e)})")
+            failures.setdefault(stage, e)
+
+def finish(task, failures, info=None, model=None, prompt_version=None):
+    # Called once the claimed task's stages have run. Their queued writes are
+    # committed first; a stage whose write was dropped is added to failures.
+    # Without failures the research is stored and the task is done. Otherwise
+    # the failed stages are retried after a backoff, until one runs out of
+    # attempts. Returns the task's new state.
+    wait_for_stage_writes(task, failures)
+    lead_id = task['lead_id']
+    now = time.time()
+    conn = db.connect()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('SELECT lease_owner FROM research_tasks WHERE lead_id = ?', (lead_id,)).fetchone()
+        if row is None or row[0] != task['owner']:
+            # Our lease expired and another worker took the task over
+            conn.rollback()
+            logging.warning(f"Lost the research lease on lead {lead_id}; leaving it to {row[0] if row else 'nobody'}")
+            return 'lost'
+
+        if not failures:
+            lead_store.execute_research(conn, lead_id, info, model, prompt_version)
+            state, retry_at, error = 'done', 0, None
+        else:
+            attempts = max(task[f'{stage}_attempts'] + 1 for stage in failures)
+            error = '; '.join(f"{stage}: {str(e)}" for stage, e in failures.items())
+            for stage in failures:
+                conn.execute(f'''
+                    UPDATE research_tasks SET {stage}_status = 'failed', {stage}_attempts = {stage}_attempts + 1
+                    WHERE lead_id = ?
+                ''', (lead_id,))
+            if attempts >= MAX_ATTEMPTS:
+                # A refresh that fails keeps the research of the last good run
+                previous = conn.execute('SELECT status, research_error FROM leads WHERE id = ?',
+                                        (lead_id,)).fetchone()
+                if previous is None or previous[0] != 'researched' or previous[1] is not None:
+                    lead_store.execute_research(conn, lead_id, {'error': error}, model, prompt_version)
+                    # The error replaced the stored extraction, so it can't be reused
+                    conn.execute('UPDATE research_tasks SET extracted_hash = NULL WHERE lead_id = ?', (lead_id,))
+                state, retry_at = 'failed', 0
+            else:
+                state, retry_at = 'pending', now + RETRY_DELAY * 2 ** (attempts - 1)
+
+        # Research may have filled in employees, revenue and contacts
+        scoring.rescore(conn, [lead_id])
+        conn.execute('''
+            UPDATE research_tasks
+            SET state = ?, retry_at = ?, last_error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?
+            WHERE lead_id = ?
+        ''', (state, retry_at, error, now, lead_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return state
+
+def requeue_stale(max_age=REFRESH_AGE, limit=None):
+    # Puts researched leads whose last run is older than max_age back in the
+    # queue, highest priority first, then oldest first. Every stage is pending
+    # again, but only the scrape is sure to run: extraction and contacts are
+    # skipped when the page text and company name they used are unchanged.
+    now = time.time()
+    conn = db.connect()
+    cursor = conn.execute('''
+        UPDATE research_tasks SET
+            state = 'pending', scrape_status = 'pending', extract_status = 'pending', contacts_status = 'pending',
+            scrape_attempts = 0, extract_attempts = 0, contacts_attempts = 0, last_error = NULL,
+            lease_owner = NULL, lease_expires = NULL, retry_at = 0, updated_at = ?
+        WHERE lead_id IN (
+            SELECT t.lead_id FROM research_tasks t JOIN leads l ON l.id = t.lead_id
+            WHERE t.state IN ('done', 'failed') AND t.updated_at < ? AND l.status = 'researched'
+            ORDER BY t.priority DESC, t.updated_at LIMIT ?
+        )
+    ''', (now, now - max_age, -1 if limit is None else limit))
+    conn.commit()
+    if cursor.rowcount:
+        logging.info(f"Requeued {cursor.rowcount} leads last researched over {max_age / 86400:.1f} days ago")
+    return cursor.rowcount
+
+def freshness(max_age=REFRESH_AGE):
+    # How many researched leads are current, stale or queued for a refresh,
+    # and when the oldest page was scraped
+    cutoff = time.time() - max_age
+    row = db.connect().execute('''
+        SELECT COUNT(*) FILTER (WHERE t.state IN ('done', 'failed') AND t.updated_at >= ?),
+               COUNT(*) FILTER (WHERE t.state IN ('done', 'failed') AND t.updated_at < ?),
+               COUNT(*) FILTER (WHERE t.state IN ('pending', 'running')),
+               MIN(t.scraped_at)
+        FROM research_tasks t JOIN leads l ON l.id = t.lead_id
+        WHERE l.status = 'researched'
+    ''', (cutoff, cutoff)).fetchone()
+    return {'current': row[0], 'stale': row[1], 'queued': row[2], 'oldest_scrape': row[3]}
+
+def has_claimable():
+    # Whether claim() would return anything right now, without taking a lease
+    now = time.time()
+    row = db.connect().execute('''
+        SELECT 1 FROM research_tasks t JOIN leads l ON l.id = t.lead_id
+        WHERE ((t.state = 'running' AND t.lease_expires < ?) OR (t.state = 'pending' AND t.retry_at <= ?))
+          AND l.status != 'duplicate'
+        LIMIT 1
+    ''', (now, now)).fetchone()
+    return row is not None
+
+def summary():
+    rows = db.connect().execute('SELECT state, COUNT(*) FROM research_tasks GROUP BY state').fetchall()
+    return dict(rows)
+
+def log_summary():
+    counts = summary()
+    logging.info("Research tasks: " + (', '.join(f"{state}: {count}" for state, count in sorted(counts.items()))
+                                       or 'none'))
+    return counts
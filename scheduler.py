@@ -0,0 +1,238 @@
+import os
+import re
+import time
+import random
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import metrics
+
+# Requests per minute allowed for each external API. Defaults follow the
+# providers' entry-level quotas; raise them to match your plan.
+API_RATES = {
+    'exa': float(os.getenv('EXA_RATE_PER_MIN', '300')),
+    'groq': float(os.getenv('GROQ_RATE_PER_MIN', '30')),
+    'apollo': float(os.getenv('APOLLO_RATE_PER_MIN', '100')),
+}
+# Minimum seconds between two requests to the same scraped host
+HOST_DELAY = float(os.getenv('SCRAPE_HOST_DELAY', '1.0'))
+
+MAX_RETRIES = int(os.getenv('MAX_RETRIES', '5'))
+BACKOFF_BASE = float(os.getenv('BACKOFF_BASE', '1.0'))
+BACKOFF_MAX = float(os.getenv('BACKOFF_MAX', '60'))
+
+BREAKER_THRESHOLD = int(os.getenv('BREAKER_THRESHOLD', '5'))
+BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', '300'))
+# Hosts whose rate limit and circuit breaker are kept in memory. Past this,
+# the least recently used hosts with nothing to remember are dropped.
+MAX_HOSTS = int(os.getenv('SCHEDULER_MAX_HOSTS', '10000'))
+
+TRANSIENT_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+class CircuitOpenError(Exception):
+    pass
+
+class TransientHTTPError(Exception):
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def idle(self):
+        # Full again, so a new bucket would behave the same
+        with self.lock:
+            return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # Half-open: after the cooldown one request may try the host again
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                opened = self.opened_at is None
+                self.opened_at = time.monotonic()
+                return opened
+        return False
+
+    def idle(self):
+        # Closed with no failures counted, so a new breaker would behave the same
+        with self.lock:
+            return self.failures == 0 and self.opened_at is None
+
+_lock = threading.Lock()
+_api_buckets = {api: TokenBucket(rate / 60.0) for api, rate in API_RATES.items()}
+_host_buckets = OrderedDict()
+_breakers = OrderedDict()
+stats = {}
+
+def _count(api, key):
+    with _lock:
+        counters = stats.setdefault(api, {'calls': 0, 'retries': 0, 'errors': 0, 'circuit_opened': 0, 'rejected': 0})
+        counters[key] += 1
+    metrics.inc(f'provider_{key}_total', provider=api)
+
+def host_of(url):
+    return (urlsplit(url).hostname or '').lower()
+
+def _per_host(table, host, create):
+    # The host's entry, most recently used last. Called with _lock held.
+    entry = table.get(host)
+    if entry is not None:
+        table.move_to_end(host)
+        return entry
+    entry = table[host] = create()
+    excess = len(table) - MAX_HOSTS
+    if excess > 0:
+        idle = []
+        for other, other_entry in table.items():
+            if len(idle) >= excess:
+                break
+            if other != host and other_entry.idle():
+                idle.append(other)
+        for other in idle:
+            del table[other]
+    return entry
+
+def _host_bucket(host):
+    if HOST_DELAY <= 0:
+        return None
+    with _lock:
+        return _per_host(_host_buckets, host, lambda: TokenBucket(1.0 / HOST_DELAY, capacity=1))
+
+def _breaker(host):
+    with _lock:
+        return _per_host(_breakers, host, CircuitBreaker)
+
+def status_code_of(error):
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None)
+    if status is None:
+        # The Exa SDK reports HTTP failures as ValueError("... status code 429: ...")
+        match = re.search(r'status code (\d{3})', str(error))
+        if match:
+            status = int(match.group(1))
+    return status
+
+def is_transient(error):
+    if isinstance(error, TransientHTTPError):
+        return True
+    status = status_code_of(error)
+    if status is not None:
+        return status in TRANSIENT_STATUS
+    # Timeouts and dropped connections from requests, the Groq SDK or the OS
+    name = type(error).__name__
+    return 'Timeout' in name or 'Connection' in name or isinstance(error, (TimeoutError, ConnectionError))
+
+def retry_after_of(error):
+    value = getattr(error, 'retry_after', None)
+    if value is None:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        value = headers.get('Retry-After')
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, retry_after=None):
+    # Full jitter keeps a crowd of workers from retrying in lockstep
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, BACKOFF_MAX))
+    return delay
+
+def call(api, func, *args, host=None, **kwargs):
+    # Runs func under the API's rate limit (and the host's politeness limit
+    # and circuit breaker when host is given), retrying transient failures
+    bucket = _api_buckets.get(api)
+    breaker = _breaker(host) if host else None
+    attempt = 0
+    while True:
+        if breaker is not None and not breaker.allow():
+            _count(api, 'rejected')
+            raise CircuitOpenError(f"Circuit open for {host} after repeated failures")
+
+        if bucket is not None:
+            bucket.acquire()
+        if host:
+            host_bucket = _host_bucket(host)
+            if host_bucket is not None:
+                host_bucket.acquire()
+
+        _count(api, 'calls')
+        started = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            metrics.observe('provider_request_seconds', time.monotonic() - started, provider=api)
+            transient = is_transient(e)
+            circuit_opened = breaker is not None and transient and breaker.record_failure()
+            if circuit_opened:
+                _count(api, 'circuit_opened')
+                logging.warning(f"Opened circuit for {host} for {BREAKER_COOLDOWN:.0f}s")
+            # No point waiting out a backoff for a host we've just given up on
+            if not transient or circuit_opened or attempt >= MAX_RETRIES:
+                _count(api, 'errors')
+                raise
+            delay = backoff_delay(attempt, retry_after_of(e))
+            attempt += 1
+            _count(api, 'retries')
+            logging.warning(f"{api} call failed ({str(e)}), retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        metrics.observe('provider_request_seconds', time.monotonic() - started, provider=api)
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+def log_stats():
+    for api, counters in sorted(stats.items()):
+        logging.info(f"Scheduler {api}: {counters['calls']} calls, {counters['retries']} retries, "
+                     f"{counters['errors']} errors, {counters['circuit_opened']} circuits opened, "
+                     f"{counters['rejected']} rejected by open circuits")
+    return {api: dict(counters) for api, counters in stats.items()}
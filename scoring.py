@@ -0,0 +1,100 @@
+import math
+import time
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Share of each signal in the priority score; they add up to 1
+WEIGHTS = {'exa': 0.35, 'employees': 0.2, 'revenue': 0.2, 'contacts': 0.15, 'seeds': 0.1}
+# Values at which a signal counts in full; size signals grow logarithmically
+FULL_EMPLOYEES = 10000
+FULL_REVENUE = 1e9
+FULL_CONTACTS = 5
+FULL_SEEDS = 8
+
+RESCORE_CHUNK_SIZE = 100000
+
+def _log_share(value, full):
+    if value is None or value <= 0:
+        return 0.0
+    return min(math.log1p(value) / math.log1p(full), 1.0)
+
+def priority(score, employees, revenue, contacts, seeds):
+    # Composite priority in [0, 1]. Unknown values count as zero, so leads
+    # move up as research fills in their fields.
+    total = WEIGHTS['exa'] * min(max(score or 0.0, 0.0), 1.0)
+    total += WEIGHTS['employees'] * _log_share(employees, FULL_EMPLOYEES)
+    total += WEIGHTS['revenue'] * _log_share(revenue, FULL_REVENUE)
+    total += WEIGHTS['contacts'] * min(max(contacts or 0, 0) / FULL_CONTACTS, 1.0)
+    # A lead surfaced by several seeds is likelier to be a real match
+    if seeds and seeds > 1:
+        total += WEIGHTS['seeds'] * min(math.log2(seeds) / math.log2(FULL_SEEDS), 1.0)
+    return round(total, 6)
+
+def _log_share_array(values, full):
+    values = numpy.nan_to_num(values, nan=0.0)
+    return numpy.minimum(numpy.log1p(numpy.maximum(values, 0.0)) / math.log1p(full), 1.0)
+
+def priorities(scores, employees, revenues, contacts, seeds):
+    # Vectorized priority() over equal-length sequences (None for unknown)
+    if numpy is None:
+        return [priority(*values) for values in zip(scores, employees, revenues, contacts, seeds)]
+    scores, employees, revenues, contacts, seeds = (numpy.array(values, dtype=float)
+                                                    for values in (scores, employees, revenues, contacts, seeds))
+    total = WEIGHTS['exa'] * numpy.clip(numpy.nan_to_num(scores, nan=0.0), 0.0, 1.0)
+    total += WEIGHTS['employees'] * _log_share_array(employees, FULL_EMPLOYEES)
+    total += WEIGHTS['revenue'] * _log_share_array(revenues, FULL_REVENUE)
+    total += WEIGHTS['contacts'] * numpy.clip(numpy.nan_to_num(contacts, nan=0.0) / FULL_CONTACTS, 0.0, 1.0)
+    seeds = numpy.maximum(numpy.nan_to_num(seeds, nan=0.0), 1.0)
+    total += WEIGHTS['seeds'] * numpy.minimum(numpy.log2(seeds) / math.log2(FULL_SEEDS), 1.0)
+    return numpy.round(total, 6).tolist()
+
+PRIORITY_COLUMNS = 'id, score, employee_count, revenue_amount, contact_count, seed_count, priority'
+
+def _priority_updates(rows):
+    # (priority, id) for the rows whose stored priority is out of date
+    if not rows:
+        return []
+    columns = list(zip(*rows))
+    return [(new, lead_id) for lead_id, old, new in zip(columns[0], columns[6], priorities(*columns[1:6]))
+            if old is None or abs(new - old) > 1e-6]
+
+def rescore(conn, lead_ids):
+    # Recomputes the priority of these leads; run after writing any of the
+    # fields it's built from. The research_tasks copy follows by trigger.
+    lead_ids = list(lead_ids)
+    if not lead_ids:
+        return 0
+    rows = conn.execute(f"SELECT {PRIORITY_COLUMNS} FROM leads WHERE id IN ({', '.join('?' * len(lead_ids))})",
+                        lead_ids).fetchall()
+    updates = _priority_updates(rows)
+    conn.executemany('UPDATE leads SET priority = ? WHERE id = ?', updates)
+    return len(updates)
+
+def rescore_all(conn, chunk_size=RESCORE_CHUNK_SIZE):
+    # Recomputes every lead's priority in chunks, writing only the ones that
+    # changed. rescore() keeps priorities current as fields arrive; this is
+    # for new weights or a backfill.
+    started = time.monotonic()
+    cursor = conn.cursor()
+    rows = changed = 0
+    last_id = 0
+    while True:
+        cursor.execute(f'SELECT {PRIORITY_COLUMNS} FROM leads WHERE id > ? ORDER BY id LIMIT ?', (last_id, chunk_size))
+        chunk = cursor.fetchall()
+        if not chunk:
+            break
+        updates = _priority_updates(chunk)
+        cursor.executemany('UPDATE leads SET priority = ? WHERE id = ?', updates)
+        conn.commit()
+        rows += len(chunk)
+        changed += len(updates)
+        last_id = chunk[-1][0]
+
+    elapsed = time.monotonic() - started
+    logging.info(f"Rescored {rows} leads in {elapsed:.1f}s ({changed} changed, "
+                 f"{'numpy' if numpy is not None else 'pure Python'})")
+    return rows, changed, elapsed
@@ -0,0 +1,150 @@
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from url_utils import normalize_url
+import metrics
+
+# Cache file, how long a page is kept, the total size bodies are evicted
+# down to, and SCRAPE_CACHE=0 to turn the cache off
+CACHE_PATH = os.getenv('SCRAPE_CACHE_PATH', 'scrape_cache.db')
+CACHE_TTL = float(os.getenv('SCRAPE_CACHE_TTL', str(30 * 24 * 3600)))
+CACHE_MAX_BYTES = int(os.getenv('SCRAPE_CACHE_MAX_BYTES', str(500 * 1024 * 1024)))
+CACHE_ENABLED = os.getenv('SCRAPE_CACHE', '1') != '0'
+
+_conn = None
+_lock = threading.Lock()
+stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evicted': 0}
+
+def _connection():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        _conn.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                url_key TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+        # Extracted text is stored once per distinct content, so mirrors and
+        # unchanged rescrapes share a single body
+        _conn.execute('''
+            CREATE TABLE IF NOT EXISTS bodies (
+                content_hash TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL
+            )
+        ''')
+        _conn.execute('CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages (accessed_at)')
+        _conn.execute('CREATE INDEX IF NOT EXISTS idx_pages_fetched ON pages (fetched_at)')
+        _conn.execute('CREATE INDEX IF NOT EXISTS idx_pages_hash ON pages (content_hash)')
+        _conn.commit()
+    return _conn
+
+def set_enabled(enabled):
+    global CACHE_ENABLED
+    CACHE_ENABLED = enabled
+
+def lookup(url):
+    key = normalize_url(url)
+    with _lock:
+        conn = _connection()
+        row = conn.execute('''
+            SELECT p.etag, p.last_modified, p.fetched_at, b.text, p.content_hash
+            FROM pages p JOIN bodies b ON b.content_hash = p.content_hash
+            WHERE p.url_key = ?
+        ''', (key,)).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[2] > CACHE_TTL:
+            conn.execute('DELETE FROM pages WHERE url_key = ?', (key,))
+            _release_body(conn, row[4])
+            conn.commit()
+            return None
+    return {'etag': row[0], 'last_modified': row[1], 'text': row[3]}
+
+def conditional_headers(entry):
+    headers = {}
+    if entry:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+def mark_hit(url):
+    # The server answered 304, so the cached text is still current
+    with _lock:
+        conn = _connection()
+        conn.execute('UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE url_key = ?',
+                     (time.time(), time.time(), normalize_url(url)))
+        conn.commit()
+        stats['hits'] += 1
+    metrics.inc('cache_requests_total', cache='scrape', result='hit')
+
+def store(url, text, etag=None, last_modified=None):
+    stats['misses'] += 1
+    metrics.inc('cache_requests_total', cache='scrape', result='miss')
+    # Without a validator there's no way to revalidate, so don't keep it
+    if not etag and not last_modified:
+        return
+
+    content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    now = time.time()
+    with _lock:
+        conn = _connection()
+        key = normalize_url(url)
+        previous = conn.execute('SELECT content_hash FROM pages WHERE url_key = ?', (key,)).fetchone()
+        conn.execute('INSERT OR IGNORE INTO bodies (content_hash, text, size) VALUES (?, ?, ?)',
+                     (content_hash, text, len(text.encode('utf-8'))))
+        conn.execute('''
+            INSERT OR REPLACE INTO pages (url_key, content_hash, etag, last_modified, fetched_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (key, content_hash, etag, last_modified, now, now))
+        if previous and previous[0] != content_hash:
+            _release_body(conn, previous[0])
+        conn.commit()
+        stats['stores'] += 1
+        _evict(conn)
+
+def _release_body(conn, content_hash):
+    # Delete a body once no cached URL points at it; returns the bytes freed
+    if conn.execute('SELECT 1 FROM pages WHERE content_hash = ? LIMIT 1', (content_hash,)).fetchone():
+        return 0
+    size = conn.execute('SELECT size FROM bodies WHERE content_hash = ?', (content_hash,)).fetchone()
+    conn.execute('DELETE FROM bodies WHERE content_hash = ?', (content_hash,))
+    return size[0] if size else 0
+
+def _evict(conn):
+    evicted = 0
+    cutoff = time.time() - CACHE_TTL
+    for url_key, content_hash in conn.execute('SELECT url_key, content_hash FROM pages WHERE fetched_at < ?', (cutoff,)).fetchall():
+        conn.execute('DELETE FROM pages WHERE url_key = ?', (url_key,))
+        _release_body(conn, content_hash)
+        evicted += 1
+
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM bodies').fetchone()[0]
+    if total > CACHE_MAX_BYTES:
+        # Drop least recently used pages until the bodies fit the budget again
+        for url_key, content_hash in conn.execute('SELECT url_key, content_hash FROM pages ORDER BY accessed_at').fetchall():
+            conn.execute('DELETE FROM pages WHERE url_key = ?', (url_key,))
+            total -= _release_body(conn, content_hash)
+            evicted += 1
+            if total <= CACHE_MAX_BYTES:
+                break
+
+    conn.commit()
+    if evicted:
+        stats['evicted'] += evicted
+        logging.info(f"Evicted {evicted} pages from the scrape cache")
+
+def log_stats():
+    logging.info(f"Scrape cache: {stats['hits']} revalidated (304), {stats['misses']} downloaded, "
+                 f"{stats['stores']} stored, {stats['evicted']} evicted")
+    return dict(stats)
@@ -0,0 +1,21 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import blob_store
+import db
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    # A fresh database file, with its own connections and writer thread
+    monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'leads.db'))
+    monkeypatch.setattr(db, '_local', threading.local())
+    monkeypatch.setattr(db, '_schema_ready', False)
+    monkeypatch.setattr(db, '_writer', None)
+    monkeypatch.setattr(blob_store, '_dictionaries', {})
+    yield db.connect()
+    db.flush()
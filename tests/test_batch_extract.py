@@ -0,0 +1,31 @@
+import json
+
+# research_crew imports batch_extract part way through, so it's loaded first
+import research_crew
+import batch_extract
+import db
+import llm_memo
+import research_tasks
+
+def test_results_carry_the_version_of_the_prompt_that_made_them(database, monkeypatch):
+    monkeypatch.setattr(batch_extract, '_request_batch', lambda batch: json.dumps(
+        [{'lead_id': lead_id, 'Industry': f'Industry {lead_id}'} for lead_id, _ in batch]))
+    llm_memo.put(research_crew.GROQ_MODEL, research_crew.EXTRACTION_PROMPT_VERSION, 'memoized text',
+                 {'Industry': 'Tools'})
+    db.flush()
+
+    results = batch_extract.extract_info_batch([(1, 'memoized text'), (2, 'second text'), (3, 'third text')], 4)
+    assert results[1] == ({'Industry': 'Tools'}, research_crew.EXTRACTION_PROMPT_VERSION)
+    assert results[2] == ({'Industry': 'Industry 2'}, batch_extract.batch_prompt_version())
+    assert results[3][1] == batch_extract.batch_prompt_version()
+
+def test_editing_the_batch_prompt_makes_batch_results_stale(monkeypatch):
+    task = {'page_hash': 'abc', 'extracted_hash': 'abc',
+            'extract_version': research_tasks.extraction_version(research_crew.GROQ_MODEL,
+                                                                 batch_extract.batch_prompt_version())}
+    assert research_tasks.extraction_current(task, research_crew.GROQ_MODEL,
+                                             batch_extract.current_prompt_versions())
+
+    monkeypatch.setattr(batch_extract, 'BATCH_PROMPT', batch_extract.BATCH_PROMPT + '\nBe brief.')
+    assert not research_tasks.extraction_current(task, research_crew.GROQ_MODEL,
+                                                 batch_extract.current_prompt_versions())
@@ -0,0 +1,41 @@
+import blob_store
+
+def store_pages(conn, count, start=0):
+    for i in range(start, start + count):
+        blob_store.put(conn, f'Welcome to company {i}\nHome | About us | Products | Contact us\n'
+                             f'All rights reserved. Privacy policy and terms of use.\n')
+
+def test_round_trip(database):
+    text = 'Acme makes anvils. ' * 20
+    blob_id = blob_store.put(database, text)
+    assert blob_store.get(database, blob_id) == text
+    assert blob_store.put(database, '') is None
+
+def test_dictionary_is_trained_once_enough_text_is_stored(database, monkeypatch):
+    monkeypatch.setattr(blob_store, 'DICT_TRAIN_SAMPLES', 5)
+    store_pages(database, 4)
+    assert blob_store.maybe_train_dictionary(database) is None
+    store_pages(database, 1, start=4)
+    dict_id = blob_store.maybe_train_dictionary(database)
+    assert dict_id is not None
+
+    # New text is compressed with it and still reads back
+    blob_id = blob_store.put(database, 'Home | About us | Products | Contact us\n' * 3)
+    assert database.execute('SELECT dict_id FROM blobs WHERE id = ?', (blob_id,)).fetchone()[0] == dict_id
+    assert blob_store.get(database, blob_id) == 'Home | About us | Products | Contact us\n' * 3
+
+def test_failed_training_waits_for_more_blobs(database, monkeypatch):
+    monkeypatch.setattr(blob_store, 'DICT_TRAIN_SAMPLES', 5)
+    attempts = []
+    monkeypatch.setattr(blob_store, 'train_dictionary', lambda conn, samples, codec=None: attempts.append(1))
+    store_pages(database, 5)
+
+    assert blob_store.maybe_train_dictionary(database) is None
+    assert blob_store.maybe_train_dictionary(database) is None
+    store_pages(database, 4, start=5)
+    assert blob_store.maybe_train_dictionary(database) is None
+    assert len(attempts) == 1
+
+    store_pages(database, 1, start=9)
+    blob_store.maybe_train_dictionary(database)
+    assert len(attempts) == 2
@@ -0,0 +1,24 @@
+import contact_cache
+
+def test_org_key_prefers_the_domain():
+    assert contact_cache.org_key('Acme Inc', 'https://www.acme.com/about') == 'domain:acme.com'
+    assert contact_cache.org_key('Acme, Inc.', 'acme.com') == contact_cache.org_key('ACME', 'http://acme.com')
+    # Two companies called Acme are different organizations
+    assert contact_cache.org_key('Acme', 'acme.com') != contact_cache.org_key('Acme', 'acme.co.uk')
+
+def test_org_key_falls_back_to_the_name():
+    assert contact_cache.org_key('Acme Inc', None) == 'name:acme'
+    assert contact_cache.org_key('Acme Inc', '') == 'name:acme'
+    assert contact_cache.org_key('', None) is None
+
+def test_lookup_many_searches_each_organization_once(database):
+    searched = []
+
+    def fetch(company_name, website):
+        searched.append(website)
+        return [{'name': f'CEO of {website}'}]
+
+    results = contact_cache.lookup_many([('Acme', 'acme.com'), ('Acme Inc', 'www.acme.com'),
+                                         ('Acme', 'acme.co.uk')], fetch)
+    assert sorted(searched) == ['acme.co.uk', 'acme.com']
+    assert results['domain:acme.co.uk'] == [{'name': 'CEO of acme.co.uk'}]
@@ -0,0 +1,27 @@
+import sqlite3
+
+import pytest
+
+import db
+
+def test_write_resolves_once_committed(database):
+    done = db.write('INSERT INTO seed_urls (url, status) VALUES (?, ?)', ('https://a.example/', 'not-started'))
+    assert done.result(timeout=5) is None
+    assert database.execute('SELECT url FROM seed_urls').fetchall() == [('https://a.example/',)]
+
+def test_dropped_atomic_write_rolls_back_and_reports(database):
+    insert = 'INSERT INTO seed_urls (url, status) VALUES (?, ?)'
+    failed = db.write_atomic([(insert, ('https://a.example/', 'not-started'), False),
+                              ('INSERT INTO no_such_table VALUES (?)', (1,), False)])
+    kept = db.write(insert, ('https://b.example/', 'not-started'))
+    with pytest.raises(sqlite3.Error):
+        failed.result(timeout=5)
+    assert kept.result(timeout=5) is None
+    # Neither statement of the failed item was committed
+    assert database.execute('SELECT url FROM seed_urls').fetchall() == [('https://b.example/',)]
+
+def test_flush_waits_for_queued_writes(database):
+    rows = [(f'https://{i}.example/', 'not-started') for i in range(50)]
+    db.write_many('INSERT INTO seed_urls (url, status) VALUES (?, ?)', rows)
+    db.flush()
+    assert database.execute('SELECT COUNT(*) FROM seed_urls').fetchone()[0] == 50
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import lead_agent
+import research_tasks
+
+SEED = 'https://seed.example/'
+ACME_TEXT = 'Acme builds anvils, rockets and giant magnets for desert roadrunner enthusiasts everywhere.'
+BETA_TEXT = 'Beta brews small batch coffee from beans roasted weekly in its own downtown workshop.'
+
+def exa_result(*sites):
+    return SimpleNamespace(results=[SimpleNamespace(title=title, url=url, score=0.8, text=text, summary='')
+                                    for title, url, text in sites])
+
+def lead(conn, website):
+    return conn.execute('''
+        SELECT l.id, l.status, t.state FROM leads l LEFT JOIN research_tasks t ON t.lead_id = l.id
+        WHERE l.website = ?
+    ''', (website,)).fetchone()
+
+def research_all(conn):
+    research_tasks.enqueue_new_leads()
+    conn.execute("UPDATE research_tasks SET state = 'done'")
+    conn.execute("UPDATE leads SET status = 'researched' WHERE status = 'new'")
+    conn.commit()
+
+def test_refound_lead_is_only_researched_again_when_renamed(database):
+    lead_agent.save_similar_results(SEED, exa_result(('Acme', 'https://acme.example/', ACME_TEXT),
+                                                     ('Beta', 'https://beta.example/', BETA_TEXT)))
+    research_all(database)
+
+    lead_agent.save_similar_results(SEED, exa_result(('Acme', 'https://acme.example/', ACME_TEXT),
+                                                     ('Beta Coffee', 'https://beta.example/', BETA_TEXT)))
+    assert lead(database, 'https://acme.example/')[1:] == ('researched', 'done')
+    assert lead(database, 'https://beta.example/')[1:] == ('new', 'pending')
+
+def test_refound_duplicate_is_not_researched_again(database):
+    lead_agent.save_similar_results(SEED, exa_result(('Acme', 'https://acme.example/', ACME_TEXT)))
+    research_all(database)
+    lead_agent.save_similar_results(SEED, exa_result(('Acme Mirror', 'https://mirror.example/', ACME_TEXT)))
+    mirror_id = lead(database, 'https://mirror.example/')[0]
+    assert lead(database, 'https://mirror.example/')[1:] == ('duplicate', None)
+
+    # A task left over from before the lead was set aside isn't claimed
+    database.execute("INSERT INTO research_tasks (lead_id, state, updated_at) VALUES (?, 'done', 0)", (mirror_id,))
+    database.commit()
+    lead_agent.save_similar_results(SEED, exa_result(('Acme Mirror Site', 'https://mirror.example/', ACME_TEXT)))
+    assert lead(database, 'https://mirror.example/')[1:] == ('duplicate', 'done')
+    assert research_tasks.claim('worker', 5) == []
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lead_store
+
+@pytest.mark.parametrize('value, expected', [
+    ('1,200', 1200),
+    ('50-100', 50),
+    ('about 10k employees', 10000),
+    ('1.5 million', 1500000),
+    ('2 billion', 2000000000),
+    ('Founded in 2010, 250 employees', 250),
+    ('500+ staff', 500),
+    ('$5M revenue and 40 employees', 40),
+    (75, 75),
+    ('unknown', None),
+    (None, None),
+])
+def test_parse_count(value, expected):
+    assert lead_store.parse_count(value) == expected
+
+@pytest.mark.parametrize('value, expected', [
+    ('$12.5M', 12500000.0),
+    ('USD 3 billion', 3000000000.0),
+    ('1,200,000', 1200000.0),
+    ('2019 revenue of $5M', 5000000.0),
+    ('Revenue in 2021: 40 million USD', 40000000.0),
+    ('€2.5bn (2022)', 2500000000.0),
+    ('FY2020: 300k', 300000.0),
+    ('250 Main Street', 250.0),
+    (1e6, 1000000.0),
+    ('not disclosed', None),
+    (None, None),
+])
+def test_parse_amount(value, expected):
+    assert lead_store.parse_amount(value) == expected
+
+def test_extraction_columns_parse_revenue_and_employees():
+    columns = lead_store.extraction_columns({'Revenue': '2019 revenue of $5M', 'Number of Employees': '2010: 80 staff'})
+    assert columns['revenue_amount'] == 5000000.0
+    assert columns['employee_count'] == 80
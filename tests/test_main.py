@@ -0,0 +1,22 @@
+import json
+import os
+import subprocess
+import sys
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+def run_main(tmp_path, *args):
+    env = dict(os.environ, LEAD_AGENT_DB=str(tmp_path / 'leads.db'), SCRAPE_CACHE_PATH=str(tmp_path / 'cache.db'),
+               GROQ_API_KEY='test', APOLLO_API_KEY='test', METRICS_PORT='0')
+    env.pop('METRICS_SNAPSHOT_PATH', None)
+    return subprocess.run([sys.executable, MAIN, *args], cwd=tmp_path, env=env, capture_output=True, text=True,
+                          timeout=60)
+
+def test_stats_reads_the_snapshot_a_research_run_left(tmp_path):
+    assert run_main(tmp_path, 'stats').returncode == 1
+    assert run_main(tmp_path, 'research').returncode == 0
+    assert (tmp_path / 'metrics.json').exists()
+
+    stats = run_main(tmp_path, 'stats', 'json')
+    assert stats.returncode == 0
+    assert 'counters' in json.loads(stats.stdout)
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import research_crew
+import research_pipeline
+import research_tasks
+
+def make_task(lead_id, company_name='Acme', website='https://acme.example'):
+    return {'lead_id': lead_id, 'company_name': company_name, 'website': website, 'contacts_status': 'pending'}
+
+def test_failed_contact_search_is_not_shared_with_the_retry(monkeypatch):
+    calls = []
+
+    def lookup_contacts(company_name, website=None):
+        calls.append(company_name)
+        if len(calls) == 1:
+            raise RuntimeError('Apollo is down')
+        return [{'name': 'Ann'}]
+
+    claims = iter([[make_task(1)], [make_task(1)]])
+    monkeypatch.setattr(research_tasks, 'claim', lambda owner, limit: next(claims))
+    monkeypatch.setattr(research_crew, 'lookup_contacts', lookup_contacts)
+
+    async def scenario():
+        contact_tasks = {}
+        first = await produce(contact_tasks)
+        try:
+            await first['contacts_task']
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('the first search should fail')
+        retry = await produce(contact_tasks)
+        return first, retry, await retry['contacts_task']
+
+    async def produce(contact_tasks):
+        scrape_queue = asyncio.Queue()
+        await research_pipeline._produce('worker', scrape_queue, asyncio.Semaphore(1), contact_tasks, 1, budget=1)
+        job = scrape_queue.get_nowait()
+        assert scrape_queue.get_nowait() is None
+        return job
+
+    first, retry, contacts = asyncio.run(scenario())
+    assert retry['contacts_task'] is not first['contacts_task']
+    assert contacts == [{'name': 'Ann'}]
+    assert len(calls) == 2
+
+def test_running_and_successful_searches_are_shared(monkeypatch):
+    calls = []
+
+    def lookup_contacts(company_name, website=None):
+        calls.append(company_name)
+        return [{'name': 'Ann'}]
+
+    monkeypatch.setattr(research_tasks, 'claim', lambda owner, limit: [make_task(1), make_task(2)][:limit])
+    monkeypatch.setattr(research_crew, 'lookup_contacts', lookup_contacts)
+
+    async def scenario():
+        scrape_queue = asyncio.Queue()
+        contact_tasks = {}
+        await research_pipeline._produce('worker', scrape_queue, asyncio.Semaphore(1), contact_tasks, 2, budget=2)
+        first, second = scrape_queue.get_nowait(), scrape_queue.get_nowait()
+        assert first['contacts_task'] is second['contacts_task']
+        await first['contacts_task']
+        assert list(contact_tasks.values()) == [first['contacts_task']]
+
+    asyncio.run(scenario())
+    assert calls == ['Acme']
+
+def test_extraction_is_saved_with_the_prompt_version_that_made_it(database):
+    lead_id = database.execute('INSERT INTO leads (company_name, website, status) VALUES (?, ?, ?)',
+                               ('Acme', 'https://acme.example', 'new')).lastrowid
+    database.commit()
+    research_tasks.enqueue_new_leads()
+    task = research_tasks.claim('worker', 1)[0]
+    task.update(scrape_status='done', contacts_status='done', page_hash='abc')
+    job = {'task': task, 'lead_id': lead_id, 'failures': {}, 'contacts_task': None}
+
+    results = {}
+    asyncio.run(research_pipeline._finish_job(job, ({'Industry': 'Tools'}, 'batch-version'), results))
+    assert 'error' not in results[lead_id]
+    assert research_tasks.load_extraction(lead_id) == ({'Industry': 'Tools'}, 'batch-version')
+    assert database.execute('SELECT extract_version FROM research_tasks WHERE lead_id = ?',
+                            (lead_id,)).fetchone()[0] == f'{research_crew.GROQ_MODEL}:batch-version'
@@ -0,0 +1,90 @@
+import time
+
+import lead_store
+import research_tasks
+import scoring
+
+def add_lead(conn, company_name='Acme', website=None, status='new', score=0.5):
+    website = website or f'https://{company_name.lower()}.example'
+    lead_id = conn.execute('INSERT INTO leads (company_name, website, status, score) VALUES (?, ?, ?, ?)',
+                           (company_name, website, status, score)).lastrowid
+    scoring.rescore(conn, [lead_id])
+    conn.commit()
+    return lead_id
+
+def task_row(conn, lead_id, columns='state, scrape_status, extract_status, contacts_status'):
+    return conn.execute(f'SELECT {columns} FROM research_tasks WHERE lead_id = ?', (lead_id,)).fetchone()
+
+def test_claim_leases_each_task_to_one_worker(database):
+    first, second = add_lead(database, score=0.2), add_lead(database, 'Beta', score=0.9)
+    assert research_tasks.enqueue_new_leads() == 2
+    assert research_tasks.enqueue_new_leads() == 0
+
+    claimed = research_tasks.claim('worker-a', 1)
+    # Highest priority first
+    assert [task['lead_id'] for task in claimed] == [second]
+    assert [task['lead_id'] for task in research_tasks.claim('worker-b', 5)] == [first]
+    assert research_tasks.claim('worker-c', 5) == []
+    assert task_row(database, second, 'state, lease_owner') == ('running', 'worker-a')
+
+def test_expired_lease_is_claimed_again(database, monkeypatch):
+    lead_id = add_lead(database)
+    research_tasks.enqueue_new_leads()
+    monkeypatch.setattr(research_tasks, 'LEASE_SECONDS', -1)
+    task = research_tasks.claim('worker-a', 1)[0]
+    assert [t['lead_id'] for t in research_tasks.claim('worker-b', 1)] == [lead_id]
+    # The first worker lost its lease, so its results aren't stored
+    assert research_tasks.finish(task, {}, {'industry': 'Tools'}) == 'lost'
+    assert task_row(database, lead_id, 'lease_owner')[0] == 'worker-b'
+
+def test_finish_waits_for_queued_stage_writes(database):
+    lead_id = add_lead(database)
+    research_tasks.enqueue_new_leads()
+    task = research_tasks.claim('worker', 1)[0]
+    research_tasks.save_scraped_text(task, 'Acme makes anvils.')
+    research_tasks.save_extraction(task, {'industry': 'Tools'}, 'model', 'v1')
+    research_tasks.save_contacts(task, [{'name': 'Ann', 'email': 'ann@acme.example'}])
+
+    info = {'industry': 'Tools', 'website': task['website'], 'contacts': [{'name': 'Ann'}]}
+    assert research_tasks.finish(task, {}, info, 'model', 'v1') == 'done'
+    # No flush: finish() itself waited for the stage writes
+    assert task_row(database, lead_id) == ('done', 'done', 'done', 'done')
+    assert research_tasks.load_extraction(lead_id) == ({'industry': 'Tools'}, 'v1')
+
+def test_dropped_stage_write_fails_the_stage(database, monkeypatch):
+    lead_id = add_lead(database)
+    research_tasks.enqueue_new_leads()
+    task = research_tasks.claim('worker', 1)[0]
+    research_tasks.save_scraped_text(task, 'Acme makes anvils.')
+    # Rows with a column missing make the queued contacts write fail
+    monkeypatch.setattr(lead_store, 'contact_rows', lambda lead_id, contacts: [(lead_id, 'Ann')])
+    research_tasks.save_contacts(task, [{'name': 'Ann'}])
+
+    failures = {}
+    assert research_tasks.finish(task, failures, {'industry': 'Tools'}) == 'pending'
+    assert list(failures) == ['contacts']
+    # Neither the contacts nor their done mark were committed
+    assert task_row(database, lead_id) == ('pending', 'done', 'pending', 'failed')
+    assert database.execute('SELECT COUNT(*) FROM lead_contacts WHERE lead_id = ?', (lead_id,)).fetchone()[0] == 0
+    assert task_row(database, lead_id, 'enriched_at')[0] is None
+    assert task_row(database, lead_id, 'retry_at')[0] > time.time()
+
+def test_duplicate_lead_is_not_claimed(database):
+    lead_id = add_lead(database)
+    research_tasks.enqueue_new_leads()
+    database.execute("UPDATE leads SET status = 'duplicate', canonical_id = 1 WHERE id = ?", (lead_id,))
+    database.commit()
+    assert not research_tasks.has_claimable()
+    assert research_tasks.claim('worker', 5) == []
+
+def test_restart_tasks_only_restarts_new_leads(database):
+    renamed, researched, duplicate = add_lead(database), add_lead(database, 'Beta'), add_lead(database, 'Gamma')
+    research_tasks.enqueue_new_leads()
+    database.execute("UPDATE research_tasks SET state = 'done', scrape_status = 'done'")
+    database.execute("UPDATE leads SET status = 'researched' WHERE id = ?", (researched,))
+    database.execute("UPDATE leads SET status = 'duplicate' WHERE id = ?", (duplicate,))
+    research_tasks.restart_tasks(database, [renamed, researched, duplicate])
+    database.commit()
+    assert task_row(database, renamed, 'state, scrape_status') == ('pending', 'pending')
+    assert task_row(database, researched, 'state, scrape_status') == ('done', 'done')
+    assert task_row(database, duplicate, 'state, scrape_status') == ('done', 'done')
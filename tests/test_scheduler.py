@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+import pytest
+
+import scheduler
+
+@pytest.fixture(autouse=True)
+def fresh_scheduler(monkeypatch):
+    monkeypatch.setattr(scheduler, '_host_buckets', OrderedDict())
+    monkeypatch.setattr(scheduler, '_breakers', OrderedDict())
+    monkeypatch.setattr(scheduler, 'BACKOFF_BASE', 0)
+    monkeypatch.setattr(scheduler, 'HOST_DELAY', 0)
+
+def failing(*errors):
+    # A function that raises each error in turn, then returns 'ok'
+    errors = list(errors)
+
+    def call():
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+    return call
+
+def test_transient_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(scheduler, 'MAX_RETRIES', 2)
+    assert scheduler.call('test', failing(TimeoutError(), scheduler.TransientHTTPError('busy', 503))) == 'ok'
+    with pytest.raises(TimeoutError):
+        scheduler.call('test', failing(TimeoutError(), TimeoutError(), TimeoutError()))
+
+def test_other_errors_are_not_retried():
+    with pytest.raises(ValueError):
+        scheduler.call('test', failing(ValueError('bad request'), ValueError('bad request')))
+
+def test_breaker_opens_after_repeated_failures_and_half_opens(monkeypatch):
+    monkeypatch.setattr(scheduler, 'MAX_RETRIES', 0)
+    breaker = scheduler._breakers['down.example'] = scheduler.CircuitBreaker(threshold=2, cooldown=60)
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            scheduler.call('scrape', failing(TimeoutError()), host='down.example')
+    with pytest.raises(scheduler.CircuitOpenError):
+        scheduler.call('scrape', failing(), host='down.example')
+
+    # After the cooldown one request may try again, and a success closes it
+    breaker.opened_at -= 60
+    assert scheduler.call('scrape', failing(), host='down.example') == 'ok'
+    assert breaker.idle()
+
+def test_breakers_keep_only_recent_or_failing_hosts(monkeypatch):
+    monkeypatch.setattr(scheduler, 'MAX_HOSTS', 3)
+    scheduler._breaker('open.example').opened_at = 0
+    for i in range(10):
+        scheduler.call('scrape', failing(), host=f'site{i}.example')
+
+    # Closed breakers are dropped least recently used first; the open one is kept
+    assert list(scheduler._breakers) == ['open.example', 'site8.example', 'site9.example']
+    assert scheduler._breakers['open.example'].opened_at == 0
+
+def test_host_buckets_keep_only_recent_or_refilling_hosts(monkeypatch):
+    monkeypatch.setattr(scheduler, 'MAX_HOSTS', 3)
+    monkeypatch.setattr(scheduler, 'HOST_DELAY', 60)
+    scheduler._host_bucket('busy.example').acquire()
+    for i in range(10):
+        scheduler._host_bucket(f'site{i}.example')
+
+    assert list(scheduler._host_buckets) == ['busy.example', 'site8.example', 'site9.example']
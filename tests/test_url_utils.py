@@ -0,0 +1,39 @@
+import sqlite3
+
+import pytest
+
+import lead_agent
+from url_utils import canonicalize_url
+
+@pytest.mark.parametrize('url, expected', [
+    ('example.com', 'https://example.com/'),
+    ('HTTP://Example.COM.:80/About/?utm_source=x&id=7#team', 'http://example.com/About?id=7'),
+    ('https://example.com:443/a/b/', 'https://example.com/a/b'),
+    ('example.com:8080', 'https://example.com:8080/'),
+    ('example.com:', 'https://example.com/'),
+    ('example.com?q=1', 'https://example.com/?q=1'),
+    ('localhost:3000/x', 'https://localhost:3000/x'),
+    ('example.com:abc', None),
+    ('example.com:8080x', None),
+    ('example.com:99999', None),
+    ('ftp://example.com/', None),
+    ('not a url', None),
+    ('intranet', None),
+])
+def test_canonicalize_url(url, expected):
+    assert canonicalize_url(url) == expected
+
+def test_bulk_import_stores_one_row_per_canonical_url(database, tmp_path):
+    seeds = tmp_path / 'seeds.txt'
+    seeds.write_text('\n'.join(['example.com', 'https://EXAMPLE.com/', 'http://example.com:80/#top',
+                                'https://example.com/?utm_source=mail', 'example.com:abc', 'example.com:8080x',
+                                'example.com:8080', '']))
+    counts = lead_agent.bulk_add_urls(str(seeds))
+    assert counts == {'inserted': 3, 'duplicate': 2, 'invalid': 2}
+
+    lead_agent.add_seed_url('https://example.com')
+    rows = database.execute('SELECT url FROM seed_urls ORDER BY url').fetchall()
+    assert rows == [('http://example.com/',), ('https://example.com/',), ('https://example.com:8080/',)]
+    # The unique index backs this up for writers that skip canonicalization
+    with pytest.raises(sqlite3.IntegrityError):
+        database.execute('INSERT INTO seed_urls (url) VALUES (?)', ('https://example.com/',))
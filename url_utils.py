@@ -0,0 +1,62 @@
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def normalize_url(url):
+    # Lowercase scheme and host, drop default ports and fragments and give
+    # bare domains a "/" path so equivalent spellings share one key
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or 'http').lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path or '/'
+    return urlunsplit((scheme, host, path, parts.query, ''))
+
+# Query parameters that only identify a campaign or click, not a page
+TRACKING_PARAMS = {'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid',
+                   '_ga', '_gl', 'igshid', 'ref', 'ref_src', 'spm'}
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name.startswith('utm_') or name in TRACKING_PARAMS
+
+# scheme (optional), host, port, path, query; fragments are matched and dropped.
+# The path must start with "/", so nothing but digits can follow the ":".
+URL_PATTERN = re.compile(r'(?:([A-Za-z][A-Za-z0-9+.-]*):)?//([^/?#:@\s]+)(?::(\d*))?(/[^?#\s]*)?(?:\?([^#\s]*))?(?:#\S*)?')
+
+def canonicalize_url(url):
+    # Returns the canonical form of a seed URL, or None if it isn't a usable
+    # http(s) URL. Bare domains are assumed to be https. A regex is used rather
+    # than urlsplit because bulk imports run this over millions of lines.
+    url = url.strip()
+    if '//' not in url:
+        url = f'//{url}'
+    match = URL_PATTERN.fullmatch(url)
+    if match is None:
+        return None
+
+    scheme, host, port, path, query = match.groups()
+    scheme = (scheme or 'https').lower()
+    host = host.lower().rstrip('.')
+    if scheme not in DEFAULT_PORTS or not host or ('.' not in host and host != 'localhost'):
+        return None
+    if port:
+        port = int(port)
+        if port > 65535:
+            return None
+        if port != DEFAULT_PORTS[scheme]:
+            host = f"{host}:{port}"
+
+    if path and len(path) > 1:
+        path = path.rstrip('/') or '/'
+    else:
+        path = '/'
+
+    if query:
+        query = '&'.join(pair for pair in query.split('&')
+                         if pair and not is_tracking_param(pair.split('=', 1)[0]))
+        if query:
+            return f"{scheme}://{host}{path}?{query}"
+    return f"{scheme}://{host}{path}"